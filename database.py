@@ -112,6 +112,21 @@ class GroupFeature(Base):
     document = relationship("GroupDocument", back_populates="features")
     creator = relationship("User", foreign_keys=[created_by])
 
+# Document Q&A ingestion jobs
+class IngestionJob(Base):
+    __tablename__ = "ingestion_jobs"
+
+    id = Column(String, primary_key=True, index=True)
+    filename = Column(String, nullable=False, index=True)
+    file_path = Column(String, nullable=False)
+    namespace = Column(String, default="public", nullable=False)
+    content_hash = Column(String, index=True)
+    status = Column(String, default="queued", nullable=False)  # queued, extracting, chunking, embedding, indexing, completed, failed
+    error = Column(Text)
+    chunk_count = Column(Integer, default=0)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
 # Create all tables
 try:
     Base.metadata.create_all(bind=engine)
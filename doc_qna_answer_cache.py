@@ -0,0 +1,115 @@
+import os
+import re
+import time
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+import numpy as np
+
+# Cosine similarity above which a past question counts as the same question
+ANSWER_CACHE_THRESHOLD = float(os.getenv("DOC_QNA_ANSWER_CACHE_THRESHOLD", "0.92"))
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("DOC_QNA_ANSWER_CACHE_MAX_ENTRIES", "256"))
+ANSWER_CACHE_TTL_SECONDS = int(os.getenv("DOC_QNA_ANSWER_CACHE_TTL_SECONDS", str(24 * 3600)))
+# Every distinct source filter gets its own namespace; the least recently used ones are dropped past this
+ANSWER_CACHE_MAX_NAMESPACES = int(os.getenv("DOC_QNA_ANSWER_CACHE_MAX_NAMESPACES", "64"))
+
+# Send "X-Answer-Cache: bypass" to skip the cache; responses report hit, miss or bypass
+ANSWER_CACHE_HEADER = "X-Answer-Cache"
+
+# namespace -> {"version": int, "vectors": np.ndarray, "entries": [{"query", "answer", "created"}]}, least recently used first
+_answer_caches: "OrderedDict[str, Dict]" = OrderedDict()
+_answer_cache_lock = threading.Lock()
+# Newest corpus version seen; every cached namespace was built at it
+_latest_version = 0
+
+answer_cache_stats = {"hits": 0, "misses": 0, "bypassed": 0, "stored": 0, "invalidations": 0}
+
+
+def normalize_query(query: str) -> str:
+    """Lowercase and strip punctuation so trivially different phrasings embed alike"""
+    query = re.sub(r"[^\w\s]", " ", query.lower())
+    return re.sub(r"\s+", " ", query).strip()
+
+
+def _unit_vector(embedding: List[float]) -> np.ndarray:
+    vector = np.asarray(embedding, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+def _namespace_cache(namespace: str, corpus_version: int) -> Optional[Dict]:
+    """Return the cache for a namespace, or None for a version the corpus has already moved past"""
+    global _latest_version
+    if corpus_version < _latest_version:
+        # Captured before an ingestion finished; its answer may miss the new chunks
+        return None
+    if corpus_version > _latest_version:
+        # Caches built before the corpus changed can never hit again
+        answer_cache_stats["invalidations"] += len(_answer_caches)
+        _answer_caches.clear()
+        _latest_version = corpus_version
+
+    cache = _answer_caches.pop(namespace, None)
+    if cache is None:
+        cache = {"version": corpus_version, "vectors": None, "entries": []}
+    _answer_caches[namespace] = cache
+    while len(_answer_caches) > ANSWER_CACHE_MAX_NAMESPACES:
+        _answer_caches.popitem(last=False)
+    return cache
+
+
+def lookup_answer(namespace: str, corpus_version: int, embedding: List[float]) -> Optional[str]:
+    """Return a cached answer for a sufficiently similar past query"""
+    query_vector = _unit_vector(embedding)
+    now = time.time()
+
+    with _answer_cache_lock:
+        cache = _namespace_cache(namespace, corpus_version)
+        if cache is not None and cache["vectors"] is not None and len(cache["entries"]):
+            similarities = cache["vectors"] @ query_vector
+            best = int(np.argmax(similarities))
+            entry = cache["entries"][best]
+            if similarities[best] >= ANSWER_CACHE_THRESHOLD and now - entry["created"] <= ANSWER_CACHE_TTL_SECONDS:
+                answer_cache_stats["hits"] += 1
+                return entry["answer"]
+
+        answer_cache_stats["misses"] += 1
+        return None
+
+
+def store_answer(namespace: str, corpus_version: int, query: str, embedding: List[float], answer: str):
+    """Remember an answer for later similar queries"""
+    query_vector = _unit_vector(embedding)[np.newaxis, :]
+
+    with _answer_cache_lock:
+        cache = _namespace_cache(namespace, corpus_version)
+        if cache is None:
+            return
+        cache["entries"].append({"query": query, "answer": answer, "created": time.time()})
+        cache["vectors"] = query_vector if cache["vectors"] is None else np.vstack([cache["vectors"], query_vector])
+
+        # Drop the oldest entries once the namespace is full
+        overflow = len(cache["entries"]) - ANSWER_CACHE_MAX_ENTRIES
+        if overflow > 0:
+            cache["entries"] = cache["entries"][overflow:]
+            cache["vectors"] = cache["vectors"][overflow:]
+
+        answer_cache_stats["stored"] += 1
+
+
+def record_bypass():
+    with _answer_cache_lock:
+        answer_cache_stats["bypassed"] += 1
+
+
+def get_answer_cache_stats() -> Dict:
+    """Hit-rate metrics for the answer cache"""
+    with _answer_cache_lock:
+        lookups = answer_cache_stats["hits"] + answer_cache_stats["misses"]
+        return {
+            **answer_cache_stats,
+            "hit_rate": round(answer_cache_stats["hits"] / lookups, 4) if lookups else 0.0,
+            "namespaces": len(_answer_caches),
+            "entries": sum(len(cache["entries"]) for cache in _answer_caches.values()),
+        }
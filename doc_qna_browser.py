@@ -0,0 +1,188 @@
+import os
+import time
+import asyncio
+import threading
+import concurrent.futures
+
+from bs4 import BeautifulSoup
+
+# Long-lived headless Chromium shared by every JS-rendered extraction
+BROWSER_COUNT = int(os.getenv("DOC_QNA_BROWSER_COUNT", "1"))
+BROWSER_MAX_PAGES = int(os.getenv("DOC_QNA_BROWSER_MAX_PAGES", "4"))
+# A context is thrown away after this many pages so cookies and memory don't pile up
+BROWSER_CONTEXT_MAX_USES = int(os.getenv("DOC_QNA_BROWSER_CONTEXT_MAX_USES", "20"))
+BROWSER_PAGE_TIMEOUT_SECONDS = float(os.getenv("DOC_QNA_BROWSER_PAGE_TIMEOUT_SECONDS", "30"))
+
+BLOCKED_RESOURCE_TYPES = {"image", "font", "media"}
+
+_browser_pool = None
+_browser_pool_lock = threading.Lock()
+
+
+class BrowserPool:
+    """Headless browsers on a dedicated event loop, handing out recycled contexts to a bounded number of pages"""
+
+    def __init__(self, browsers: int = BROWSER_COUNT, max_pages: int = BROWSER_MAX_PAGES,
+                 context_max_uses: int = BROWSER_CONTEXT_MAX_USES):
+        self.browser_count = browsers
+        self.max_pages = max_pages
+        self.context_max_uses = context_max_uses
+        self.stats = {"pages": 0, "contexts_created": 0, "blocked_requests": 0}
+
+        # Playwright objects belong to the loop that created them, so all browser work runs on this one
+        self.loop = asyncio.new_event_loop()
+        threading.Thread(target=self.loop.run_forever, daemon=True).start()
+        self._run(self._start()).result()
+        print(f"✅ Browser pool started with {browsers} browsers and {max_pages} concurrent pages")
+
+    def _run(self, coro) -> concurrent.futures.Future:
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    async def _start(self):
+        from playwright.async_api import async_playwright
+
+        self.playwright = await async_playwright().start()
+        self.browsers = [await self.playwright.chromium.launch() for _ in range(self.browser_count)]
+        self.page_slots = asyncio.Semaphore(self.max_pages)
+        self.idle_contexts = []  # [(context, uses)]
+        self.next_browser = 0
+
+    async def _new_context(self):
+        browser = self.browsers[self.next_browser % len(self.browsers)]
+        self.next_browser += 1
+        context = await browser.new_context()
+
+        async def block_heavy_resources(route):
+            # Text extraction never needs images, fonts or media
+            if route.request.resource_type in BLOCKED_RESOURCE_TYPES:
+                self.stats["blocked_requests"] += 1
+                await route.abort()
+            else:
+                await route.continue_()
+
+        await context.route("**/*", block_heavy_resources)
+        self.stats["contexts_created"] += 1
+        return context
+
+    async def _render(self, url: str, timeout: float) -> str:
+        async with self.page_slots:
+            if self.idle_contexts:
+                context, uses = self.idle_contexts.pop()
+            else:
+                context, uses = await self._new_context(), 0
+
+            try:
+                page = await context.new_page()
+                try:
+                    await page.goto(url, timeout=timeout * 1000, wait_until="networkidle")
+                    return await page.content()
+                finally:
+                    await page.close()
+            finally:
+                # Cookies and storage from earlier pages stay in the context until it is recycled
+                uses += 1
+                if uses >= self.context_max_uses:
+                    await context.close()
+                else:
+                    self.idle_contexts.append((context, uses))
+                self.stats["pages"] += 1
+
+    def render(self, url: str, timeout: float = BROWSER_PAGE_TIMEOUT_SECONDS) -> str:
+        """Rendered HTML of a page, for callers outside the event loop"""
+        return self._run(self._render(url, timeout)).result()
+
+    async def arender(self, url: str, timeout: float = BROWSER_PAGE_TIMEOUT_SECONDS) -> str:
+        """Rendered HTML of a page, awaitable from any event loop"""
+        return await asyncio.wrap_future(self._run(self._render(url, timeout)))
+
+    async def _close(self):
+        for context, _ in self.idle_contexts:
+            await context.close()
+        for browser in self.browsers:
+            await browser.close()
+        await self.playwright.stop()
+
+    def close(self):
+        self._run(self._close()).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+
+def get_browser_pool() -> BrowserPool:
+    """Start the shared browser pool on first use"""
+    global _browser_pool
+
+    with _browser_pool_lock:
+        if _browser_pool is None:
+            _browser_pool = BrowserPool()
+        return _browser_pool
+
+
+def rendered_page_text(html: str) -> str:
+    return BeautifulSoup(html, "html.parser").get_text(strip=True)
+
+
+async def arender_text(url: str) -> str:
+    """Text of a JS-rendered page through the shared browser pool"""
+    html = await get_browser_pool().arender(url)
+    return rendered_page_text(html)
+
+
+def benchmark_browser_pool(num_pages: int = 20):
+    """Compare launching Chromium per page with the pooled browser against a local static site"""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    from playwright.sync_api import sync_playwright
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = (
+                "<html><body><img src='/photo.jpg'><div id='app'></div>"
+                "<script>document.getElementById('app').innerText = 'Rendered ' + location.pathname;</script>"
+                "</body></html>"
+            ).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    urls = [f"http://127.0.0.1:{server.server_address[1]}/page/{i}" for i in range(num_pages)]
+
+    def launch_per_page(url):
+        with sync_playwright() as p:
+            browser = p.chromium.launch()
+            page = browser.new_page()
+            page.goto(url)
+            content = page.content()
+            browser.close()
+            return content
+
+    try:
+        start = time.perf_counter()
+        for url in urls:
+            launch_per_page(url)
+        per_page = time.perf_counter() - start
+
+        pool = BrowserPool()
+        try:
+            pool.render(urls[0])
+            start = time.perf_counter()
+            with concurrent.futures.ThreadPoolExecutor(max_workers=pool.max_pages) as executor:
+                texts = list(executor.map(lambda url: rendered_page_text(pool.render(url)), urls))
+            pooled = time.perf_counter() - start
+        finally:
+            pool.close()
+
+        print(f"launch per page: {num_pages / per_page:6.1f} pages/sec")
+        print(f"   browser pool: {num_pages / pooled:6.1f} pages/sec ({pool.stats})")
+        print(f"Sample: {texts[0]}")
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    benchmark_browser_pool()
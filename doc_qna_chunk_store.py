@@ -0,0 +1,482 @@
+import os
+import gc
+import json
+import time
+import shutil
+import threading
+import tracemalloc
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+from langchain.schema import Document
+from langchain_community.docstore.base import AddableMixin, Docstore
+
+# Chunks of the dense index live next to it, one .npy file per column
+CHUNK_STORE_DIR = "chunks"
+# Dead text is dropped from the blob once it is this share of it
+COMPACT_DEAD_FRACTION = 0.5
+
+# Metadata with a column of its own; anything else is kept as interned JSON
+INT_COLUMNS = ("page", "chunk", "tokens")
+STRING_COLUMNS = ("source", "namespace")
+MISSING = -1
+
+
+class ChunkStore:
+    """Chunk texts in one UTF-8 blob plus numpy metadata columns, addressed by integer id
+
+    Ids are the dense index ids, so a row never moves; deleted rows keep their id and lose their text
+    on compaction. Repeated strings (sources, namespaces, other metadata) are stored once and referred
+    to by code.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.blob = np.zeros(0, dtype=np.uint8)
+        self.blob_size = 0
+        self.offsets = np.zeros(1, dtype=np.int64)
+        self.live = np.zeros(0, dtype=bool)
+        self.timestamp = np.zeros(0, dtype=np.float64)
+        self.columns = {name: np.zeros(0, dtype=np.int32) for name in (*INT_COLUMNS, *STRING_COLUMNS, "extra")}
+        # Chunks kept once for several sources (near-duplicate uploads): owners besides the source column
+        self.shared_ids = np.zeros(0, dtype=np.int64)
+        self.shared_sources = np.zeros(0, dtype=np.int32)
+        self.strings: List[str] = []
+        self.codes: Dict[str, int] = {}
+        self.read_only = False
+
+    # -- writing --
+
+    def _intern(self, value: Optional[str]) -> int:
+        if value is None:
+            return MISSING
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.strings)
+            self.strings.append(value)
+        return code
+
+    @staticmethod
+    def _grow(array: np.ndarray, size: int, fill=0) -> np.ndarray:
+        """Array with room for size items, doubling capacity so appends stay amortized O(1)"""
+        if len(array) >= size and array.flags.writeable:
+            return array
+        grown = np.full(max(size, 2 * len(array), 16), fill, dtype=array.dtype)
+        grown[:len(array)] = array
+        return grown
+
+    def _reserve(self, rows: int, text_bytes: int):
+        if self.read_only:
+            raise ValueError("Chunk store was opened read-only")
+        self.blob = self._grow(self.blob, self.blob_size + text_bytes)
+        self.offsets = self._grow(self.offsets, rows + 1)
+        self.live = self._grow(self.live, rows, False)
+        self.timestamp = self._grow(self.timestamp, rows, np.nan)
+        for name, column in self.columns.items():
+            self.columns[name] = self._grow(column, rows, MISSING)
+
+    def add(self, ids: Iterable[int], texts: Iterable[str], metadatas: Iterable[Dict]):
+        """Store chunks under ids at or past the end of the store; skipped ids become empty dead rows"""
+        items = [(int(chunk_id), text.encode("utf-8"), dict(metadata or {}))
+                 for chunk_id, text, metadata in zip(ids, texts, metadatas)]
+        if not items:
+            return
+        items.sort(key=lambda item: item[0])
+        if items[0][0] < self.count:
+            raise ValueError(f"Chunk id {items[0][0]} is already in use")
+
+        self._reserve(items[-1][0] + 1, sum(len(data) for _, data, _ in items))
+        for chunk_id, data, metadata in items:
+            # Rows between the previous id and this one are gaps: empty text, not live
+            self.offsets[self.count + 1:chunk_id + 1] = self.blob_size
+            self.blob[self.blob_size:self.blob_size + len(data)] = np.frombuffer(data, dtype=np.uint8)
+            self.blob_size += len(data)
+            self.offsets[chunk_id + 1] = self.blob_size
+
+            self.live[chunk_id] = True
+            timestamp = metadata.pop("timestamp", None)
+            self.timestamp[chunk_id] = np.nan if timestamp is None else timestamp
+            for name in INT_COLUMNS:
+                # Values that aren't small ints stay with the JSON metadata
+                value = metadata.get(name)
+                if type(value) is int and 0 <= value < 2**31:
+                    self.columns[name][chunk_id] = metadata.pop(name)
+            for name in STRING_COLUMNS:
+                self.columns[name][chunk_id] = self._intern(metadata.pop(name, None))
+            self.columns["extra"][chunk_id] = self._intern(json.dumps(metadata, sort_keys=True) if metadata else None)
+            self.count = chunk_id + 1
+
+    def delete(self, ids: Iterable[int]):
+        if self.read_only:
+            raise ValueError("Chunk store was opened read-only")
+        ids = np.fromiter((int(chunk_id) for chunk_id in ids), dtype=np.int64)
+        ids = ids[(ids >= 0) & (ids < self.count)]
+        self.live = self._grow(self.live, len(self.live))
+        self.live[ids] = False
+        shared = np.isin(self.shared_ids, ids)
+        self.shared_ids, self.shared_sources = self.shared_ids[~shared], self.shared_sources[~shared]
+        if self.dead_bytes() > COMPACT_DEAD_FRACTION * self.blob_size:
+            self.compact()
+
+    def add_owners(self, ids: Iterable[int], source: str) -> int:
+        """Let another source own live chunks too, instead of indexing its near-duplicates of them again"""
+        if self.read_only:
+            raise ValueError("Chunk store was opened read-only")
+        code = self._intern(source)
+        ids = np.unique(np.fromiter((int(chunk_id) for chunk_id in ids if chunk_id in self), dtype=np.int64))
+        ids = ids[(self.columns["source"][ids] != code) & ~np.isin(ids, self.shared_ids[self.shared_sources == code])]
+        self.shared_ids = np.concatenate([self.shared_ids, ids])
+        self.shared_sources = np.concatenate([self.shared_sources, np.full(len(ids), code, dtype=np.int32)])
+        return len(ids)
+
+    def release_sources(self, sources: Iterable[str]) -> np.ndarray:
+        """Drop sources as owners and return the ids of their chunks that no other source owns
+
+        A chunk whose source column names a released source passes to its first remaining owner.
+        """
+        if self.read_only:
+            raise ValueError("Chunk store was opened read-only")
+        codes = [self.codes[source] for source in sources if source in self.codes]
+        if not codes:
+            return np.zeros(0, dtype=np.int64)
+        owned = self.ids_for_sources(sources)
+
+        released = np.isin(self.shared_sources, codes)
+        self.shared_ids, self.shared_sources = self.shared_ids[~released], self.shared_sources[~released]
+
+        primary = owned[np.isin(self.columns["source"][owned], codes)]
+        inherited = np.isin(primary, self.shared_ids)
+        if inherited.any():
+            heirs = {}
+            for position in np.flatnonzero(np.isin(self.shared_ids, primary)).tolist():
+                heirs.setdefault(int(self.shared_ids[position]), position)
+            positions = np.fromiter(heirs.values(), dtype=np.int64, count=len(heirs))
+            self.columns["source"] = self._grow(self.columns["source"], len(self.columns["source"]))
+            self.columns["source"][self.shared_ids[positions]] = self.shared_sources[positions]
+            kept = np.ones(len(self.shared_ids), dtype=bool)
+            kept[positions] = False
+            self.shared_ids, self.shared_sources = self.shared_ids[kept], self.shared_sources[kept]
+        return primary[~inherited]
+
+    def dead_bytes(self) -> int:
+        lengths = np.diff(self.offsets[:self.count + 1])
+        return int(lengths[~self.live[:self.count]].sum())
+
+    def compact(self):
+        """Rewrite the blob without the text of deleted rows; ids don't change"""
+        lengths = np.diff(self.offsets[:self.count + 1])
+        lengths[~self.live[:self.count]] = 0
+        offsets = np.zeros(self.count + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+
+        keep = np.repeat(self.live[:self.count], np.diff(self.offsets[:self.count + 1]))
+        self.blob = self.blob[:self.blob_size][keep]
+        self.blob_size = len(self.blob)
+        self.offsets = offsets
+
+    # -- reading --
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __contains__(self, chunk_id) -> bool:
+        return 0 <= chunk_id < self.count and bool(self.live[chunk_id])
+
+    def live_ids(self) -> np.ndarray:
+        return np.flatnonzero(self.live[:self.count])
+
+    def live_count(self, sourced: bool = False) -> int:
+        """Live chunks; with sourced, only those that belong to a source (not the placeholder)"""
+        live = self.live[:self.count]
+        if sourced:
+            live = live & (self.columns["source"][:self.count] != MISSING)
+        return int(np.count_nonzero(live))
+
+    def text(self, chunk_id: int) -> str:
+        return self.blob[self.offsets[chunk_id]:self.offsets[chunk_id + 1]].tobytes().decode("utf-8")
+
+    def iter_texts(self) -> Iterator[str]:
+        """Text of every row in id order; deleted rows are empty"""
+        for chunk_id in range(self.count):
+            yield self.text(chunk_id) if self.live[chunk_id] else ""
+
+    def metadata(self, chunk_id: int) -> Dict:
+        extra = self.columns["extra"][chunk_id]
+        metadata = json.loads(self.strings[extra]) if extra != MISSING else {}
+        for name in STRING_COLUMNS:
+            code = self.columns[name][chunk_id]
+            if code != MISSING:
+                metadata[name] = self.strings[code]
+        for name in INT_COLUMNS:
+            value = self.columns[name][chunk_id]
+            if value != MISSING:
+                metadata[name] = int(value)
+        if not np.isnan(self.timestamp[chunk_id]):
+            metadata["timestamp"] = float(self.timestamp[chunk_id])
+        return metadata
+
+    def document(self, chunk_id: int) -> Document:
+        """A Document built on demand; nothing holds on to it after the caller is done"""
+        return Document(page_content=self.text(chunk_id), metadata=self.metadata(chunk_id))
+
+    def iter_documents(self) -> Iterator[Tuple[int, Document]]:
+        for chunk_id in self.live_ids().tolist():
+            yield chunk_id, self.document(chunk_id)
+
+    def sources(self) -> List[str]:
+        """Distinct sources of the live chunks, including those that only share chunks"""
+        live = self.live[:self.count]
+        codes = np.unique(np.concatenate([
+            self.columns["source"][:self.count][live], self.shared_sources[live[self.shared_ids]]
+        ]))
+        return [self.strings[code] for code in codes.tolist() if code != MISSING]
+
+    def source_stats(self) -> Dict[str, Dict]:
+        """Per source, from the columns alone: live chunks, their text bytes, earliest timestamp and namespace
+
+        Shared chunks count for every owner. "first" is the first chunk naming the source in its source
+        column, for metadata kept per source; it is None for a source that only shares chunks.
+        """
+        live_ids = self.live_ids()
+        shared = self.live[self.shared_ids]
+        ids = np.concatenate([live_ids, self.shared_ids[shared]])
+        codes = np.concatenate([self.columns["source"][live_ids], self.shared_sources[shared]])
+        ids, codes = ids[codes != MISSING], codes[codes != MISSING]
+        if not len(ids):
+            return {}
+
+        order = np.argsort(codes, kind="stable")
+        ids, codes = ids[order], codes[order]
+        unique, starts, counts = np.unique(codes, return_index=True, return_counts=True)
+        lengths = np.diff(self.offsets[:self.count + 1])
+        text_bytes = np.add.reduceat(lengths[ids], starts)
+        timestamps = np.fmin.reduceat(self.timestamp[ids], starts)
+        namespaces = self.columns["namespace"][ids[starts]]
+
+        primary_codes, first = np.unique(self.columns["source"][live_ids], return_index=True)
+        first_ids = dict(zip(primary_codes.tolist(), live_ids[first].tolist()))
+
+        return {
+            self.strings[code]: {
+                "chunks": int(count),
+                "text_bytes": int(size),
+                "timestamp": None if np.isnan(timestamp) else float(timestamp),
+                "namespace": self.strings[namespace] if namespace != MISSING else None,
+                "first": first_ids.get(code),
+            }
+            for code, count, size, timestamp, namespace in zip(
+                unique.tolist(), counts.tolist(), text_bytes.tolist(), timestamps.tolist(), namespaces.tolist()
+            )
+        }
+
+    def shared_owners(self, chunk_id: int) -> List[str]:
+        """Sources that own a chunk besides the one in its source column"""
+        return [self.strings[code] for code in self.shared_sources[self.shared_ids == chunk_id].tolist()]
+
+    def ids_for_sources(self, sources: Iterable[str]) -> np.ndarray:
+        """Live ids of the chunks of some sources, from the source column rather than a per-source index"""
+        codes = [self.codes[source] for source in sources if source in self.codes]
+        if not codes:
+            return np.zeros(0, dtype=np.int64)
+        owned = self.live[:self.count] & np.isin(self.columns["source"][:self.count], codes)
+        shared = self.shared_ids[np.isin(self.shared_sources, codes)]
+        owned[shared] = self.live[shared]
+        return np.flatnonzero(owned)
+
+    def nbytes(self) -> int:
+        """Bytes of the used part of every array"""
+        arrays = [self.offsets[:self.count + 1], self.live[:self.count], self.timestamp[:self.count],
+                  self.shared_ids, self.shared_sources, *(column[:self.count] for column in self.columns.values())]
+        return self.blob_size + sum(array.nbytes for array in arrays) + sum(len(value) for value in self.strings)
+
+    # -- files --
+
+    def _arrays(self) -> Dict[str, np.ndarray]:
+        return {
+            "blob": self.blob[:self.blob_size],
+            "offsets": self.offsets[:self.count + 1],
+            "live": self.live[:self.count],
+            "timestamp": self.timestamp[:self.count],
+            "shared_ids": self.shared_ids,
+            "shared_sources": self.shared_sources,
+            **{name: column[:self.count] for name, column in self.columns.items()},
+        }
+
+    def save(self, path: str):
+        """Write the store as .npy files; a new directory is swapped in so open mappings stay valid"""
+        # Unique names, so a save that overlaps another never removes the directory the other is writing
+        suffix = f"{os.getpid()}.{threading.get_ident()}"
+        staging = f"{path}.{suffix}.tmp"
+        shutil.rmtree(staging, ignore_errors=True)
+        os.makedirs(staging)
+        for name, array in self._arrays().items():
+            np.save(os.path.join(staging, f"{name}.npy"), array)
+        with open(os.path.join(staging, "strings.json"), "w", encoding="utf-8") as f:
+            json.dump(self.strings, f)
+
+        if os.path.exists(path):
+            retired = f"{path}.{suffix}.old"
+            shutil.rmtree(retired, ignore_errors=True)
+            os.replace(path, retired)
+            os.replace(staging, path)
+            shutil.rmtree(retired, ignore_errors=True)
+        else:
+            os.replace(staging, path)
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True, read_only: bool = False) -> "ChunkStore":
+        """Open a saved store; with mmap the columns are paged in from disk and shared between processes
+
+        Writing to a mapped store copies the affected arrays into memory first, unless it is read-only.
+        """
+        store = cls()
+        arrays = {
+            name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r" if mmap else None)
+            for name in ("blob", "offsets", "live", "timestamp", "shared_ids", "shared_sources", *store.columns)
+            if os.path.exists(os.path.join(path, f"{name}.npy"))
+        }
+        # A column added since the store was saved starts out empty
+        for name in store.columns:
+            arrays.setdefault(name, np.full(len(arrays["live"]), MISSING, dtype=np.int32))
+        with open(os.path.join(path, "strings.json"), encoding="utf-8") as f:
+            store.strings = json.load(f)
+        store.codes = {value: code for code, value in enumerate(store.strings)}
+
+        store.blob, store.offsets, store.live, store.timestamp = (
+            arrays["blob"], arrays["offsets"], arrays["live"], arrays["timestamp"]
+        )
+        store.columns = {name: arrays[name] for name in store.columns}
+        # Stores saved before chunks could be shared have no owner table
+        if "shared_ids" in arrays:
+            store.shared_ids, store.shared_sources = arrays["shared_ids"], arrays["shared_sources"]
+        store.blob_size = len(store.blob)
+        store.count = len(store.live)
+        store.read_only = read_only
+        return store
+
+
+class ChunkDocstore(Docstore, AddableMixin):
+    """LangChain docstore over a ChunkStore; docstore ids are the chunk ids as strings"""
+
+    def __init__(self, store: Optional[ChunkStore] = None, path: Optional[str] = None):
+        self.store = store if store is not None else ChunkStore()
+        self.path = path
+
+    @property
+    def next_id(self) -> int:
+        return len(self.store)
+
+    def search(self, search: str):
+        try:
+            chunk_id = int(search)
+        except (TypeError, ValueError):
+            return f"ID {search} not found."
+        return self.store.document(chunk_id) if chunk_id in self.store else f"ID {search} not found."
+
+    def add(self, texts: Dict[str, Document]) -> None:
+        self.store.add(texts.keys(), (doc.page_content for doc in texts.values()),
+                       (doc.metadata for doc in texts.values()))
+
+    def delete(self, ids: List) -> None:
+        self.store.delete(ids)
+
+    def save(self):
+        self.store.save(self.path)
+
+    # Pickled with the FAISS index as a reference only; the columns are saved by save()
+    def __getstate__(self):
+        return {"path": self.path}
+
+    def __setstate__(self, state):
+        self.path = state["path"]
+        self.store = ChunkStore.load(self.path)
+
+
+def prepare_docstore(vector_store, path: str):
+    """Move a store's chunks into a ChunkDocstore keyed by dense index id"""
+    if isinstance(vector_store.docstore, ChunkDocstore):
+        vector_store.docstore.path = path
+        return
+
+    # Older saves keep Documents in memory under uuids; rows are renumbered to the index ids
+    mapping = vector_store.index_to_docstore_id
+    docstore = ChunkDocstore(path=path)
+    ids = sorted(mapping)
+    docs = [vector_store.docstore.search(mapping[faiss_id]) for faiss_id in ids]
+    docstore.store.add(ids, (doc.page_content for doc in docs), (doc.metadata for doc in docs))
+    for faiss_id in ids:
+        mapping[faiss_id] = str(faiss_id)
+    vector_store.docstore = docstore
+    print(f"📦 Moved {len(ids)} chunks into the compact chunk store")
+
+
+def _synthetic_chunks(num_chunks: int, num_sources: int = 2000) -> Iterator[Tuple[str, Dict]]:
+    words = ["retrieval", "index", "vector", "chunk", "document", "memory", "query", "source", "answer", "model"]
+    for i in range(num_chunks):
+        text = " ".join(words[(i * 7 + j) % len(words)] for j in range(60)) + f" {i}"
+        yield text, {
+            "source": f"upload_{i % num_sources}.pdf", "namespace": "public", "timestamp": 1.7e9 + i,
+            "page": i % 40, "chunk": i % 400, "tokens": 60 + i % 200, "section": f"Section {i % 12}", "content_hash": f"{i % num_sources:064x}",
+        }
+
+
+def _traced(build):
+    """Result of build and the bytes it still holds"""
+    gc.collect()
+    tracemalloc.start()
+    try:
+        result = build()
+        gc.collect()
+        return result, tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+
+
+def benchmark_chunk_stores(num_chunks: int = 1_000_000):
+    """Memory held by a list of Documents vs the compact store for the same chunks"""
+    text_bytes = sum(len(text.encode("utf-8")) for text, _ in _synthetic_chunks(num_chunks))
+    print(f"{num_chunks} chunks, {text_bytes / 2**20:.0f} MiB of text")
+
+    started = time.perf_counter()
+    documents, list_bytes = _traced(lambda: [Document(page_content=text, metadata=metadata)
+                                             for text, metadata in _synthetic_chunks(num_chunks)])
+    print(f"list of Documents: {list_bytes / 2**20:8.0f} MiB ({list_bytes / num_chunks:6.0f} B/chunk), "
+          f"built in {time.perf_counter() - started:.1f}s")
+    del documents
+
+    def build_store():
+        store = ChunkStore()
+        batch = []
+        for chunk_id, (text, metadata) in enumerate(_synthetic_chunks(num_chunks)):
+            batch.append((chunk_id, text, metadata))
+            if len(batch) == 10000:
+                store.add(*zip(*batch))
+                batch = []
+        if batch:
+            store.add(*zip(*batch))
+        # Trim spare capacity, as a save and reload would
+        store.blob, store.offsets = store.blob[:store.blob_size].copy(), store.offsets[:store.count + 1].copy()
+        store.live, store.timestamp = store.live[:store.count].copy(), store.timestamp[:store.count].copy()
+        store.columns = {name: column[:store.count].copy() for name, column in store.columns.items()}
+        return store
+
+    started = time.perf_counter()
+    store, store_bytes = _traced(build_store)
+    print(f"chunk store:       {store_bytes / 2**20:8.0f} MiB ({store_bytes / num_chunks:6.0f} B/chunk), "
+          f"built in {time.perf_counter() - started:.1f}s")
+
+    path = os.path.join("data", "chunk_store_benchmark")
+    store.save(path)
+    del store
+    mapped, mapped_bytes = _traced(lambda: ChunkStore.load(path, read_only=True))
+    started = time.perf_counter()
+    for chunk_id in range(0, num_chunks, max(1, num_chunks // 10000)):
+        mapped.document(chunk_id)
+    lookup_us = (time.perf_counter() - started) / min(num_chunks, 10000) * 1e6
+    print(f"memory-mapped:     {mapped_bytes / 2**20:8.1f} MiB private, {lookup_us:.1f}µs per Document lookup")
+    del mapped
+    shutil.rmtree(path, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    benchmark_chunk_stores()
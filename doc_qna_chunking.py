@@ -0,0 +1,191 @@
+import os
+import re
+import math
+import threading
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from langchain.schema import Document
+
+from doc_qna_embeddings import EMBEDDING_MODEL_NAME, EMBEDDING_CACHE_DIR
+
+# all-MiniLM-L6-v2 truncates at 256 word pieces, two of which are [CLS] and [SEP]
+MODEL_MAX_TOKENS = 256
+CHUNK_MAX_TOKENS = min(int(os.getenv("DOC_QNA_CHUNK_MAX_TOKENS", "254")), MODEL_MAX_TOKENS - 2)
+CHUNK_OVERLAP_TOKENS = int(os.getenv("DOC_QNA_CHUNK_OVERLAP_TOKENS", "32"))
+# A heading only starts a new chunk once the current one holds this much; tiny sections are merged
+CHUNK_MIN_TOKENS = int(os.getenv("DOC_QNA_CHUNK_MIN_TOKENS", "64"))
+
+PAGE_MARKER = re.compile(r"^-{3} Page (\d+) -{3}$")
+HEADING = re.compile(r"^(#{1,6}\s+\S.*|={2,}\s*\S.*?\s*={2,}|\[ .+ \])$")
+SEPARATOR = re.compile(r"^[=\-_*]{5,}$")
+SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+
+_tokenizer = None
+_tokenizer_lock = threading.Lock()
+
+
+def get_tokenizer():
+    """The embedding model's own tokenizer, or None if it can't be loaded"""
+    global _tokenizer
+
+    with _tokenizer_lock:
+        if _tokenizer is None:
+            try:
+                from transformers import AutoTokenizer
+                _tokenizer = AutoTokenizer.from_pretrained(EMBEDDING_MODEL_NAME, cache_dir=EMBEDDING_CACHE_DIR)
+            except Exception as e:
+                print(f"⚠️ Could not load tokenizer, estimating token counts: {e}")
+                _tokenizer = False
+        return _tokenizer or None
+
+
+def count_tokens(texts: List[str]) -> List[int]:
+    """Word pieces per text, without special tokens"""
+    if not texts:
+        return []
+
+    tokenizer = get_tokenizer()
+    if tokenizer is not None:
+        encoded = tokenizer(texts, add_special_tokens=False, truncation=False)["input_ids"]
+        return [len(ids) for ids in encoded]
+
+    # Deliberately high estimate so chunks stay under the limit without the real tokenizer
+    return [math.ceil(len(re.findall(r"\w+|[^\w\s]", text)) * 1.4) for text in texts]
+
+
+def split_pages(text: str) -> Iterator[Tuple[Optional[int], List[Tuple[Optional[str], List[str]]]]]:
+    """Yield (page, [(heading, paragraphs)]) using the page markers the extractors insert"""
+    page = None
+    sections = [(None, [])]
+    paragraph = []
+
+    def flush():
+        if paragraph:
+            sections[-1][1].append("\n".join(paragraph))
+            paragraph.clear()
+
+    for line in text.splitlines():
+        stripped = line.strip()
+        page_match = PAGE_MARKER.match(stripped)
+
+        if page_match:
+            flush()
+            if any(paragraphs or heading for heading, paragraphs in sections):
+                yield page, sections
+            page = int(page_match.group(1))
+            sections = [(None, [])]
+        elif not stripped or SEPARATOR.match(stripped):
+            flush()
+        elif HEADING.match(stripped):
+            flush()
+            sections.append((stripped, []))
+        else:
+            paragraph.append(line.rstrip())
+
+    flush()
+    if any(paragraphs or heading for heading, paragraphs in sections):
+        yield page, sections
+
+
+def _split_oversized(text: str, tokens: int) -> List[Tuple[str, int]]:
+    """Break a paragraph over the limit into sentences, and sentences over it into word windows"""
+    if tokens <= CHUNK_MAX_TOKENS:
+        return [(text, tokens)]
+
+    units = []
+    sentences = [sentence for sentence in SENTENCE_END.split(text) if sentence.strip()]
+    if len(sentences) > 1:
+        for sentence, count in zip(sentences, count_tokens(sentences)):
+            units.extend(_split_oversized(sentence, count))
+        return units
+
+    words = text.split()
+    window, window_tokens = [], 0
+    for word, count in zip(words, count_tokens(words)):
+        if window and window_tokens + count > CHUNK_MAX_TOKENS:
+            units.append((" ".join(window), window_tokens))
+            window, window_tokens = [], 0
+        window.append(word)
+        window_tokens += count
+    if window:
+        units.append((" ".join(window), window_tokens))
+    return units
+
+
+def _pack_page(page: Optional[int], sections) -> Iterator[Document]:
+    """Greedily fill chunks up to the token limit without crossing the page"""
+    texts = [heading for heading, _ in sections if heading] + [p for _, paragraphs in sections for p in paragraphs]
+    counts = dict(zip(texts, count_tokens(texts)))
+
+    current, current_tokens, current_heading = [], 0, None
+
+    def emit():
+        metadata: Dict = {"tokens": current_tokens}
+        if page is not None:
+            metadata["page"] = page
+        if current_heading:
+            metadata["section"] = current_heading
+        return Document(page_content="\n".join(current), metadata=metadata)
+
+    for heading, paragraphs in sections:
+        units = []
+        if heading:
+            if current and current_tokens >= CHUNK_MIN_TOKENS:
+                yield emit()
+                current, current_tokens = [], 0
+            if not current:
+                current_heading = heading
+            units.append((heading, counts[heading]))
+        for paragraph in paragraphs:
+            units.extend(_split_oversized(paragraph, counts[paragraph]))
+
+        for text, tokens in units:
+            if current and current_tokens + tokens > CHUNK_MAX_TOKENS:
+                yield emit()
+                # Carry a short trailing unit over so a thought split across chunks keeps some context
+                last_text, last_tokens = current[-1], counts.get(current[-1], CHUNK_OVERLAP_TOKENS + 1)
+                if last_text != heading and last_tokens <= CHUNK_OVERLAP_TOKENS and last_tokens + tokens <= CHUNK_MAX_TOKENS:
+                    current, current_tokens = [last_text], last_tokens
+                else:
+                    current, current_tokens = [], 0
+                current_heading = heading or current_heading
+            current.append(text)
+            current_tokens += tokens
+            counts.setdefault(text, tokens)
+
+    if current:
+        yield emit()
+
+
+def chunk_text(text: str) -> Iterator[Document]:
+    """Split extracted text into chunks sized in real word pieces, keeping page and heading boundaries"""
+    for page, sections in split_pages(text):
+        yield from _pack_page(page, sections)
+
+
+def benchmark_chunkers(file_path: str):
+    """Compare the old 600-character splitter with the token-aware chunker on one document"""
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+    from function_for_DOC_QNA import extract_text_auto
+
+    text = extract_text_auto(file_path=file_path)
+    splitter = RecursiveCharacterTextSplitter(chunk_size=600, chunk_overlap=100, separators=["\n\n", "\n", ". ", " ", ""])
+    results = {
+        "600-char splitter": splitter.split_text(text),
+        "token-aware": [doc.page_content for doc in chunk_text(text)],
+    }
+
+    source_words = set(text.split())
+    for name, chunks in results.items():
+        counts = count_tokens(chunks)
+        truncated = sum(1 for count in counts if count > MODEL_MAX_TOKENS - 2)
+        # Batches of 32 are padded to their longest member before the forward pass
+        padded = sum(max(counts[i:i + 32]) * len(counts[i:i + 32]) for i in range(0, len(counts), 32))
+        covered = len(source_words & set(" ".join(chunks).split())) / max(1, len(source_words))
+        print(f"{name:>18}: {len(chunks)} chunks, {truncated} truncated, "
+              f"{padded} padded tokens ({sum(counts)} real), {covered:.1%} of words kept")
+
+
+if __name__ == "__main__":
+    import sys
+    benchmark_chunkers(sys.argv[1])
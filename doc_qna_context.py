@@ -0,0 +1,119 @@
+import os
+from typing import Dict, List, Tuple
+
+from langchain.schema import Document
+
+from doc_qna_chunking import count_tokens
+
+# Prompt context is packed up to this many word pieces
+CONTEXT_MAX_TOKENS = int(os.getenv("DOC_QNA_CONTEXT_MAX_TOKENS", "1500"))
+# Fused results considered for the context of one answer
+CONTEXT_CANDIDATES = int(os.getenv("DOC_QNA_CONTEXT_CANDIDATES", "8"))
+# Reciprocal rank fusion constant; larger values flatten the gap between ranks
+RRF_K = 60
+# Shorter shared text only counts as chunk overlap when it is a whole line
+MIN_OVERLAP_CHARS = 20
+MAX_OVERLAP_CHARS = 1000
+
+
+def _chunk_key(doc) -> Tuple:
+    metadata = getattr(doc, "metadata", None) or {}
+    return metadata.get("source"), getattr(doc, "page_content", str(doc))
+
+
+def fuse_rankings(rankings: List[List[Document]], k: int = RRF_K) -> List[Tuple[Document, float]]:
+    """Reciprocal rank fusion of several ranked lists; a chunk found by more than one retriever appears once"""
+    docs, scores = {}, {}
+    for ranking in rankings:
+        for rank, doc in enumerate(ranking):
+            key = _chunk_key(doc)
+            docs.setdefault(key, doc)
+            scores[key] = scores.get(key, 0.0) + 1.0 / (k + rank + 1)
+
+    return sorted(((docs[key], score) for key, score in scores.items()), key=lambda item: item[1], reverse=True)
+
+
+def join_overlapping(first: str, second: str) -> str:
+    """Concatenate consecutive chunks, dropping the text the second one repeats from the first"""
+    for size in range(min(len(first), len(second), MAX_OVERLAP_CHARS), 0, -1):
+        if first.endswith(second[:size]) and (size >= MIN_OVERLAP_CHARS or second[size:size + 1] in ("\n", "")):
+            return first + second[size:]
+    return f"{first}\n{second}"
+
+
+def merge_adjacent(scored: List[Tuple[Document, float]], max_tokens: int = CONTEXT_MAX_TOKENS) -> List[Dict]:
+    """Stitch runs of consecutive chunks from the same source and page into single blocks"""
+    tokens = count_tokens([getattr(doc, "page_content", str(doc)) for doc, _ in scored])
+    blocks = [
+        {"docs": [doc], "text": getattr(doc, "page_content", str(doc)), "score": score, "tokens": count}
+        for (doc, score), count in zip(scored, tokens)
+    ]
+
+    # Only chunks numbered at ingestion can be placed next to each other
+    groups: Dict[Tuple, List[Dict]] = {}
+    for block in blocks:
+        metadata = getattr(block["docs"][0], "metadata", None) or {}
+        if "chunk" in metadata:
+            groups.setdefault((metadata.get("source"), metadata.get("url"), metadata.get("page")), []).append(block)
+
+    merged_away = set()
+    for group in groups.values():
+        group.sort(key=lambda block: block["docs"][0].metadata["chunk"])
+        run = group[0]
+        for block in group[1:]:
+            consecutive = block["docs"][0].metadata["chunk"] == run["docs"][-1].metadata["chunk"] + 1
+            if consecutive and run["tokens"] + block["tokens"] <= max_tokens:
+                run["docs"].extend(block["docs"])
+                run["text"] = join_overlapping(run["text"], block["text"])
+                run["score"] = max(run["score"], block["score"])
+                run["tokens"] += block["tokens"]
+                merged_away.add(id(block))
+            else:
+                run = block
+
+    blocks = [block for block in blocks if id(block) not in merged_away]
+    # Summed counts include the overlap that joining removed
+    stitched = [block for block in blocks if len(block["docs"]) > 1]
+    for block, count in zip(stitched, count_tokens([block["text"] for block in stitched])):
+        block["tokens"] = count
+    return blocks
+
+
+def _block_label(block: Dict) -> str:
+    metadata = getattr(block["docs"][0], "metadata", None) or {}
+    label = metadata.get("url") or metadata.get("filename") or metadata.get("source") or "unknown source"
+    if metadata.get("page") is not None:
+        label += f", page {metadata['page']}"
+    return label
+
+
+def pack_context(scored: List[Tuple[Document, float]], max_tokens: int = CONTEXT_MAX_TOKENS) -> List[Dict]:
+    """Highest-scoring merged blocks that together fit the token budget"""
+    blocks = sorted(merge_adjacent(scored, max_tokens), key=lambda block: block["score"], reverse=True)
+    headers = count_tokens([f"Document {i + 1} ({_block_label(block)}):" for i, block in enumerate(blocks)])
+
+    packed, used = [], 0
+    for block, header in zip(blocks, headers):
+        cost = block["tokens"] + header
+        # Greedy: a block that doesn't fit is skipped so a smaller, lower-ranked one can still be used
+        if packed and used + cost > max_tokens:
+            continue
+        packed.append(block)
+        used += cost
+    return packed
+
+
+def format_context(blocks: List[Dict]) -> str:
+    """Render packed blocks as the prompt context"""
+    return "".join(f"Document {i + 1} ({_block_label(block)}):\n{block['text']}\n\n" for i, block in enumerate(blocks))
+
+
+def context_sources(blocks: List[Dict]) -> List[str]:
+    """Distinct sources of the packed blocks, best first"""
+    sources = []
+    for block in blocks:
+        metadata = getattr(block["docs"][0], "metadata", None) or {}
+        source = metadata.get("filename") or metadata.get("source")
+        if source and source not in sources:
+            sources.append(source)
+    return sources
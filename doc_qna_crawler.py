@@ -0,0 +1,230 @@
+import os
+import re
+import time
+import asyncio
+import threading
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import AsyncIterator, List, Optional, Tuple
+from urllib.parse import urljoin, urlsplit, urlunsplit, parse_qsl, urlencode
+
+import httpx
+from bs4 import BeautifulSoup
+
+from doc_qna_http_cache import afetch_url, cached_parse
+
+# Concurrent fetches per crawl, and how many of those may hit the same host at once
+CRAWL_WORKERS = int(os.getenv("DOC_QNA_CRAWL_WORKERS", "8"))
+CRAWL_PER_HOST = int(os.getenv("DOC_QNA_CRAWL_PER_HOST", "4"))
+# The start page is depth 1, pages it links to are depth 2, and so on
+CRAWL_MAX_DEPTH = int(os.getenv("DOC_QNA_CRAWL_MAX_DEPTH", "2"))
+CRAWL_MAX_PAGES = int(os.getenv("DOC_QNA_CRAWL_MAX_PAGES", "50"))
+CRAWL_TIMEOUT_SECONDS = float(os.getenv("DOC_QNA_CRAWL_TIMEOUT_SECONDS", "10"))
+
+CRAWL_HEADERS = {"User-Agent": "Mozilla/5.0"}
+TRACKING_PARAMS = ("utm_", "fbclid", "gclid")
+
+
+@dataclass
+class CrawledPage:
+    url: str
+    depth: int
+    text: str
+
+
+def canonicalize_url(url: str) -> str:
+    """Normalize a URL so the same page is only crawled once"""
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or "").lower()
+
+    port = parts.port
+    if port is None or (scheme, port) in (("http", 80), ("https", 443)):
+        netloc = host
+    else:
+        netloc = f"{host}:{port}"
+
+    path = re.sub(r"/{2,}", "/", parts.path) or "/"
+    if path != "/" and path.endswith("/"):
+        path = path.rstrip("/")
+
+    query = urlencode(sorted(
+        (key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+        if not key.startswith(TRACKING_PARAMS)
+    ))
+    return urlunsplit((scheme, netloc, path, query, ""))
+
+
+def parse_documentation_page(url: str, html: str) -> Tuple[str, List[str]]:
+    """Structured text of a documentation page, without deprecation and warning notes, plus its links"""
+    soup = BeautifulSoup(html, "html.parser")
+
+    links = [urljoin(url, link["href"]) for link in soup.find_all("a", href=True)]
+
+    for tag in ["nav", "footer", "aside", "script", "style", "form", "header", "noscript"]:
+        for element in soup.find_all(tag):
+            element.decompose()
+
+    structured_text = f"\n\n[ Section: {url} ]\n\n"  # Section title per link
+    headers = [h.get_text(strip=True) for h in soup.find_all(["h1", "h2", "h3"])]
+    paragraphs = [p.get_text(strip=True) for p in soup.find_all("p") if p.get_text(strip=True)]
+
+    filtered_paragraphs = [p for p in paragraphs if not re.search(r"(deprecated|warning)", p, re.IGNORECASE)]
+
+    if headers:
+        structured_text += "\n".join(headers) + "\n\n"
+    if filtered_paragraphs:
+        structured_text += "\n".join(filtered_paragraphs)
+
+    structured_text += "\n\n" + "=" * 50 + "\n\n"
+    return structured_text, links
+
+
+async def crawl_site(start_url: str, max_depth: int = CRAWL_MAX_DEPTH, max_pages: int = CRAWL_MAX_PAGES,
+                     workers: int = CRAWL_WORKERS, per_host: int = CRAWL_PER_HOST,
+                     client: Optional[httpx.AsyncClient] = None) -> AsyncIterator[CrawledPage]:
+    """Crawl same-site links breadth-first and yield each page as soon as it is parsed"""
+    start_url = canonicalize_url(start_url)
+    site = urlsplit(start_url).netloc
+
+    # Per-crawl state, so a second crawl of the same site starts from scratch
+    seen = {start_url}
+    frontier = asyncio.Queue()
+    pages = asyncio.Queue(maxsize=workers * 2)
+    host_limits = {}
+    frontier.put_nowait((start_url, 1))
+
+    own_client = client is None
+    if own_client:
+        client = httpx.AsyncClient(headers=CRAWL_HEADERS, timeout=CRAWL_TIMEOUT_SECONDS, follow_redirects=True)
+
+    async def fetch(url):
+        host = urlsplit(url).netloc
+        limit = host_limits.setdefault(host, asyncio.Semaphore(per_host))
+        async with limit:
+            response = await afetch_url(client, url)
+        if "html" not in (response.content_type or "html"):
+            return None
+        return response
+
+    async def worker():
+        while True:
+            url, depth = await frontier.get()
+            try:
+                print(f"Extracting: {url} (Depth: {depth})")
+                response = await fetch(url)
+                if response is None:
+                    continue
+
+                # Parsing is CPU-bound; keep it off the event loop the other crawl workers share
+                text, links = await asyncio.to_thread(
+                    cached_parse, response, "docs", lambda html: parse_documentation_page(url, html)
+                )
+                if depth < max_depth:
+                    for link in links:
+                        link = canonicalize_url(link)
+                        parts = urlsplit(link)
+                        if parts.scheme not in ("http", "https") or parts.netloc != site:
+                            continue
+                        if link not in seen and len(seen) < max_pages:
+                            seen.add(link)
+                            frontier.put_nowait((link, depth + 1))
+
+                await pages.put(CrawledPage(url=url, depth=depth, text=text))
+            except Exception as e:
+                print(f"Error fetching {url}: {e}")
+            finally:
+                frontier.task_done()
+
+    async def finish():
+        # Every page is queued before its task_done, so the sentinel always comes last
+        await frontier.join()
+        await pages.put(None)
+
+    tasks = [asyncio.create_task(worker()) for _ in range(workers)]
+    tasks.append(asyncio.create_task(finish()))
+
+    try:
+        while True:
+            page = await pages.get()
+            if page is None:
+                break
+            yield page
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if own_client:
+            await client.aclose()
+
+
+def crawl_site_text(start_url: str, **kwargs) -> str:
+    """Blocking wrapper for callers outside the event loop: the whole crawl as one text"""
+    async def collect():
+        return [page.text async for page in crawl_site(start_url, **kwargs)]
+
+    return "".join(asyncio.run(collect())).strip()
+
+
+def _start_benchmark_site(num_pages: int, latency_ms: float):
+    """Local site of linked pages, each served after an artificial delay"""
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            time.sleep(latency_ms / 1000)
+            path = self.path.strip("/")
+            number = int(path.split("/")[-1]) if path else 0
+            links = "".join(f'<a href="/page/{n}">Page {n}</a>' for n in range(number * 5 + 1, number * 5 + 6) if n < num_pages)
+            body = f"<html><body><h1>Page {number}</h1><p>Content of page {number}.</p>{links}</body></html>".encode()
+            etag = f'"page-{number}"'
+            if self.headers.get("If-None-Match") == etag:
+                self.send_response(304)
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.send_header("ETag", etag)
+            self.send_header("Content-Type", "text/html")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def benchmark_crawler(num_pages: int = 150, latency_ms: float = 50):
+    """Report pages/sec against a local site: sequential, concurrent, then repeat crawls served by the HTTP cache"""
+    import tempfile
+    import doc_qna_http_cache
+
+    server = _start_benchmark_site(num_pages, latency_ms)
+    start_url = f"http://127.0.0.1:{server.server_address[1]}/"
+    ttl = doc_qna_http_cache.HTTP_CACHE_TTL_SECONDS
+
+    runs = (
+        ("sequential", 1, 1, "cold"),
+        ("concurrent", CRAWL_WORKERS, CRAWL_PER_HOST, "cold"),
+        ("cached", CRAWL_WORKERS, CRAWL_PER_HOST, "fresh"),
+        ("revalidate", CRAWL_WORKERS, CRAWL_PER_HOST, "stale"),
+    )
+    try:
+        for label, workers, per_host, cache_state in runs:
+            if cache_state == "cold":
+                doc_qna_http_cache.HTTP_CACHE_DIR = tempfile.mkdtemp(prefix="http_cache_bench_")
+            doc_qna_http_cache.HTTP_CACHE_TTL_SECONDS = 0 if cache_state == "stale" else ttl
+
+            start = time.perf_counter()
+            text = crawl_site_text(start_url, max_depth=10, max_pages=num_pages, workers=workers, per_host=per_host)
+            elapsed = time.perf_counter() - start
+            crawled = text.count("[ Section:")
+            print(f"{label:>10}: {crawled} pages in {elapsed:.2f}s ({crawled / elapsed:.1f} pages/sec)")
+    finally:
+        doc_qna_http_cache.HTTP_CACHE_TTL_SECONDS = ttl
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    benchmark_crawler()
@@ -0,0 +1,232 @@
+import os
+import re
+import zlib
+import hashlib
+import threading
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from langchain.schema import Document
+
+# Estimated Jaccard similarity of word shingles above which a chunk counts as a near-duplicate
+DEDUP_THRESHOLD = float(os.getenv("DOC_QNA_DEDUP_THRESHOLD", "0.85"))
+DEDUP_ENABLED = os.getenv("DOC_QNA_DEDUP_ENABLED", "true").lower() == "true"
+SHINGLE_WORDS = 5
+# 16 bands of 8 rows: pairs around 0.7 Jaccard and up become LSH candidates, then are checked exactly
+NUM_PERMUTATIONS = 128
+LSH_BANDS = 16
+LSH_ROWS = NUM_PERMUTATIONS // LSH_BANDS
+
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_MAX_HASH = np.uint64((1 << 32) - 1)
+_rng = np.random.RandomState(1)
+_perm_a = _rng.randint(1, 1 << 32, size=NUM_PERMUTATIONS, dtype=np.uint64)
+_perm_b = _rng.randint(0, 1 << 32, size=NUM_PERMUTATIONS, dtype=np.uint64)
+
+# namespace -> per-band buckets of (source_id, key); signatures are kept per source so eviction can drop them
+_buckets: Dict[str, List[Dict[bytes, set]]] = {}
+# source_id -> {(namespace, digest of the indexed chunk's text): signature}
+_signatures: Dict[str, Dict[tuple, np.ndarray]] = defaultdict(dict)
+_dedup_lock = threading.Lock()
+# Chunks read per read-lock hold while signatures are rebuilt at startup
+REBUILD_SLICE = 1000
+
+dedup_stats = {"checked": 0, "dropped": 0, "dropped_within_source": 0, "dropped_across_sources": 0}
+dropped_by_namespace: Dict[str, int] = defaultdict(int)
+
+
+def minhash_signature(text: str) -> Optional[np.ndarray]:
+    """MinHash of the text's word shingles, or None for text too short to compare"""
+    words = re.findall(r"\w+", text.lower())
+    if not words:
+        return None
+
+    size = min(SHINGLE_WORDS, len(words))
+    shingles = {" ".join(words[i:i + size]) for i in range(len(words) - size + 1)}
+    hashes = np.fromiter((zlib.crc32(shingle.encode()) for shingle in shingles), dtype=np.uint64, count=len(shingles))
+
+    # Universal hashing a*x + b mod p, one row per permutation; both factors are below 2**32 so nothing overflows
+    permuted = (np.outer(_perm_a, hashes) + _perm_b[:, np.newaxis]) % _MERSENNE_PRIME & _MAX_HASH
+    return permuted.min(axis=1)
+
+
+def chunk_digest(text: str) -> str:
+    """Short hash of a chunk's text, to find the indexed chunk a signature stands for"""
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=8).hexdigest()
+
+
+def _band_keys(signature: np.ndarray) -> List[bytes]:
+    return [signature[band * LSH_ROWS:(band + 1) * LSH_ROWS].tobytes() for band in range(LSH_BANDS)]
+
+
+def _find_duplicate(namespace: str, signature: np.ndarray) -> Optional[tuple]:
+    """Entry of an indexed chunk similar enough to this signature, if any"""
+    buckets = _buckets.get(namespace)
+    if buckets is None:
+        return None
+
+    candidates = set()
+    for band, key in enumerate(_band_keys(signature)):
+        candidates.update(buckets[band].get(key, ()))
+
+    for source_id, key in candidates:
+        other = _signatures.get(source_id, {}).get(key)
+        if other is not None and np.mean(other == signature) >= DEDUP_THRESHOLD:
+            return source_id, key
+    return None
+
+
+def _add_signature(namespace: str, source_id: str, digest: str, signature: np.ndarray, buckets=None, signatures=None):
+    buckets = _buckets if buckets is None else buckets
+    signatures = _signatures if signatures is None else signatures
+    namespace_buckets = buckets.setdefault(namespace, [defaultdict(set) for _ in range(LSH_BANDS)])
+    key = (namespace, digest)
+    if key in signatures[source_id]:
+        # The same text again has the same signature, already in the buckets
+        return
+    signatures[source_id][key] = signature
+    for band, band_key in enumerate(_band_keys(signature)):
+        namespace_buckets[band][band_key].add((source_id, key))
+
+
+def _remove_signatures(source_id: str, buckets=None, signatures=None):
+    buckets = _buckets if buckets is None else buckets
+    signatures = _signatures if signatures is None else signatures
+    for key, signature in signatures.pop(source_id, {}).items():
+        namespace_buckets = buckets.get(key[0])
+        if namespace_buckets is None:
+            continue
+        for band, band_key in enumerate(_band_keys(signature)):
+            bucket = namespace_buckets[band].get(band_key)
+            if bucket is not None:
+                bucket.discard((source_id, key))
+                if not bucket:
+                    del namespace_buckets[band][band_key]
+
+
+def drop_near_duplicates(documents: List[Document], namespace: str,
+                         source_id: str) -> Tuple[List[Document], List[Tuple[Document, str, str]]]:
+    """Drop chunks that nearly repeat one already indexed in the namespace, or earlier in this batch
+
+    Returns the kept chunks, and the dropped ones that repeat another source's chunk as
+    (chunk, owning source, digest of the chunk it repeats), so the source can share that chunk.
+    """
+    if not DEDUP_ENABLED or not documents:
+        return documents, []
+
+    signatures = [minhash_signature(doc.page_content) for doc in documents]
+    kept, shared = [], []
+
+    with _dedup_lock:
+        for doc, signature in zip(documents, signatures):
+            dedup_stats["checked"] += 1
+            if signature is None:
+                kept.append(doc)
+                continue
+
+            duplicate_of = _find_duplicate(namespace, signature)
+            if duplicate_of is not None:
+                dedup_stats["dropped"] += 1
+                dropped_by_namespace[namespace] += 1
+                if duplicate_of[0] == source_id:
+                    dedup_stats["dropped_within_source"] += 1
+                else:
+                    dedup_stats["dropped_across_sources"] += 1
+                    shared.append((doc, duplicate_of[0], duplicate_of[1][1]))
+                continue
+
+            # Registered right away so later chunks of the same upload are compared against it too
+            _add_signature(namespace, source_id, chunk_digest(doc.page_content), signature)
+            kept.append(doc)
+
+    return kept, shared
+
+
+def record_shared_signatures(namespace: str, source_id: str, shared: List[Tuple[str, str]], orphans: List[Document]):
+    """Index signatures for a source's cross-source near-duplicates once they are attached or indexed
+
+    Shared chunks get a signature under this source too, so they stay originals after their first owner
+    is evicted; orphans, whose chunk was evicted before they could share it, are indexed as they are.
+    """
+    with _dedup_lock:
+        for owner, digest in shared:
+            signature = _signatures.get(owner, {}).get((namespace, digest))
+            if signature is not None:
+                _add_signature(namespace, source_id, digest, signature)
+        for doc in orphans:
+            signature = minhash_signature(doc.page_content)
+            if signature is not None:
+                _add_signature(namespace, source_id, chunk_digest(doc.page_content), signature)
+
+
+def forget_source_signatures(source_id: str):
+    """Stop treating an evicted or failed source's chunks as originals"""
+    with _dedup_lock:
+        _remove_signatures(source_id)
+
+
+def reload_source_signatures(store, lock, source_id: str):
+    """Replace a source's signatures with those of its indexed chunks, after a batch failed to be added"""
+    with lock.read_lock():
+        documents = [store.document(i) for i in store.ids_for_sources([source_id]).tolist()]
+    signatures = [(doc.metadata.get("namespace", "public"), chunk_digest(doc.page_content),
+                   minhash_signature(doc.page_content)) for doc in documents]
+
+    with _dedup_lock:
+        _remove_signatures(source_id)
+        for namespace, digest, signature in signatures:
+            if signature is not None:
+                _add_signature(namespace, source_id, digest, signature)
+
+
+def rebuild_near_duplicate_index(store, lock):
+    """Recompute signatures for chunks loaded from disk, beside the live index, then swap them in"""
+    with lock.read_lock():
+        chunk_ids = store.live_ids().tolist()
+
+    buckets, signatures = {}, defaultdict(dict)
+    for start in range(0, len(chunk_ids), REBUILD_SLICE):
+        # Ingestion and eviction wait only for one slice to be read, not for the hashing
+        with lock.read_lock():
+            documents = [(store.document(i), store.shared_owners(i))
+                         for i in chunk_ids[start:start + REBUILD_SLICE] if i in store]
+        for doc, shared_owners in documents:
+            signature = minhash_signature(doc.page_content)
+            if signature is None or not doc.metadata.get("source"):
+                continue
+            # Every owner of a shared chunk gets the signature, as when it was shared
+            digest = chunk_digest(doc.page_content)
+            for source_id in [doc.metadata["source"], *shared_owners]:
+                _add_signature(doc.metadata.get("namespace", "public"), source_id, digest, signature,
+                               buckets, signatures)
+
+    with lock.read_lock(), _dedup_lock:
+        # Sources evicted meanwhile are dropped; sources uploaded meanwhile keep the signatures they registered
+        live_sources = set(store.sources())
+        for source_id in list(signatures):
+            if source_id not in live_sources or source_id in _signatures:
+                _remove_signatures(source_id, buckets, signatures)
+        for source_id, entries in _signatures.items():
+            for key, signature in entries.items():
+                _add_signature(key[0], source_id, key[1], signature, buckets, signatures)
+
+        _buckets.clear()
+        _buckets.update(buckets)
+        _signatures.clear()
+        _signatures.update(signatures)
+        count = sum(len(entries) for entries in signatures.values())
+
+    print(f"🔁 Near-duplicate index rebuilt with {count} signatures")
+
+
+def get_dedup_stats() -> Dict:
+    """How many chunks ingestion has eliminated as near-duplicates"""
+    with _dedup_lock:
+        return {
+            **dedup_stats,
+            "drop_rate": round(dedup_stats["dropped"] / dedup_stats["checked"], 4) if dedup_stats["checked"] else 0.0,
+            "dropped_by_namespace": dict(dropped_by_namespace),
+            "indexed_signatures": sum(len(entries) for entries in _signatures.values()),
+            "threshold": DEDUP_THRESHOLD,
+        }
@@ -0,0 +1,360 @@
+import os
+import time
+import queue
+import asyncio
+import itertools
+import threading
+import multiprocessing
+import concurrent.futures
+from typing import List, Optional
+
+from langchain_core.embeddings import Embeddings
+
+EMBEDDING_MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
+EMBEDDING_CACHE_DIR = os.path.join(os.path.dirname(__file__), "model_cache")
+
+# "torch" runs the fp32 model, "int8" a dynamically quantized copy of the same cached weights
+EMBEDDING_BACKEND = os.getenv("DOC_QNA_EMBEDDING_BACKEND", "torch")
+# Set to 0 to embed in the request-handling process as before
+EMBEDDING_WORKERS = int(os.getenv("DOC_QNA_EMBEDDING_WORKERS", str(max(1, (os.cpu_count() or 2) // 2))))
+EMBEDDING_BATCH_SIZE = int(os.getenv("DOC_QNA_EMBEDDING_BATCH_SIZE", "64"))
+EMBEDDING_TIMEOUT_SECONDS = 300
+# Waits on the pool wake up this often to notice workers that died
+EMBEDDING_LIVENESS_CHECK_SECONDS = 1.0
+
+# Concurrent query embeddings are collected for this long, or until the batch is full
+QUERY_BATCH_WINDOW_MS = float(os.getenv("DOC_QNA_QUERY_BATCH_WINDOW_MS", "5"))
+QUERY_MAX_BATCH = int(os.getenv("DOC_QNA_QUERY_MAX_BATCH", "32"))
+
+_embedding_pool = None
+_embedding_pool_lock = threading.Lock()
+
+
+def load_sentence_model(backend: str = "torch", num_threads: Optional[int] = None):
+    """Load MiniLM from the local model cache, optionally quantized to int8"""
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    if num_threads:
+        torch.set_num_threads(num_threads)
+
+    model = SentenceTransformer(EMBEDDING_MODEL_NAME, cache_folder=EMBEDDING_CACHE_DIR, device="cpu")
+    if backend == "int8":
+        model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    model.eval()
+    return model
+
+
+def _embedding_worker(task_queue, result_queue, backend, num_threads, batch_size):
+    """Worker process: embed batches from task_queue until a None sentinel arrives"""
+    model = load_sentence_model(backend, num_threads)
+    result_queue.put((None, None, None))  # Ready signal
+
+    while True:
+        task = task_queue.get()
+        if task is None:
+            break
+
+        batch_id, texts = task
+        try:
+            vectors = model.encode(texts, batch_size=batch_size, convert_to_numpy=True, show_progress_bar=False)
+            result_queue.put((batch_id, vectors, None))
+        except Exception as e:
+            result_queue.put((batch_id, None, str(e)))
+
+
+class EmbeddingPool:
+    """Fixed set of embedding processes fed with chunk batches over a queue"""
+
+    def __init__(self, workers: int = EMBEDDING_WORKERS, backend: str = EMBEDDING_BACKEND,
+                 batch_size: int = EMBEDDING_BATCH_SIZE):
+        ctx = multiprocessing.get_context("spawn")
+        self.workers = workers
+        self.batch_size = batch_size
+        self.task_queue = ctx.Queue()
+        self.result_queue = ctx.Queue()
+        self.pending = {}
+        self.pending_lock = threading.Lock()
+        self.batch_ids = itertools.count()
+        self.ready_count = 0
+        self.ready_changed = threading.Event()
+
+        # Split the cores between workers so they don't oversubscribe each other
+        threads_per_worker = max(1, (os.cpu_count() or 1) // workers)
+        self.processes = [
+            ctx.Process(
+                target=_embedding_worker,
+                args=(self.task_queue, self.result_queue, backend, threads_per_worker, batch_size),
+                daemon=True
+            )
+            for _ in range(workers)
+        ]
+        for process in self.processes:
+            process.start()
+
+        threading.Thread(target=self._collect_results, daemon=True).start()
+        print(f"✅ Embedding pool started with {workers} {backend} workers (batch size {batch_size})")
+
+    def _collect_results(self):
+        while True:
+            batch_id, vectors, error = self.result_queue.get()
+            if batch_id is None:
+                self.ready_count += 1
+                self.ready_changed.set()
+                continue
+
+            with self.pending_lock:
+                future = self.pending.pop(batch_id, None)
+            if future is None:
+                continue
+
+            if error:
+                future.set_exception(RuntimeError(error))
+            else:
+                future.set_result(vectors)
+
+    def wait_until_ready(self, timeout: float = EMBEDDING_TIMEOUT_SECONDS) -> bool:
+        """Block until every worker has loaded the model; gives up early once a worker has died"""
+        deadline = time.monotonic() + timeout
+        while self.ready_count < self.workers:
+            if self.alive_workers() < self.workers or time.monotonic() >= deadline:
+                return False
+            self.ready_changed.wait(EMBEDDING_LIVENESS_CHECK_SECONDS)
+            self.ready_changed.clear()
+        return True
+
+    def alive_workers(self) -> int:
+        return sum(1 for process in self.processes if process.is_alive())
+
+    def submit(self, texts: List[str]) -> concurrent.futures.Future:
+        """Queue one batch and return a future for its vectors"""
+        future = concurrent.futures.Future()
+        batch_id = next(self.batch_ids)
+        future.batch_id = batch_id
+        with self.pending_lock:
+            self.pending[batch_id] = future
+        self.task_queue.put((batch_id, texts))
+        return future
+
+    def _forget(self, futures: List[concurrent.futures.Future]):
+        """Drop batches nobody waits for anymore, so late or lost results don't pile up"""
+        with self.pending_lock:
+            for future in futures:
+                self.pending.pop(future.batch_id, None)
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        """Embed texts in parallel batches, preserving order; fails fast if workers die or never loaded"""
+        alive = self.alive_workers()
+        if alive == 0:
+            state = "failed to load the model" if self.ready_count == 0 else "exited"
+            raise RuntimeError(f"All embedding workers {state}")
+
+        futures = [
+            self.submit(texts[start:start + self.batch_size])
+            for start in range(0, len(texts), self.batch_size)
+        ]
+
+        try:
+            deadline = time.monotonic() + EMBEDDING_TIMEOUT_SECONDS
+            vectors = []
+            for future in futures:
+                while True:
+                    try:
+                        vectors.extend(future.result(timeout=EMBEDDING_LIVENESS_CHECK_SECONDS).tolist())
+                        break
+                    except concurrent.futures.TimeoutError:
+                        # A batch held by a worker that died will never come back
+                        if self.alive_workers() < alive:
+                            raise RuntimeError("An embedding worker exited while embedding")
+                        if time.monotonic() >= deadline:
+                            raise
+            return vectors
+        finally:
+            self._forget(futures)
+
+    def close(self):
+        for _ in self.processes:
+            self.task_queue.put(None)
+        for process in self.processes:
+            process.join(timeout=5)
+
+
+def get_embedding_pool() -> Optional[EmbeddingPool]:
+    """Start the shared embedding pool on first use"""
+    global _embedding_pool
+
+    if EMBEDDING_WORKERS <= 0:
+        return None
+
+    with _embedding_pool_lock:
+        if _embedding_pool is None:
+            try:
+                _embedding_pool = EmbeddingPool()
+            except Exception as e:
+                print(f"⚠️ Could not start embedding pool, embedding in-process: {e}")
+                return None
+        return _embedding_pool
+
+
+class QueryBatcher:
+    """Coalesce concurrent query embeddings into one batched forward pass"""
+
+    def __init__(self, embedder: Embeddings, window_ms: float = QUERY_BATCH_WINDOW_MS,
+                 max_batch: int = QUERY_MAX_BATCH):
+        self.embedder = embedder
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+        self.requests = queue.Queue()
+        self.stats = {"batches": 0, "queries": 0}
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def submit(self, text: str) -> concurrent.futures.Future:
+        future = concurrent.futures.Future()
+        self.requests.put((text, future))
+        return future
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.submit(text).result(timeout=EMBEDDING_TIMEOUT_SECONDS)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return await asyncio.wrap_future(self.submit(text))
+
+    def _collect(self) -> list:
+        """Requests arriving within the window, minus those whose callers already gave up"""
+        batch = [self.requests.get()]
+        deadline = time.monotonic() + self.window
+
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.requests.get(timeout=remaining))
+            except queue.Empty:
+                break
+
+        # A cancelled future (e.g. a disconnected stream client) is skipped rather than embedded
+        return [(text, future) for text, future in batch if future.set_running_or_notify_cancel()]
+
+    @staticmethod
+    def _resolve(future: concurrent.futures.Future, vector=None, error: Optional[BaseException] = None):
+        try:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(vector)
+        except concurrent.futures.InvalidStateError:
+            pass
+
+    def _run(self):
+        while True:
+            # Nothing in one batch may end the thread; every later query would wait on it
+            try:
+                batch = self._collect()
+                if not batch:
+                    continue
+
+                try:
+                    vectors = self.embedder.embed_documents([text for text, _ in batch])
+                    for (_, future), vector in zip(batch, vectors):
+                        self._resolve(future, vector)
+                except Exception as e:
+                    for _, future in batch:
+                        self._resolve(future, error=e)
+
+                self.stats["batches"] += 1
+                self.stats["queries"] += len(batch)
+            except Exception as e:
+                print(f"❗ Query batcher error: {e}")
+
+
+class PooledEmbeddings(Embeddings):
+    """LangChain embeddings that send document batches to the worker pool"""
+
+    def __init__(self, fallback: Embeddings, query_batcher: Optional[QueryBatcher] = None):
+        self.fallback = fallback
+        self.query_batcher = query_batcher
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        pool = get_embedding_pool()
+        if pool is None:
+            return self.fallback.embed_documents(texts)
+
+        try:
+            return pool.embed(list(texts))
+        except Exception as e:
+            print(f"⚠️ Embedding pool failed, embedding in-process: {e}")
+            return self.fallback.embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        if self.query_batcher is not None:
+            return self.query_batcher.embed_query(text)
+        return self.fallback.embed_query(text)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        if self.query_batcher is not None:
+            return await self.query_batcher.aembed_query(text)
+        return await asyncio.to_thread(self.fallback.embed_query, text)
+
+
+def benchmark_embedding_backends(num_chunks: int = 1024, chunk_chars: int = 600):
+    """Report chunks/sec for in-process embedding and each pool backend"""
+    from langchain_community.embeddings import HuggingFaceEmbeddings
+
+    sentence = "The mitochondria is the powerhouse of the cell and produces ATP through respiration. "
+    texts = [f"Chunk {i}: " + (sentence * (chunk_chars // len(sentence) + 1))[:chunk_chars] for i in range(num_chunks)]
+    results = {}
+
+    in_process = HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL_NAME, cache_folder=EMBEDDING_CACHE_DIR)
+    in_process.embed_documents(texts[:8])
+    start = time.perf_counter()
+    in_process.embed_documents(texts)
+    results["in-process"] = num_chunks / (time.perf_counter() - start)
+
+    for backend in ("torch", "int8"):
+        pool = EmbeddingPool(workers=max(1, EMBEDDING_WORKERS), backend=backend)
+        try:
+            pool.wait_until_ready()
+            start = time.perf_counter()
+            pool.embed(texts)
+            results[f"pool-{backend}"] = num_chunks / (time.perf_counter() - start)
+        finally:
+            pool.close()
+
+    for name, rate in results.items():
+        print(f"{name:>12}: {rate:8.1f} chunks/sec")
+    return results
+
+
+def benchmark_query_batching(concurrency: int = 32, rounds: int = 8):
+    """Compare per-query and micro-batched embedding under concurrent callers"""
+    from langchain_community.embeddings import HuggingFaceEmbeddings
+
+    model = HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL_NAME, cache_folder=EMBEDDING_CACHE_DIR)
+    batcher = QueryBatcher(model)
+    queries = [f"explain the krebs cycle step {i}" for i in range(concurrency * rounds)]
+    model.embed_query(queries[0])
+
+    for name, embed in (("per-query", model.embed_query), ("batched", batcher.embed_query)):
+        latencies = []
+
+        def timed(text):
+            start = time.perf_counter()
+            embed(text)
+            latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+            list(executor.map(timed, queries))
+        elapsed = time.perf_counter() - start
+
+        latencies.sort()
+        p99 = latencies[int(len(latencies) * 0.99) - 1] * 1000
+        print(f"{name:>10}: {len(queries) / elapsed:8.1f} queries/sec, p99 {p99:7.1f} ms")
+
+    print(f"Batcher ran {batcher.stats['batches']} batches for {batcher.stats['queries']} queries")
+
+
+if __name__ == "__main__":
+    benchmark_embedding_backends()
+    benchmark_query_batching()
@@ -0,0 +1,258 @@
+import os
+import json
+import asyncio
+import time
+import hashlib
+import threading
+from dataclasses import dataclass
+from typing import Callable, Dict, Optional
+
+import requests
+
+# Shared on-disk cache for every URL the Doc Q&A ingestion fetches
+HTTP_CACHE_DIR = os.path.join("data", "http_cache")
+# Entries younger than this are served without touching the network; older ones are revalidated
+HTTP_CACHE_TTL_SECONDS = int(os.getenv("DOC_QNA_HTTP_CACHE_TTL_SECONDS", "3600"))
+# Past this size the least recently used entries are deleted, down to HTTP_CACHE_EVICT_TO of it
+HTTP_CACHE_MAX_BYTES = int(os.getenv("DOC_QNA_HTTP_CACHE_MAX_MB", "256")) * 1024 * 1024
+HTTP_CACHE_EVICT_TO = 0.9
+
+DEFAULT_HEADERS = {"User-Agent": "Mozilla/5.0"}
+
+http_cache_stats = {"fresh": 0, "revalidated": 0, "fetched": 0, "stale": 0, "bytes_saved": 0, "parsed_hits": 0,
+                    "evicted": 0}
+_stats_lock = threading.Lock()
+# Bytes on disk, counted from the directory on the first write and kept up to date after that
+_cache_size = {"bytes": None}
+_size_lock = threading.Lock()
+
+
+@dataclass
+class CachedResponse:
+    url: str
+    status: str  # fresh, revalidated, fetched or stale
+    content: bytes
+    encoding: Optional[str]
+    content_type: str
+    digest: str
+
+    @property
+    def text(self) -> str:
+        return self.content.decode(self.encoding or "utf-8", errors="replace")
+
+
+def _count(key: str, amount: int = 1):
+    with _stats_lock:
+        http_cache_stats[key] += amount
+
+
+def _entry_path(url: str, suffix: str) -> str:
+    return os.path.join(HTTP_CACHE_DIR, hashlib.sha256(url.encode()).hexdigest() + suffix)
+
+
+def _write_atomic(path: str, data: bytes):
+    os.makedirs(HTTP_CACHE_DIR, exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+    _account(len(data))
+
+
+def _disk_entries() -> Dict[str, Dict]:
+    """url hash -> bytes, last use and file names of every entry on disk; files being written are left out"""
+    entries = {}
+    for item in os.scandir(HTTP_CACHE_DIR):
+        if item.name.endswith(".tmp"):
+            continue
+        try:
+            stat = item.stat()
+        except OSError:
+            continue
+        entry = entries.setdefault(item.name.split(".", 1)[0], {"bytes": 0, "used": 0.0, "files": []})
+        entry["bytes"] += stat.st_size
+        entry["files"].append(item.path)
+        # Hits touch the metadata file and writes are new files, so the newest one dates the last use
+        entry["used"] = max(entry["used"], stat.st_mtime)
+    return entries
+
+
+def _account(written: int):
+    """Count bytes written and delete the least recently used entries once the cache is over its size"""
+    with _size_lock:
+        if _cache_size["bytes"] is not None:
+            _cache_size["bytes"] += written
+            if _cache_size["bytes"] <= HTTP_CACHE_MAX_BYTES:
+                return
+
+        # Overwritten entries were counted twice; the directory has the exact size
+        entries = _disk_entries()
+        total = sum(entry["bytes"] for entry in entries.values())
+        evicted = 0
+        if total > HTTP_CACHE_MAX_BYTES:
+            for entry in sorted(entries.values(), key=lambda entry: entry["used"]):
+                if total <= HTTP_CACHE_MAX_BYTES * HTTP_CACHE_EVICT_TO:
+                    break
+                for path in entry["files"]:
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+                total -= entry["bytes"]
+                evicted += 1
+        _cache_size["bytes"] = total
+    if evicted:
+        _count("evicted", evicted)
+
+
+def _load_entry(url: str) -> Optional[Dict]:
+    meta_path, body_path = _entry_path(url, ".json"), _entry_path(url, ".body")
+    if not (os.path.exists(meta_path) and os.path.exists(body_path)):
+        return None
+    try:
+        with open(meta_path, "r", encoding="utf-8") as f:
+            entry = json.load(f)
+        with open(body_path, "rb") as f:
+            entry["content"] = f.read()
+        # Marks the entry as recently used for eviction
+        os.utime(meta_path)
+        return entry
+    except (OSError, ValueError):
+        return None
+
+
+def _store_entry(url: str, headers, content: bytes, encoding: Optional[str]) -> Optional[Dict]:
+    """Cache a 200 response, unless the server asked us not to"""
+    if "no-store" in headers.get("cache-control", "").lower():
+        return None
+
+    entry = {
+        "url": url,
+        "etag": headers.get("etag"),
+        "last_modified": headers.get("last-modified"),
+        "content_type": headers.get("content-type", ""),
+        "encoding": encoding,
+        "digest": hashlib.sha256(content).hexdigest(),
+        "fetched_at": time.time(),
+    }
+    _write_atomic(_entry_path(url, ".body"), content)
+    _write_atomic(_entry_path(url, ".json"), json.dumps(entry).encode())
+    entry["content"] = content
+    return entry
+
+
+def _touch_entry(url: str, entry: Dict):
+    """Restart the freshness window after a 304"""
+    entry["fetched_at"] = time.time()
+    meta = {key: value for key, value in entry.items() if key != "content"}
+    _write_atomic(_entry_path(url, ".json"), json.dumps(meta).encode())
+
+
+def _is_fresh(entry: Dict) -> bool:
+    return time.time() - entry["fetched_at"] < HTTP_CACHE_TTL_SECONDS
+
+
+def _conditional_headers(entry: Optional[Dict]) -> Dict:
+    headers = dict(DEFAULT_HEADERS)
+    if entry:
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+    return headers
+
+
+def _to_response(url: str, entry: Dict, status: str) -> CachedResponse:
+    if status in ("fresh", "revalidated", "stale"):
+        _count("bytes_saved", len(entry["content"]))
+    _count(status)
+    return CachedResponse(
+        url=url,
+        status=status,
+        content=entry["content"],
+        encoding=entry.get("encoding"),
+        content_type=entry.get("content_type", ""),
+        digest=entry["digest"],
+    )
+
+
+def _uncached_response(url: str, headers, content: bytes, encoding: Optional[str]) -> CachedResponse:
+    _count("fetched")
+    return CachedResponse(url=url, status="fetched", content=content, encoding=encoding,
+                          content_type=headers.get("content-type", ""),
+                          digest=hashlib.sha256(content).hexdigest())
+
+
+def fetch_url(url: str, timeout: float = 10) -> CachedResponse:
+    """GET through the cache with requests; revalidates stale entries with a conditional request"""
+    entry = _load_entry(url)
+    if entry and _is_fresh(entry):
+        return _to_response(url, entry, "fresh")
+
+    try:
+        response = requests.get(url, timeout=timeout, headers=_conditional_headers(entry))
+    except requests.exceptions.RequestException:
+        if entry:
+            print(f"⚠️ Could not revalidate {url}, serving cached copy")
+            return _to_response(url, entry, "stale")
+        raise
+
+    if response.status_code == 304 and entry:
+        _touch_entry(url, entry)
+        return _to_response(url, entry, "revalidated")
+
+    response.raise_for_status()
+    stored = _store_entry(url, response.headers, response.content, response.encoding)
+    if stored is None:
+        return _uncached_response(url, response.headers, response.content, response.encoding)
+    return _to_response(url, stored, "fetched")
+
+
+async def afetch_url(client, url: str) -> CachedResponse:
+    """Async counterpart of fetch_url for an httpx.AsyncClient; cache files are read and written in a thread"""
+    import httpx
+
+    entry = await asyncio.to_thread(_load_entry, url)
+    if entry and _is_fresh(entry):
+        return _to_response(url, entry, "fresh")
+
+    try:
+        response = await client.get(url, headers=_conditional_headers(entry))
+    except httpx.TransportError:
+        if entry:
+            print(f"⚠️ Could not revalidate {url}, serving cached copy")
+            return _to_response(url, entry, "stale")
+        raise
+
+    if response.status_code == 304 and entry:
+        await asyncio.to_thread(_touch_entry, url, entry)
+        return _to_response(url, entry, "revalidated")
+
+    response.raise_for_status()
+    stored = await asyncio.to_thread(_store_entry, url, response.headers, response.content, response.encoding)
+    if stored is None:
+        return _uncached_response(url, response.headers, response.content, response.encoding)
+    return _to_response(url, stored, "fetched")
+
+
+def cached_parse(response: CachedResponse, parser: str, parse: Callable[[str], object]):
+    """Parse a response body once per URL and body version; the result must be JSON-serializable"""
+    path = _entry_path(response.url, f".{parser}.parsed")
+    if os.path.exists(path):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                cached = json.load(f)
+            if cached["digest"] == response.digest:
+                _count("parsed_hits")
+                return cached["value"]
+        except (OSError, ValueError, KeyError):
+            pass
+
+    value = parse(response.text)
+    _write_atomic(path, json.dumps({"digest": response.digest, "value": value}).encode())
+    return value
+
+
+def get_http_cache_stats() -> Dict:
+    with _stats_lock:
+        return dict(http_cache_stats)
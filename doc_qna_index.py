@@ -0,0 +1,346 @@
+import os
+import time
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import faiss
+from langchain.schema import Document
+
+# Corpus sizes at which the dense index is retrained into the next tier
+ANN_IVF_THRESHOLD = int(os.getenv("DOC_QNA_ANN_IVF_THRESHOLD", "50000"))
+ANN_PQ_THRESHOLD = int(os.getenv("DOC_QNA_ANN_PQ_THRESHOLD", "500000"))
+ANN_NPROBE = int(os.getenv("DOC_QNA_ANN_NPROBE", "16"))
+# Flat vectors are stored as fp16 unless this is turned off
+ANN_FLAT_FP16 = os.getenv("DOC_QNA_ANN_FLAT_FP16", "true").lower() == "true"
+ANN_PQ_BYTES = 96  # Bytes per vector in the PQ tier; must divide the embedding dimension
+ANN_CHECK_INTERVAL_SECONDS = 60
+# Filtered searches over at most this many vectors are answered exactly from the stored vectors
+ANN_FILTER_EXACT_MAX = int(os.getenv("DOC_QNA_ANN_FILTER_EXACT_MAX", "256"))
+
+TIERS = ("flat", "ivf", "ivfpq")
+
+
+def index_tier(index) -> str:
+    if isinstance(index, faiss.IndexIVFPQ):
+        return "ivfpq"
+    if isinstance(index, faiss.IndexIVF):
+        return "ivf"
+    return "flat"
+
+
+def target_tier(ntotal: int) -> str:
+    if ntotal >= ANN_PQ_THRESHOLD:
+        return "ivfpq"
+    if ntotal >= ANN_IVF_THRESHOLD:
+        return "ivf"
+    return "flat"
+
+
+def _reconstruct(index, ids: np.ndarray) -> np.ndarray:
+    vectors = np.empty((len(ids), index.d), dtype=np.float32)
+    for row, faiss_id in enumerate(ids):
+        vectors[row] = index.reconstruct(int(faiss_id))
+    return vectors
+
+
+def _held_vectors(index, ids: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Vectors of the ids the index still holds, skipping the rest, as (ids, vectors)"""
+    held, vectors = [], []
+    for faiss_id in ids.tolist():
+        try:
+            vectors.append(index.reconstruct(faiss_id))
+        except RuntimeError:
+            continue
+        held.append(faiss_id)
+    return np.array(held, dtype=np.int64), np.array(vectors, dtype=np.float32).reshape(len(held), index.d)
+
+
+def new_flat_index(d: int):
+    """Flat tier: exact search, ids that survive deletions, fp16 storage by default"""
+    if ANN_FLAT_FP16:
+        inner = faiss.IndexScalarQuantizer(d, faiss.ScalarQuantizer.QT_fp16, faiss.METRIC_L2)
+    else:
+        inner = faiss.IndexFlatL2(d)
+    return faiss.IndexIDMap2(inner)
+
+
+def build_index(tier: str, vectors: np.ndarray, ids: np.ndarray):
+    """Train and fill an index of the given tier"""
+    n, d = vectors.shape
+    if tier == "flat":
+        index = new_flat_index(d)
+        index.add_with_ids(vectors, ids)
+        return index
+
+    nlist = int(min(max(16, 4 * np.sqrt(n)), n // 39 or 1))
+    quantizer = faiss.IndexFlatL2(d)
+    if tier == "ivfpq":
+        index = faiss.IndexIVFPQ(quantizer, d, nlist, ANN_PQ_BYTES, 8)
+    else:
+        index = faiss.IndexIVFScalarQuantizer(quantizer, d, nlist, faiss.ScalarQuantizer.QT_8bit, faiss.METRIC_L2)
+
+    # k-means needs a few dozen points per list; more only slows training down
+    sample = vectors[np.random.RandomState(0).permutation(n)[:nlist * 64]]
+    index.train(sample)
+    index.add_with_ids(vectors, ids)
+    index.set_direct_map_type(faiss.DirectMap.Hashtable)  # reconstruct() for the next migration
+    index.nprobe = ANN_NPROBE
+    index.own_fields = True
+    quantizer.this.disown()
+    return index
+
+
+def prepare_index(vector_store):
+    """Give a loaded store an index whose ids stay put when chunks are deleted"""
+    index = vector_store.index
+    if isinstance(index, (faiss.IndexIDMap2, faiss.IndexIVF)):
+        if isinstance(index, faiss.IndexIVF):
+            index.nprobe = ANN_NPROBE
+        return
+
+    # Plain flat index from an older save: positions become the ids, so index_to_docstore_id stays valid
+    ids = np.array(sorted(vector_store.index_to_docstore_id), dtype=np.int64)
+    new_index = new_flat_index(index.d)
+    if len(ids):
+        new_index.add_with_ids(_reconstruct(index, ids), ids)
+    vector_store.index = new_index
+
+
+def add_embeddings_with_ids(vector_store, texts: List[str], vectors, metadatas: List[Dict]) -> Tuple[List[str], List[int]]:
+    """Add vectors under fresh ids, in place of FAISS.add_embeddings which assumes a compacting flat index"""
+    mapping = vector_store.index_to_docstore_id
+    # Ids of evicted chunks are not handed out again, even at the end of the range
+    start = max(max(mapping) + 1 if mapping else 0, getattr(vector_store.docstore, "next_id", 0))
+    faiss_ids = np.arange(start, start + len(texts), dtype=np.int64)
+    # Docstore ids are the index ids, so the chunk store can address rows by integer
+    chunk_ids = [str(faiss_id) for faiss_id in faiss_ids.tolist()]
+
+    vector_store.index.add_with_ids(np.asarray(vectors, dtype=np.float32), faiss_ids)
+    vector_store.docstore.add({
+        chunk_id: Document(page_content=text, metadata=metadata)
+        for chunk_id, text, metadata in zip(chunk_ids, texts, metadatas)
+    })
+    mapping.update(zip(faiss_ids.tolist(), chunk_ids))
+    return chunk_ids, faiss_ids.tolist()
+
+
+def delete_chunks(vector_store, chunk_ids: List[str]) -> int:
+    """Remove chunks without renumbering the remaining ids"""
+    targets = set(chunk_ids)
+    faiss_ids = [faiss_id for faiss_id, chunk_id in vector_store.index_to_docstore_id.items() if chunk_id in targets]
+    if not faiss_ids:
+        return 0
+
+    vector_store.index.remove_ids(np.array(faiss_ids, dtype=np.int64))
+    vector_store.docstore.delete([vector_store.index_to_docstore_id.pop(faiss_id) for faiss_id in faiss_ids])
+    return len(faiss_ids)
+
+
+def search_filtered(index, query_vector, ids: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Nearest neighbours among the given ids only, as (distances, ids)"""
+    query = np.asarray(query_vector, dtype=np.float32).reshape(1, -1)
+    ids = np.asarray(ids, dtype=np.int64)
+    if not len(ids):
+        return np.empty(0, dtype=np.float32), ids
+
+    # Small subsets: scoring every member exactly is cheaper than scanning the index
+    if len(ids) <= ANN_FILTER_EXACT_MAX:
+        try:
+            vectors = index.reconstruct_batch(ids)
+        except RuntimeError:
+            # Ids can fall out of step with the index after a failed add or an eviction; score the ones it holds
+            ids, vectors = _held_vectors(index, ids)
+        distances = ((vectors - query) ** 2).sum(axis=1)
+        top = np.argsort(distances)[:k]
+        return distances[top], ids[top]
+
+    # A bitmap over the id range is much cheaper to build per query than a hashed id set
+    members = np.zeros(int(ids.max()) + 1, dtype=bool)
+    members[ids] = True
+    bitmap = np.packbits(members, bitorder="little")
+    selector = faiss.IDSelectorBitmap(len(bitmap), faiss.swig_ptr(bitmap))
+    if isinstance(index, faiss.IndexIVF):
+        # Only a fraction of each probed list passes the filter, so probe proportionally more lists
+        fraction = len(ids) / max(1, index.ntotal)
+        nprobe = min(index.nlist, int(np.ceil(ANN_NPROBE / fraction)))
+        params = faiss.SearchParametersIVF(sel=selector, nprobe=nprobe)
+    else:
+        params = faiss.SearchParameters(sel=selector)
+
+    distances, found = index.search(query, k, params=params)
+    keep = found[0] >= 0
+    return distances[0][keep], found[0][keep]
+
+
+class IndexTierManager:
+    """Retrain the dense index into a faster tier in the background and swap it in under the write lock"""
+
+    def __init__(self, get_store: Callable, lock, save: Callable[[], None]):
+        self.get_store = get_store
+        self.lock = lock
+        self.save = save
+        self.migrating = threading.Lock()
+        self.last_migration: Optional[Dict] = None
+
+    def maybe_upgrade(self):
+        """Start a migration if the corpus has outgrown its tier and none is running"""
+        store = self.get_store()
+        if store is None:
+            return
+        current, wanted = index_tier(store.index), target_tier(store.index.ntotal)
+        if TIERS.index(wanted) > TIERS.index(current) and self.migrating.acquire(blocking=False):
+            threading.Thread(target=self._migrate, args=(wanted,), daemon=True).start()
+
+    def _migrate(self, tier: str):
+        try:
+            started = time.time()
+            with self.lock.read_lock():
+                store = self.get_store()
+                old_index = store.index
+                ids = np.array(sorted(store.index_to_docstore_id), dtype=np.int64)
+                vectors = _reconstruct(old_index, ids)
+
+            print(f"🏗️ Building {tier} index for {len(ids)} vectors")
+            new_index = build_index(tier, vectors, ids)
+
+            with self.lock.write_lock():
+                store = self.get_store()
+                if store is None or store.index is not old_index:
+                    return
+
+                # Catch up with chunks added or evicted while the new index was training
+                live = set(store.index_to_docstore_id)
+                snapshot = set(ids.tolist())
+                added = np.array(sorted(live - snapshot), dtype=np.int64)
+                removed = np.array(sorted(snapshot - live), dtype=np.int64)
+                if len(added):
+                    new_index.add_with_ids(_reconstruct(old_index, added), added)
+                if len(removed):
+                    new_index.remove_ids(removed)
+
+                store.index = new_index
+                self.save()
+
+            self.last_migration = {"tier": tier, "vectors": int(new_index.ntotal), "seconds": round(time.time() - started, 1)}
+            print(f"✅ Switched to {tier} index ({new_index.ntotal} vectors)")
+        except Exception as e:
+            print(f"❗ Index migration to {tier} failed: {e}")
+        finally:
+            self.migrating.release()
+
+    def run(self):
+        """Background loop that also catches corpora loaded above a threshold"""
+        while True:
+            try:
+                self.maybe_upgrade()
+            except Exception as e:
+                print(f"❗ Index tier check failed: {e}")
+            time.sleep(ANN_CHECK_INTERVAL_SECONDS)
+
+    def stats(self) -> Dict:
+        store = self.get_store()
+        return {
+            "tier": index_tier(store.index) if store is not None else None,
+            "vectors": int(store.index.ntotal) if store is not None else 0,
+            "migrating": self.migrating.locked(),
+            "last_migration": self.last_migration,
+        }
+
+
+def _synthetic_embeddings(num_vectors: int, num_queries: int, d: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Topic clusters with low-rank variation inside each, normalized like sentence embeddings"""
+    rng = np.random.RandomState(0)
+    centers = rng.randn(256, d).astype(np.float32)
+    projection = rng.randn(32, d).astype(np.float32)
+
+    def embeddings_like(n):
+        latent = rng.randn(n, 32).astype(np.float32)
+        points = centers[rng.randint(0, 256, n)] + 0.15 * latent @ projection + 0.02 * rng.randn(n, d).astype(np.float32)
+        return points / np.linalg.norm(points, axis=1, keepdims=True)
+
+    return embeddings_like(num_vectors), embeddings_like(num_queries)
+
+
+def benchmark_index_tiers(num_vectors: int = 100000, d: int = 384, num_queries: int = 200, k: int = 10):
+    """Recall@k against exact search, per-query latency and bytes per vector for each candidate index"""
+    vectors, queries = _synthetic_embeddings(num_vectors, num_queries, d)
+    ids = np.arange(num_vectors, dtype=np.int64)
+
+    exact = faiss.IndexFlatL2(d)
+    exact.add(vectors)
+    _, truth = exact.search(queries, k)
+
+    def hnsw():
+        index = faiss.IndexHNSWFlat(d, 32)
+        index.hnsw.efSearch = 64
+        index.add(vectors)
+        return index
+
+    def flat_fp32():
+        index = faiss.IndexIDMap2(faiss.IndexFlatL2(d))
+        index.add_with_ids(vectors, ids)
+        return index
+
+    candidates = {
+        "flat fp32": (flat_fp32, 4 * d + 16),
+        "flat fp16": (lambda: build_index("flat", vectors, ids), 2 * d + 16),
+        "ivf sq8": (lambda: build_index("ivf", vectors, ids), d + 8),
+        "ivf pq": (lambda: build_index("ivfpq", vectors, ids), ANN_PQ_BYTES + 8),
+        "hnsw": (hnsw, 4 * d + 32 * 2 * 4),
+    }
+
+    print(f"{num_vectors} vectors, d={d}, recall@{k} over {num_queries} queries")
+    for name, (build, bytes_per_vector) in candidates.items():
+        start = time.perf_counter()
+        index = build()
+        build_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for query in queries:
+            _, found = index.search(query[np.newaxis, :], k)
+        latency_ms = (time.perf_counter() - start) / num_queries * 1000
+
+        _, found = index.search(queries, k)
+        recall = np.mean([len(set(found[i]) & set(truth[i])) / k for i in range(num_queries)])
+        print(f"{name:>10}: recall {recall:.3f}, {latency_ms:6.2f} ms/query, "
+              f"~{bytes_per_vector} bytes/vector, built in {build_seconds:.1f}s")
+
+
+def benchmark_filtered_search(num_vectors: int = 100000, d: int = 384, num_queries: int = 100, k: int = 10,
+                              fractions=(0.001, 0.01, 0.1, 0.5)):
+    """Latency and recall@k of filtered search against post-filtering the global top-k, per tier and filter size"""
+    vectors, queries = _synthetic_embeddings(num_vectors, num_queries, d)
+    ids = np.arange(num_vectors, dtype=np.int64)
+
+    def timed(search):
+        start = time.perf_counter()
+        found = [search(query) for query in queries]
+        return (time.perf_counter() - start) / num_queries * 1000, found
+
+    for tier in ("flat", "ivf"):
+        index = build_index(tier, vectors, ids)
+        unfiltered_ms, _ = timed(lambda query: index.search(query[np.newaxis, :], k))
+        print(f"{tier}: unfiltered {unfiltered_ms:.2f} ms/query")
+
+        for fraction in fractions:
+            # A source's chunks get consecutive ids, so a filter is a few contiguous id ranges
+            subset = ids[:max(k, int(num_vectors * fraction))]
+            _, truth = timed(lambda query: np.argsort(((vectors[subset] - query) ** 2).sum(axis=1))[:k])
+
+            post_ms, post = timed(lambda query: [i for i in index.search(query[np.newaxis, :], 10 * k)[1][0] if i in subset][:k])
+            filtered_ms, filtered = timed(lambda query: search_filtered(index, query, subset, k)[1])
+
+            def recall(found):
+                return np.mean([len(set(f) & set(subset[t])) / k for f, t in zip(found, truth)])
+
+            print(f"  {len(subset):>6} ids: post-filter top-{10 * k} {post_ms:6.2f} ms recall {recall(post):.3f} | "
+                  f"filtered {filtered_ms:6.2f} ms recall {recall(filtered):.3f}")
+
+
+if __name__ == "__main__":
+    import sys
+    if sys.argv[1:] == ["filtered"]:
+        benchmark_filtered_search()
+    else:
+        benchmark_index_tiers()
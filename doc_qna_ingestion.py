@@ -0,0 +1,184 @@
+import os
+import queue
+import signal
+import time
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, Iterable, Iterator, List, Optional
+
+from langchain.schema import Document
+
+from function_for_DOC_QNA import iter_text_auto
+from doc_qna_chunking import chunk_text
+
+# Pages waiting between the extraction process and the chunker
+PAGE_BUFFER_SIZE = int(os.getenv("DOC_QNA_PAGE_BUFFER_SIZE", "8"))
+# Chunks embedded and indexed together; each batch becomes searchable on its own
+INDEX_BATCH_SIZE = int(os.getenv("DOC_QNA_INDEX_BATCH_SIZE", "128"))
+# Longest the pipeline waits for the next page, and for a whole file, before killing its extraction process
+PAGE_TIMEOUT_SECONDS = int(os.getenv("DOC_QNA_PAGE_TIMEOUT_SECONDS", "120"))
+EXTRACTION_TIMEOUT_SECONDS = int(os.getenv("DOC_QNA_EXTRACTION_TIMEOUT_SECONDS", "300"))
+# Extractions caught in a pool broken by another file's killed process restart this often on a fresh pool
+EXTRACTION_RETRIES = 1
+
+
+def _extract_pages_to_queue(file_path, page_queue, stop_event):
+    """Extraction process: push page texts into a bounded queue, then a sentinel"""
+    def put(item):
+        # Bounded put that gives up once the consumer has gone away
+        while not stop_event.is_set():
+            try:
+                page_queue.put(item, timeout=1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    try:
+        # Lets the consumer kill this process if extraction hangs
+        if not put(("started", os.getpid())):
+            return
+        for page_text in iter_text_auto(file_path):
+            if not put(("page", page_text)):
+                return
+        put(("done", None))
+    except Exception as e:
+        put(("error", str(e)))
+
+
+def _kill_process(pid: int):
+    try:
+        os.kill(pid, getattr(signal, "SIGKILL", signal.SIGTERM))
+    except OSError:
+        pass
+
+
+def stream_pages(file_path: str, get_pool: Callable, manager, timeout: float = EXTRACTION_TIMEOUT_SECONDS,
+                 page_timeout: float = PAGE_TIMEOUT_SECONDS,
+                 discard_pool: Optional[Callable] = None) -> Iterator[str]:
+    """Yield page texts while they are still being extracted in the process pool.
+
+    The timeouts count time spent waiting for pages once a process has picked the file up, not time
+    queued behind other files or spent by the caller. A stuck process is killed and its pool handed
+    to discard_pool to be replaced."""
+    yielded = 0
+    retries = 0
+    waited = 0.0
+
+    while True:
+        pool = get_pool()
+        page_queue = manager.Queue(maxsize=PAGE_BUFFER_SIZE)
+        stop_event = manager.Event()
+        future = pool.submit(_extract_pages_to_queue, file_path, page_queue, stop_event)
+        pid, skip, idle = None, yielded, 0.0
+
+        try:
+            while True:
+                started = time.monotonic()
+                try:
+                    kind, payload = page_queue.get(timeout=1)
+                except queue.Empty:
+                    kind, payload = None, None
+                if pid is not None:
+                    waited += time.monotonic() - started
+                    idle += time.monotonic() - started
+
+                if kind is None:
+                    if future.done() and future.exception() is not None:
+                        raise future.exception()
+                    if waited > timeout or idle > page_timeout:
+                        raise TimeoutError("Timed out waiting for extracted text")
+                elif kind == "started":
+                    pid = payload
+                elif kind == "page":
+                    idle = 0.0
+                    # A restarted extraction skips the pages already passed on
+                    if skip:
+                        skip -= 1
+                        continue
+                    yielded += 1
+                    yield payload
+                elif kind == "done":
+                    return
+                else:
+                    raise ValueError(payload)
+
+        except BrokenProcessPool:
+            # Another file's extraction process was killed (or crashed) and took the pool down with it
+            if discard_pool:
+                discard_pool(pool)
+            if retries >= EXTRACTION_RETRIES:
+                raise
+            retries += 1
+            print(f"🔁 Extraction pool was restarted, extracting {os.path.basename(file_path)} again")
+
+        except TimeoutError:
+            _kill_process(pid)
+            if discard_pool:
+                discard_pool(pool)
+            raise
+
+        finally:
+            stop_event.set()
+
+
+def iter_chunks(segments: Iterable[str]) -> Iterator[Document]:
+    """Split text segments into token-sized chunks one segment at a time"""
+    number = 0
+    for segment in segments:
+        if not segment or not segment.strip():
+            continue
+        if segment.startswith("❗"):
+            # Extractors report problems inline; never index them as content
+            print(segment)
+            continue
+
+        for chunk in chunk_text(segment):
+            if chunk.page_content.strip():
+                # Consecutive numbers let retrieval stitch neighbouring chunks back together
+                chunk.metadata["chunk"] = number
+                number += 1
+                yield chunk
+
+
+def iter_batches(items: Iterable, size: int) -> Iterator[List]:
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def ingest_segments(segments: Iterable[str],
+                    embed_batch: Callable[[List[str]], List[List[float]]],
+                    index_batch: Callable[[List[Document], List[List[float]]], int],
+                    on_stage: Optional[Callable[[str, int], None]] = None,
+                    batch_size: int = INDEX_BATCH_SIZE,
+                    select_batch: Optional[Callable[[List[Document]], List[Document]]] = None) -> int:
+    """Chunk, embed and index text as it arrives, one bounded batch at a time"""
+    indexed = 0
+
+    def announce_chunking(segments):
+        for number, segment in enumerate(segments):
+            if number == 0 and on_stage:
+                on_stage("chunking", indexed)
+            yield segment
+
+    for batch in iter_batches(iter_chunks(announce_chunking(segments)), batch_size):
+        # Chunks dropped here are never embedded
+        if select_batch:
+            batch = select_batch(batch)
+            if not batch:
+                continue
+
+        if on_stage:
+            on_stage("embedding", indexed)
+        vectors = embed_batch([doc.page_content for doc in batch])
+
+        if on_stage:
+            on_stage("indexing", indexed)
+        indexed += index_batch(batch, vectors)
+
+    return indexed
@@ -0,0 +1,226 @@
+import os
+import queue
+import threading
+import uuid
+import multiprocessing
+import concurrent.futures
+from datetime import datetime
+from typing import Callable, Dict, Optional
+
+from database import SessionLocal, IngestionJob
+
+# Bounded ingestion: a fixed number of job runners, a fixed extraction process pool
+# and a queue that rejects new uploads once it is full
+INGESTION_WORKERS = int(os.getenv("DOC_QNA_INGESTION_WORKERS", "2"))
+INGESTION_QUEUE_SIZE = int(os.getenv("DOC_QNA_INGESTION_QUEUE_SIZE", "20"))
+EXTRACTION_PROCESSES = int(os.getenv("DOC_QNA_EXTRACTION_PROCESSES", str(max(1, (os.cpu_count() or 2) // 2))))
+RETRY_AFTER_SECONDS = 10
+
+JOB_STAGES = ("queued", "extracting", "chunking", "embedding", "indexing", "completed", "failed")
+TERMINAL_STAGES = ("completed", "failed")
+
+_job_queue = queue.Queue(maxsize=INGESTION_QUEUE_SIZE)
+_extraction_pool = None
+_extraction_pool_lock = threading.Lock()
+_queue_manager = None
+
+
+class IngestionQueueFull(Exception):
+    """Raised when an upload arrives while the ingestion queue is full"""
+
+
+def get_extraction_pool() -> concurrent.futures.ProcessPoolExecutor:
+    """Start the shared extraction process pool on first use"""
+    global _extraction_pool
+
+    with _extraction_pool_lock:
+        if _extraction_pool is None:
+            _extraction_pool = concurrent.futures.ProcessPoolExecutor(
+                max_workers=EXTRACTION_PROCESSES,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return _extraction_pool
+
+
+def discard_extraction_pool(pool: concurrent.futures.ProcessPoolExecutor):
+    """Drop a pool whose process was killed or crashed; the next get_extraction_pool() starts a fresh one"""
+    global _extraction_pool
+
+    with _extraction_pool_lock:
+        if _extraction_pool is pool:
+            _extraction_pool = None
+    pool.shutdown(wait=False)
+
+
+def get_queue_manager():
+    """Manager whose queues carry extracted pages back from the process pool"""
+    global _queue_manager
+
+    with _extraction_pool_lock:
+        if _queue_manager is None:
+            _queue_manager = multiprocessing.get_context("spawn").Manager()
+        return _queue_manager
+
+
+def _job_to_dict(job: IngestionJob) -> Dict:
+    return {
+        "id": job.id,
+        "filename": job.filename,
+        "file_path": job.file_path,
+        "namespace": job.namespace,
+        "content_hash": job.content_hash,
+        "status": job.status,
+        "error": job.error,
+        "chunk_count": job.chunk_count,
+        "created_at": job.created_at.isoformat() if job.created_at else None,
+        "updated_at": job.updated_at.isoformat() if job.updated_at else None,
+    }
+
+
+def create_job(filename: str, file_path: str, namespace: str = "public",
+               content_hash: Optional[str] = None) -> str:
+    """Persist a queued job and enqueue it, or raise IngestionQueueFull"""
+    job_id = uuid.uuid4().hex
+
+    db = SessionLocal()
+    try:
+        db.add(IngestionJob(
+            id=job_id,
+            filename=filename,
+            file_path=file_path,
+            namespace=namespace,
+            content_hash=content_hash,
+            status="queued"
+        ))
+        db.commit()
+    finally:
+        db.close()
+
+    try:
+        _job_queue.put_nowait(job_id)
+    except queue.Full:
+        db = SessionLocal()
+        try:
+            db.query(IngestionJob).filter(IngestionJob.id == job_id).delete()
+            db.commit()
+        finally:
+            db.close()
+        raise IngestionQueueFull()
+
+    return job_id
+
+
+def record_job(filename: str, status: str, namespace: str = "public", content_hash: Optional[str] = None,
+               error: Optional[str] = None) -> str:
+    """Persist a job that never goes through the queue, e.g. for an upload attached to existing content"""
+    job_id = uuid.uuid4().hex
+
+    db = SessionLocal()
+    try:
+        db.add(IngestionJob(
+            id=job_id,
+            filename=filename,
+            file_path="",
+            namespace=namespace,
+            content_hash=content_hash,
+            status=status,
+            error=error
+        ))
+        db.commit()
+    finally:
+        db.close()
+
+    return job_id
+
+
+def update_job(job_id: str, status: str, error: Optional[str] = None, chunk_count: Optional[int] = None):
+    """Move a job to another stage"""
+    db = SessionLocal()
+    try:
+        job = db.query(IngestionJob).filter(IngestionJob.id == job_id).first()
+        if job is None:
+            return
+        job.status = status
+        if error is not None:
+            job.error = error
+        if chunk_count is not None:
+            job.chunk_count = chunk_count
+        db.commit()
+    finally:
+        db.close()
+
+
+def get_job(job_id: str) -> Optional[Dict]:
+    db = SessionLocal()
+    try:
+        job = db.query(IngestionJob).filter(IngestionJob.id == job_id).first()
+        return _job_to_dict(job) if job else None
+    finally:
+        db.close()
+
+
+def get_latest_job_for_filename(filename: str) -> Optional[Dict]:
+    """Most recent job for a filename, for clients that still poll by name"""
+    db = SessionLocal()
+    try:
+        job = (
+            db.query(IngestionJob)
+            .filter(IngestionJob.filename == filename)
+            .order_by(IngestionJob.created_at.desc())
+            .first()
+        )
+        return _job_to_dict(job) if job else None
+    finally:
+        db.close()
+
+
+def is_queue_full() -> bool:
+    return _job_queue.full()
+
+
+def _run_jobs(handler: Callable[[Dict], None]):
+    while True:
+        job_id = _job_queue.get()
+        try:
+            job = get_job(job_id)
+            if job is not None and job["status"] not in TERMINAL_STAGES:
+                handler(job)
+        except Exception as e:
+            print(f"❗ Ingestion job {job_id} crashed: {e}")
+            update_job(job_id, "failed", error=str(e))
+        finally:
+            _job_queue.task_done()
+
+
+def _resume_unfinished_jobs(started_at: datetime):
+    """Requeue jobs interrupted by a restart whose upload is still on disk"""
+    db = SessionLocal()
+    try:
+        unfinished = (
+            db.query(IngestionJob)
+            .filter(IngestionJob.status.notin_(TERMINAL_STAGES))
+            .filter(IngestionJob.created_at < started_at)
+            .order_by(IngestionJob.created_at)
+            .all()
+        )
+        jobs = [(job.id, job.file_path) for job in unfinished]
+    finally:
+        db.close()
+
+    for job_id, file_path in jobs:
+        if not os.path.exists(file_path):
+            update_job(job_id, "failed", error="Upload was lost before processing finished")
+            continue
+        update_job(job_id, "queued")
+        _job_queue.put(job_id)  # Blocks until a runner frees a slot
+
+    if jobs:
+        print(f"🔁 Resumed {len(jobs)} unfinished ingestion jobs")
+
+
+def start_ingestion_workers(handler: Callable[[Dict], None]):
+    """Start the job runners and resume jobs left over from a previous run"""
+    started_at = datetime.utcnow()
+    for _ in range(INGESTION_WORKERS):
+        threading.Thread(target=_run_jobs, args=(handler,), daemon=True).start()
+    threading.Thread(target=_resume_unfinished_jobs, args=(started_at,), daemon=True).start()
@@ -0,0 +1,104 @@
+import threading
+from contextlib import contextmanager
+
+
+class ReadWriteLock:
+    """Many concurrent readers or one writer; waiting writers block new readers"""
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._readers = 0
+        self._writer = False
+        self._waiting_writers = 0
+
+    @contextmanager
+    def read_lock(self):
+        with self._condition:
+            while self._writer or self._waiting_writers:
+                self._condition.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._readers -= 1
+                if not self._readers:
+                    self._condition.notify_all()
+
+    @contextmanager
+    def write_lock(self):
+        with self._condition:
+            self._waiting_writers += 1
+            while self._writer or self._readers:
+                self._condition.wait()
+            self._waiting_writers -= 1
+            self._writer = True
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._writer = False
+                self._condition.notify_all()
+
+
+def benchmark_concurrent_queries(clients=(1, 4, 16, 64), queries_per_client: int = 8, llm_latency_ms: float = 50,
+                                 num_vectors: int = 50000, d: int = 384, k: int = 10):
+    """Query throughput as parallel clients grow: blocking handlers vs the retrieval executor with an exclusive or shared lock"""
+    import asyncio
+    import time
+    import concurrent.futures
+    import faiss
+    import numpy as np
+
+    rng = np.random.default_rng(0)
+    index = faiss.IndexFlatIP(d)
+    index.add(rng.standard_normal((num_vectors, d), dtype=np.float32))
+    query = rng.standard_normal((1, d), dtype=np.float32)
+    # One thread per search, so parallelism comes from concurrent clients only
+    faiss.omp_set_num_threads(1)
+
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=max(clients))
+    rw_lock, exclusive_lock = ReadWriteLock(), threading.Lock()
+    latency = llm_latency_ms / 1000
+
+    def search(lock):
+        with lock:
+            index.search(query, k)
+
+    # Each handler stands for one question: a query-expansion LLM call, then the index lookup
+    async def blocking(loop):
+        time.sleep(latency)
+        search(exclusive_lock)
+
+    async def exclusive(loop):
+        await asyncio.sleep(latency)
+        await loop.run_in_executor(executor, search, exclusive_lock)
+
+    async def shared(loop):
+        await asyncio.sleep(latency)
+        await loop.run_in_executor(executor, search, rw_lock.read_lock())
+
+    async def run(handler, num_clients):
+        loop = asyncio.get_running_loop()
+
+        async def client():
+            for _ in range(queries_per_client):
+                await handler(loop)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(client() for _ in range(num_clients)))
+        return num_clients * queries_per_client / (time.perf_counter() - start)
+
+    print(f"{'clients':>8} " + " ".join(f"{name:>16}" for name in ("blocking", "executor+lock", "executor+rwlock")))
+    results = {}
+    for num_clients in clients:
+        rates = [asyncio.run(run(handler, num_clients)) for handler in (blocking, exclusive, shared)]
+        results[num_clients] = rates
+        print(f"{num_clients:>8} " + " ".join(f"{rate:12.1f} q/s" for rate in rates))
+
+    executor.shutdown()
+    return results
+
+
+if __name__ == "__main__":
+    benchmark_concurrent_queries()
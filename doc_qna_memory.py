@@ -0,0 +1,224 @@
+import os
+import re
+import time
+import asyncio
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict
+
+from doc_qna_chunking import count_tokens
+from doc_qna_answer_cache import normalize_query
+
+# Recent turns are kept verbatim up to this many word pieces; older ones are folded into the summary
+MEMORY_MAX_TOKENS = int(os.getenv("DOC_QNA_MEMORY_MAX_TOKENS", "600"))
+MEMORY_SUMMARY_MAX_TOKENS = int(os.getenv("DOC_QNA_MEMORY_SUMMARY_MAX_TOKENS", "200"))
+MEMORY_SESSION_TTL_SECONDS = int(os.getenv("DOC_QNA_MEMORY_SESSION_TTL_SECONDS", str(2 * 3600)))
+MEMORY_MAX_SESSIONS = int(os.getenv("DOC_QNA_MEMORY_MAX_SESSIONS", "1000"))
+REWRITE_CACHE_MAX_ENTRIES = int(os.getenv("DOC_QNA_REWRITE_CACHE_MAX_ENTRIES", "1024"))
+# One answer may fill at most this share of the verbatim window
+TURN_ANSWER_MAX_TOKENS = MEMORY_MAX_TOKENS // 2
+
+# Questions without these words (or longer than a few words) are searched as they are
+FOLLOW_UP_WORDS = re.compile(
+    r"\b(it|its|this|that|these|those|they|them|their|he|she|him|her|there|above|previous|same|also|"
+    r"more|else|again|instead|why|what about|how about)\b",
+    re.IGNORECASE
+)
+FOLLOW_UP_MAX_WORDS = 4
+
+SUMMARY_PROMPT = """Update the running summary of a conversation about the user's documents.
+Keep names, numbers and what the user is trying to find out. Stay under {max_words} words.
+
+Current summary:
+{summary}
+
+New exchanges:
+{turns}
+
+Updated summary:"""
+
+REWRITE_PROMPT = """Rewrite the follow-up question as a standalone search query using the conversation.
+Return only the query.
+
+Conversation:
+{history}
+
+Follow-up question: {question}
+
+Standalone query:"""
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Cut text down to roughly max_tokens word pieces"""
+    tokens = count_tokens([text])[0]
+    if tokens <= max_tokens:
+        return text
+    words = text.split()
+    return " ".join(words[:max(1, len(words) * max_tokens // tokens)])
+
+
+def needs_rewrite(question: str) -> bool:
+    """Whether a question probably leans on earlier turns"""
+    return bool(FOLLOW_UP_WORDS.search(question)) or len(question.split()) <= FOLLOW_UP_MAX_WORDS
+
+
+class ConversationMemory:
+    """Per-session chat history held to a fixed token budget by summarizing older turns in the background"""
+
+    def __init__(self, complete: Callable[[str], Awaitable[str]]):
+        self.complete = complete
+        self.sessions: "OrderedDict[str, Dict]" = OrderedDict()
+        self.rewrites: "OrderedDict[str, str]" = OrderedDict()
+        self.lock = threading.Lock()
+        self.tasks = set()
+        self.stats = {"turns": 0, "compactions": 0, "compaction_failures": 0,
+                      "rewrites": 0, "rewrite_cache_hits": 0, "rewrites_skipped": 0}
+
+    def _session(self, session_id: str) -> Dict:
+        """Session state, creating it and dropping expired or least recently used sessions"""
+        now = time.time()
+        session = self.sessions.pop(session_id, None)
+        if session is None or now - session["last_used"] > MEMORY_SESSION_TTL_SECONDS:
+            session = {"summary": "", "turns": [], "pending": [], "compacting": False, "last_used": now}
+        session["last_used"] = now
+        self.sessions[session_id] = session
+
+        while len(self.sessions) > MEMORY_MAX_SESSIONS:
+            self.sessions.popitem(last=False)
+        return session
+
+    def history(self, session_id: str) -> str:
+        """Summary plus recent turns, ready to put in a prompt"""
+        with self.lock:
+            session = self._session(session_id)
+            summary, turns = session["summary"], list(session["turns"])
+
+        parts = []
+        if summary:
+            parts.append(f"Summary of earlier conversation: {summary}")
+        for turn in turns:
+            parts.append(f"User: {turn['question']}\nAssistant: {turn['answer']}")
+        return "\n\n".join(parts)
+
+    def record_turn(self, session_id: str, question: str, answer: str):
+        """Add an exchange; turns pushed out of the window are summarized after the response is sent"""
+        answer = truncate_to_tokens(answer, TURN_ANSWER_MAX_TOKENS)
+        tokens = count_tokens([f"User: {question}\nAssistant: {answer}"])[0]
+
+        with self.lock:
+            session = self._session(session_id)
+            session["turns"].append({"question": question, "answer": answer, "tokens": tokens})
+            self.stats["turns"] += 1
+
+            # Once over the window, evict down to two thirds of it so one summary call covers several turns
+            if sum(turn["tokens"] for turn in session["turns"]) > MEMORY_MAX_TOKENS:
+                while session["turns"] and sum(turn["tokens"] for turn in session["turns"]) > MEMORY_MAX_TOKENS * 2 // 3:
+                    session["pending"].append(session["turns"].pop(0))
+
+            start = bool(session["pending"]) and not session["compacting"]
+            if start:
+                session["compacting"] = True
+
+        if start:
+            task = asyncio.get_running_loop().create_task(self._compact(session_id))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+    async def _compact(self, session_id: str):
+        """Fold pending turns into the session summary until none are left"""
+        while True:
+            with self.lock:
+                session = self.sessions.get(session_id)
+                if session is None:
+                    return
+                if not session["pending"]:
+                    session["compacting"] = False
+                    return
+                pending, summary = list(session["pending"]), session["summary"]
+
+            turns = "\n\n".join(f"User: {turn['question']}\nAssistant: {turn['answer']}" for turn in pending)
+            try:
+                summary = await self.complete(SUMMARY_PROMPT.format(
+                    max_words=MEMORY_SUMMARY_MAX_TOKENS * 2 // 3, summary=summary or "(none)", turns=turns
+                ))
+                self.stats["compactions"] += 1
+            except Exception as e:
+                # The budget is hard: the turns are dropped rather than kept around unsummarized
+                print(f"❗ Conversation summary failed: {e}")
+                self.stats["compaction_failures"] += 1
+
+            with self.lock:
+                session["summary"] = truncate_to_tokens(summary.strip(), MEMORY_SUMMARY_MAX_TOKENS)
+                del session["pending"][:len(pending)]
+
+    async def standalone_query(self, session_id: str, question: str) -> str:
+        """Rewrite a follow-up into a query that retrieval can use without the conversation"""
+        history = self.history(session_id)
+        if not history or not needs_rewrite(question):
+            self.stats["rewrites_skipped"] += 1
+            return question
+
+        key = hashlib.sha256(f"{history}\x00{normalize_query(question)}".encode("utf-8")).hexdigest()
+        with self.lock:
+            cached = self.rewrites.get(key)
+            if cached is not None:
+                self.rewrites.move_to_end(key)
+                self.stats["rewrite_cache_hits"] += 1
+                return cached
+
+        try:
+            rewritten = (await self.complete(REWRITE_PROMPT.format(history=history, question=question))).strip()
+        except Exception as e:
+            print(f"Query rewrite failed: {e}")
+            return question
+        rewritten = rewritten or question
+
+        with self.lock:
+            self.rewrites[key] = rewritten
+            while len(self.rewrites) > REWRITE_CACHE_MAX_ENTRIES:
+                self.rewrites.popitem(last=False)
+            self.stats["rewrites"] += 1
+        print(f"🔁 Rewrote follow-up '{question}' as '{rewritten}'")
+        return rewritten
+
+    def clear(self, session_id: str):
+        with self.lock:
+            self.sessions.pop(session_id, None)
+
+    def get_stats(self) -> Dict:
+        with self.lock:
+            return {
+                **self.stats,
+                "sessions": len(self.sessions),
+                "summarizing": sum(1 for session in self.sessions.values() if session["compacting"]),
+                "cached_rewrites": len(self.rewrites),
+            }
+
+
+def benchmark_prompt_growth(num_turns: int = 40):
+    """History tokens per turn with and without the memory budget, using a stand-in summarizer"""
+    async def fake_complete(prompt: str) -> str:
+        # Summaries are capped by the budget, so their exact wording doesn't affect prompt size
+        return " ".join(prompt.split()[-MEMORY_SUMMARY_MAX_TOKENS:])
+
+    async def run():
+        memory = ConversationMemory(fake_complete)
+        unbounded = []
+        for turn in range(num_turns):
+            question = f"What does section {turn} say about the results in table {turn}?"
+            answer = " ".join(f"Section {turn} reports finding {i} with value {i * turn}." for i in range(12))
+            unbounded.append(f"User: {question}\nAssistant: {answer}")
+            memory.record_turn("benchmark", question, answer)
+            await asyncio.sleep(0)
+            await asyncio.gather(*memory.tasks)
+            if turn % 5 == 4:
+                full, bounded = count_tokens(["\n\n".join(unbounded), memory.history("benchmark")])
+                print(f"turn {turn + 1:>3}: unbounded history {full:>6} tokens, bounded {bounded:>4} tokens")
+        print(memory.get_stats())
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    benchmark_prompt_growth()
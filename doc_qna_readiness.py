@@ -0,0 +1,58 @@
+import time
+import threading
+from typing import Callable, Dict, Iterable, Optional
+
+# Component states; "fallback" works in a degraded mode and "skipped" loads lazily on first use
+PENDING, WARMING, READY, FALLBACK, SKIPPED, FAILED = "pending", "warming", "ready", "fallback", "skipped", "failed"
+SERVING_STATES = (READY, FALLBACK, SKIPPED)
+
+
+class Readiness:
+    """Warm-up state of each part of the retrieval stack"""
+
+    def __init__(self, required: Iterable[str], optional: Iterable[str] = ()):
+        self.required = tuple(required)
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.components: Dict[str, Dict] = {
+            name: {"state": PENDING, "seconds": None, "detail": None}
+            for name in (*self.required, *optional)
+        }
+
+    def _set(self, name: str, state: str, seconds: Optional[float] = None, detail: Optional[str] = None):
+        with self.lock:
+            self.components[name] = {"state": state, "seconds": seconds, "detail": detail}
+
+    def run(self, name: str, warm: Callable[[], Optional[str]]) -> bool:
+        """Run one warm-up step; it may return a state other than ready, e.g. fallback or skipped"""
+        self._set(name, WARMING)
+        start = time.perf_counter()
+        try:
+            state = warm() or READY
+        except Exception as e:
+            print(f"❗ Warm-up of {name} failed: {e}")
+            self._set(name, FAILED, round(time.perf_counter() - start, 2), str(e))
+            return False
+
+        seconds = round(time.perf_counter() - start, 2)
+        self._set(name, state, seconds)
+        print(f"🔥 {name} warm ({state}) in {seconds}s")
+        return True
+
+    def skip_all(self, detail: str):
+        """Mark every component as loading lazily instead of at startup"""
+        for name in list(self.components):
+            self._set(name, SKIPPED, detail=detail)
+
+    def is_ready(self) -> bool:
+        with self.lock:
+            return all(self.components[name]["state"] in SERVING_STATES for name in self.required)
+
+    def report(self) -> Dict:
+        with self.lock:
+            components = {name: dict(component) for name, component in self.components.items()}
+        return {
+            "ready": self.is_ready(),
+            "uptime_seconds": round(time.time() - self.started, 1),
+            "components": components,
+        }
@@ -1,6 +1,6 @@
-from fastapi import FastAPI, File, UploadFile, Form, HTTPException, Depends
+from fastapi import FastAPI, File, UploadFile, Form, HTTPException, Depends, Request, Query
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse, FileResponse, HTMLResponse
+from fastapi.responses import JSONResponse, FileResponse, HTMLResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel
 import os
@@ -20,12 +20,15 @@ from langchain_community.vectorstores import FAISS
 from langchain_community.document_loaders import PyMuPDFLoader, CSVLoader, WebBaseLoader
 from langchain.schema import Document
 from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain.retrievers import BM25Retriever
 from rank_bm25 import BM25Okapi
 from datetime import datetime
 import traceback
 import json
 import concurrent.futures
+import hashlib
+import asyncio
+import functools
+import uuid
 
 # Import extraction functions
 from function_for_DOC_QNA import (
@@ -37,6 +40,70 @@ from function_for_DOC_QNA import (
     extract_clean_text,
     extract_text_from_url_simple
 )
+from doc_qna_sources import (
+    EVICTION_INTERVAL_SECONDS,
+    register_chunks,
+    rebuild_registry,
+    record_source_hits,
+    select_sources_to_evict,
+    forget_source,
+    claim_content_hash,
+    release_content_hash,
+    attach_source,
+    aliases_of,
+    save_source_catalog,
+    resolve_source,
+    resolve_sources,
+    file_source_id,
+    name_source,
+    source_name,
+    get_corpus_version
+)
+from doc_qna_answer_cache import (
+    ANSWER_CACHE_HEADER,
+    normalize_query,
+    lookup_answer,
+    store_answer,
+    record_bypass,
+    get_answer_cache_stats
+)
+from doc_qna_embeddings import PooledEmbeddings, QueryBatcher, get_embedding_pool
+from doc_qna_chunking import get_tokenizer
+from doc_qna_readiness import Readiness, FALLBACK, SKIPPED
+from doc_qna_locks import ReadWriteLock
+from doc_qna_ingestion import INDEX_BATCH_SIZE, stream_pages, iter_chunks, ingest_segments
+from doc_qna_crawler import crawl_site
+from doc_qna_browser import arender_text
+from doc_qna_index import IndexTierManager, prepare_index, add_embeddings_with_ids, delete_chunks, search_filtered
+from doc_qna_chunk_store import CHUNK_STORE_DIR, prepare_docstore
+from doc_qna_context import CONTEXT_CANDIDATES, fuse_rankings, pack_context, format_context, context_sources
+from doc_qna_memory import ConversationMemory
+from doc_qna_summaries import SummaryIndex, is_overview_query, SUMMARY_ENABLED
+from doc_qna_dedup import (
+    chunk_digest,
+    drop_near_duplicates,
+    record_shared_signatures,
+    forget_source_signatures,
+    reload_source_signatures,
+    rebuild_near_duplicate_index,
+    get_dedup_stats
+)
+from doc_qna_jobs import (
+    RETRY_AFTER_SECONDS,
+    TERMINAL_STAGES,
+    IngestionQueueFull,
+    get_extraction_pool,
+    discard_extraction_pool,
+    get_queue_manager,
+    create_job,
+    record_job,
+    update_job,
+    get_job,
+    get_latest_job_for_filename,
+    is_queue_full,
+    start_ingestion_workers
+)
+from auth import verify_token
 
 # Load environment variables
 load_dotenv()
@@ -61,60 +128,225 @@ embeddings = HuggingFaceEmbeddings(
     cache_folder=cache_dir
 )
 
+# Document batches are embedded by the worker pool; concurrent queries are
+# micro-batched into one in-process forward pass
+ingest_embeddings = PooledEmbeddings(embeddings, query_batcher=QueryBatcher(embeddings))
+
 # Global variables
-all_documents = []
-tokenized_corpus = []
+# BM25 rows are chunk ids: row i scores the chunk stored under dense index id i
 bm25_index = None
 vector_store = None
-bm25_retriever = None
 
 # Create data directory
 os.makedirs("data", exist_ok=True)
 VECTOR_DB_PATH = "data/vector_db"
+CHUNK_STORE_PATH = os.path.join(VECTOR_DB_PATH, CHUNK_STORE_DIR)
+SUMMARY_PATH = os.path.join(VECTOR_DB_PATH, "summaries.json")
+SOURCE_CATALOG_PATH = os.path.join(VECTOR_DB_PATH, "sources.json")
+
+# Concurrent queries share the read side; ingestion and eviction take the write side
+vector_store_lock = ReadWriteLock()
+# Saves run under either side of it, so writing the files has a lock of its own
+vector_store_save_lock = threading.Lock()
+
+# BM25 is rebuilt off the write lock once index changes have been quiet for a moment,
+# and at least this often while a long ingestion keeps changing it
+BM25_REFRESH_DELAY_SECONDS = float(os.getenv("DOC_QNA_BM25_REFRESH_DELAY_SECONDS", "2"))
+BM25_REFRESH_MAX_DELAY_SECONDS = float(os.getenv("DOC_QNA_BM25_REFRESH_MAX_DELAY_SECONDS", "30"))
+sparse_changes = {"first": None, "last": None}
+sparse_changes_lock = threading.Lock()
+
+# Indexes and models are loaded in the background at startup; /ready reports when queries won't wait on them
+WARMUP_ENABLED = os.getenv("DOC_QNA_WARMUP_ENABLED", "true").lower() == "true"
+readiness = Readiness(
+    required=("dense_index", "sparse_index", "query_embeddings"),
+    optional=("embedding_pool", "tokenizer")
+)
+
+# Moves the dense index from flat to IVF to IVF-PQ as the corpus grows
+index_tiers = IndexTierManager(
+    get_store=lambda: vector_store,
+    lock=vector_store_lock,
+    save=lambda: save_vector_store()
+)
+
+# CPU-bound retrieval and blocking ingestion run here instead of on the event loop
+RETRIEVAL_WORKERS = int(os.getenv("DOC_QNA_RETRIEVAL_WORKERS", str(min(32, (os.cpu_count() or 1) + 4))))
+retrieval_executor = concurrent.futures.ThreadPoolExecutor(
+    max_workers=RETRIEVAL_WORKERS,
+    thread_name_prefix="doc-qna-retrieval"
+)
+
+# Uploads are hashed while they stream to disk in blocks of this size
+UPLOAD_BLOCK_SIZE = 1024 * 1024
 
-# Thread lock for vector store access
-vector_store_lock = threading.Lock()
+NO_DOCUMENTS_RESPONSE = "Hello! I can help you analyze documents, images, audio files, and web content. Upload some files or add URLs to get started!"
+NO_RESULTS_RESPONSE = "I couldn't find specific information about that query in your uploaded documents. Try uploading more relevant content or rephrasing your question."
+GENERATION_ERROR_MESSAGE = "I encountered an error while generating a response."
 
-# Store file processing status
-processing_status = {}
+# Key in the signed session cookie that identifies a conversation
+CHAT_SESSION_KEY = "doc_qna_session"
 
 class URLInput(BaseModel):
     url: str
+    js_render: bool = False
 
 class ChatInput(BaseModel):
     question: str
 
-def clear_vector_store():
-    """Clears FAISS and BM25 index every 1 hour."""
-    global all_documents, bm25_index, vector_store, bm25_retriever
+class RetrieveInput(BaseModel):
+    question: str
+    sources: List[str] = []
+    metadata: Dict[str, Any] = {}
+    top_n: int = 5
+
+def evict_sources(source_ids):
+    """Remove individual sources from the FAISS and BM25 indexes."""
+    global vector_store
+
+    with vector_store_lock.write_lock():
+        if vector_store is None:
+            return 0
+
+        # Chunks shared with sources that stay are kept; docstore ids are the chunk store's ids as strings
+        chunks = get_chunk_store()
+        owned = len(chunks.ids_for_sources(source_ids))
+        chunk_ids = [str(chunk_id) for chunk_id in chunks.release_sources(source_ids).tolist()]
+        for source_id in source_ids:
+            forget_source(source_id)
+            forget_source_signatures(source_id)
+            summary_index.forget(source_id)
+
+        if not owned:
+            return 0
+
+        try:
+            if chunk_ids:
+                delete_chunks(vector_store, chunk_ids)
+                mark_sparse_index_stale()
+            save_vector_store()
+
+            print(f"🧹 Evicted {len(source_ids)} sources ({len(chunk_ids)} chunks) from the vector database")
+            return len(chunk_ids)
+        except Exception as e:
+            print(f"Error evicting sources: {e}")
+            return 0
 
+def run_source_eviction():
+    """Periodically evict expired, idle or over-budget sources."""
     while True:
-        print("🕒 Waiting 1 hour before clearing vector database...")
-        time.sleep(3600)  # Wait for 1 hour
-        
-        with vector_store_lock:
-            print("🧹 Clearing vector database...")
-            if os.path.exists(VECTOR_DB_PATH):
-                shutil.rmtree(VECTOR_DB_PATH)
-            os.makedirs(VECTOR_DB_PATH, exist_ok=True)
+        time.sleep(EVICTION_INTERVAL_SECONDS)
 
-            # Reset global variables
-            all_documents = []
-            bm25_index = None
-            vector_store = None
-            bm25_retriever = None
+        try:
+            source_ids = select_sources_to_evict()
+            if source_ids:
+                evict_sources(source_ids)
+        except Exception as e:
+            print(f"Source eviction error: {e}")
 
-            print("✅ Vector database successfully cleared!")
+def get_request_namespace(request: Request) -> str:
+    """Namespace for a caller: the logged-in user, or public."""
+    token = request.cookies.get("access_token")
+    payload = verify_token(token) if token else None
+    return f"user_{payload['user_id']}" if payload else "public"
 
-# Run cleanup in the background
-threading.Thread(target=clear_vector_store, daemon=True).start()
+async def run_blocking(func, *args, **kwargs):
+    """Run a blocking call on the retrieval executor"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(retrieval_executor, functools.partial(func, *args, **kwargs))
 
-def generate_response_with_gemini(query: str, context: str) -> str:
-    """Generate response using Gemini with context"""
+def build_retrieval_filter(sources: Optional[List[str]], metadata: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """Restrict retrieval to some sources (aliases allowed) and/or metadata values; None searches everything"""
+    if not sources and not metadata:
+        return None
+    return {
+        "sources": resolve_sources(sources or []),
+        "metadata": metadata or {}
+    }
+
+def parse_metadata_filter(metadata: Optional[str]) -> Optional[Dict[str, Any]]:
+    """Parse the JSON metadata filter of the chat endpoints, e.g. {"page": [3, 4]}"""
+    if not metadata:
+        return None
     try:
-        prompt = f"""
+        parsed = json.loads(metadata)
+    except ValueError:
+        parsed = None
+    if not isinstance(parsed, dict):
+        raise HTTPException(status_code=400, detail="metadata must be a JSON object")
+    return parsed
+
+def metadata_matches(metadata: Dict[str, Any], wanted: Dict[str, Any]) -> bool:
+    """Every wanted key must equal the value, or one of the values when a list is given"""
+    return all(metadata.get(key) in (value if isinstance(value, list) else [value]) for key, value in wanted.items())
+
+def filtered_chunk_ids(chunks, retrieval_filter) -> List[int]:
+    """Ids of the chunks a filter allows; the same ids address the dense index and BM25 rows"""
+    if retrieval_filter["sources"]:
+        chunk_ids = chunks.ids_for_sources(retrieval_filter["sources"]).tolist()
+    else:
+        chunk_ids = chunks.live_ids().tolist()
+
+    if retrieval_filter["metadata"]:
+        return [i for i in chunk_ids if metadata_matches(chunks.metadata(i), retrieval_filter["metadata"])]
+    return chunk_ids
+
+def get_chunk_store():
+    """Compact store of chunk texts and metadata behind the FAISS docstore"""
+    return vector_store.docstore.store if vector_store is not None else None
+
+def has_documents() -> bool:
+    """Whether any uploaded chunk is indexed; the placeholder doesn't count"""
+    chunks = get_chunk_store()
+    return chunks is not None and chunks.live_count(sourced=True) > 0
+
+async def check_answer_cache(request: Request, message: str, retrieval_filter=None) -> Dict[str, Any]:
+    """Look up a cached answer for the caller's namespace and the current corpus version"""
+    namespace = get_request_namespace(request)
+    if retrieval_filter is not None:
+        # Answers restricted to some documents must not be served for other restrictions
+        namespace = f"{namespace}|{json.dumps(retrieval_filter, sort_keys=True)}"
+
+    cache = {
+        "namespace": namespace,
+        "version": get_corpus_version(),
+        "embedding": None,
+        "answer": None,
+        "state": "bypass"
+    }
+
+    if request.headers.get(ANSWER_CACHE_HEADER, "").lower() == "bypass":
+        record_bypass()
+        return cache
+
+    try:
+        cache["embedding"] = await ingest_embeddings.aembed_query(normalize_query(message))
+        cache["answer"] = lookup_answer(cache["namespace"], cache["version"], cache["embedding"])
+        cache["state"] = "hit" if cache["answer"] is not None else "miss"
+    except Exception as e:
+        print(f"Answer cache lookup failed: {e}")
+
+    return cache
+
+def remember_answer(cache: Dict[str, Any], message: str, answer: str):
+    """Store a generated answer unless the cache was bypassed or generation failed"""
+    if cache["embedding"] is None or not answer or answer.startswith(GENERATION_ERROR_MESSAGE):
+        return
+    store_answer(cache["namespace"], cache["version"], message, cache["embedding"], answer)
+
+# Run eviction and index tiering in the background
+threading.Thread(target=run_source_eviction, daemon=True).start()
+threading.Thread(target=index_tiers.run, daemon=True).start()
+
+def build_answer_prompt(query: str, context: str, history: str = "") -> str:
+    """Build the grounded answer prompt sent to Gemini"""
+    conversation = f"""
+        Conversation so far:
+        {history}
+        """ if history else ""
+    return f"""
         Based on the following context, answer the user's question. If the context doesn't contain relevant information, say so.
-        
+        {conversation}
         Context:
         {context}
         
@@ -122,218 +354,495 @@ def generate_response_with_gemini(query: str, context: str) -> str:
         
         Answer:
         """
+
+def complete(prompt: str) -> str:
+    """Plain Gemini completion, for background summaries"""
+    response = llm.invoke(prompt)
+    return response.content if hasattr(response, 'content') else str(response)
+
+async def acomplete(prompt: str) -> str:
+    """Plain Gemini completion, for summaries and query rewrites"""
+    response = await llm.ainvoke(prompt)
+    return response.content if hasattr(response, 'content') else str(response)
+
+# Recent turns per browser session, with older ones summarized in the background
+conversation_memory = ConversationMemory(acomplete)
+
+def get_source_chunks(source_id: str):
+    """Text and metadata of a source's chunks in ingestion order"""
+    with vector_store_lock.read_lock():
+        chunks = get_chunk_store()
+        if chunks is None:
+            return []
+        results = [(chunks.text(i), chunks.metadata(i)) for i in chunks.ids_for_sources([source_id]).tolist()]
+
+    # Chunks shared with an earlier upload carry that upload's name
+    name = source_name(source_id)
+    for _, metadata in results:
+        if metadata.get("source") != source_id:
+            metadata["source"] = source_id
+            if name != source_id:
+                metadata["filename"] = name
+            else:
+                metadata.pop("filename", None)
+    return results
+
+# Summary trees for overview questions, built in the background once a source is ingested
+summary_index = SummaryIndex(complete, get_source_chunks, SUMMARY_PATH)
+threading.Thread(target=summary_index.run, daemon=True).start()
+
+def select_summaries(query: str, retrieval_filter=None):
+    """Summary nodes for overview questions; empty when the question needs a chunk search"""
+    if not SUMMARY_ENABLED or not is_overview_query(query) or (retrieval_filter and retrieval_filter["metadata"]):
+        return []
+    return summary_index.select(query, retrieval_filter["sources"] if retrieval_filter else None)
+
+def get_chat_session(request: Request) -> str:
+    """Conversation id kept in the session cookie, created on the first message"""
+    session_id = request.session.get(CHAT_SESSION_KEY)
+    if not session_id:
+        session_id = uuid.uuid4().hex
+        request.session[CHAT_SESSION_KEY] = session_id
+    return session_id
+
+def format_sse(event: str, payload: Dict[str, Any]) -> str:
+    """Format one server-sent event"""
+    return f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+
+def generate_response_with_gemini(query: str, context: str, history: str = "") -> str:
+    """Generate response using Gemini with context"""
+    try:
+        prompt = build_answer_prompt(query, context, history)
         
         response = llm.invoke(prompt)
         return response.content if hasattr(response, 'content') else str(response)
     except Exception as e:
         print(f"Error generating response: {e}")
-        return f"I encountered an error while generating a response. Context available: {len(context)} characters."
+        return f"{GENERATION_ERROR_MESSAGE} Context available: {len(context)} characters."
+
+async def agenerate_response_with_gemini(query: str, context: str, history: str = "") -> str:
+    """Generate response using Gemini with context without blocking the event loop"""
+    try:
+        prompt = build_answer_prompt(query, context, history)
+
+        response = await llm.ainvoke(prompt)
+        return response.content if hasattr(response, 'content') else str(response)
+    except Exception as e:
+        print(f"Error generating response: {e}")
+        return f"{GENERATION_ERROR_MESSAGE} Context available: {len(context)} characters."
 
 def process_extracted_text(text: str) -> List[Document]:
     """Process extracted text into document chunks"""
     try:
-        if not text or not text.strip():
-            return []
-        
-        # Create document
-        doc = Document(page_content=text.strip())
-        
-        # Split text
-        text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=600,
-            chunk_overlap=100,
-            separators=["\n\n", "\n", ". ", " ", ""]
-        )
-        
-        chunks = text_splitter.split_documents([doc])
-        return chunks
+        return list(iter_chunks([text]))
     except Exception as e:
         print(f"Error processing text: {e}")
         return []
 
-def get_vector_store():
+def prepare_url_chunks(text: str, source_id: str, page_url: Optional[str] = None):
+    """Chunk fetched page text and drop near-duplicates; CPU-bound, so routes run it on the retrieval executor.
+
+    Returns the chunks still to index and how many were shared with chunks already indexed."""
+    documents = process_extracted_text(text)
+    if page_url:
+        for doc in documents:
+            doc.metadata["url"] = page_url
+    kept, shared = drop_near_duplicates(documents, "public", source_id)
+    orphans = share_duplicate_chunks(shared, source_id, "public")
+    return kept + orphans, len(shared) - len(orphans)
+
+def ensure_vector_store():
+    """Load the vector store once, even when several requests race for it."""
+    if vector_store is not None:
+        return vector_store
+    with vector_store_lock.write_lock():
+        return vector_store if vector_store is not None else get_vector_store()
+
+def get_vector_store(build_sparse=True):
     """Load or create FAISS vector store safely."""
-    global all_documents, bm25_index, vector_store
+    global bm25_index, vector_store
 
     if not os.path.exists(VECTOR_DB_PATH):
-        vector_store = FAISS.from_texts(["Placeholder document"], embeddings)
+        vector_store = FAISS.from_texts(["Placeholder document"], ingest_embeddings)
+        prepare_index(vector_store)
+        prepare_docstore(vector_store, CHUNK_STORE_PATH)
         return vector_store
 
     try:
-        vector_store = FAISS.load_local(VECTOR_DB_PATH, embeddings, allow_dangerous_deserialization=True)
-        if not all_documents:
-            all_documents = list(vector_store.docstore._dict.values())
-        update_bm25_index()
+        vector_store = FAISS.load_local(VECTOR_DB_PATH, ingest_embeddings, allow_dangerous_deserialization=True)
+        prepare_index(vector_store)
+        prepare_docstore(vector_store, CHUNK_STORE_PATH)
+        rebuild_registry(vector_store.docstore.store, vector_store.index.d, SOURCE_CATALOG_PATH)
+        summary_index.load(vector_store.docstore.store.sources())
+        if build_sparse:
+            refresh_sparse_indexes()
+        # Signatures for existing chunks are recomputed off the request path
+        threading.Thread(target=rebuild_near_duplicate_index,
+                         args=(vector_store.docstore.store, vector_store_lock), daemon=True).start()
         return vector_store
     except Exception as e:
         print(f"Error loading vector store: {e}")
-        vector_store = FAISS.from_texts(["Placeholder document"], embeddings)
+        vector_store = FAISS.from_texts(["Placeholder document"], ingest_embeddings)
+        prepare_index(vector_store)
+        prepare_docstore(vector_store, CHUNK_STORE_PATH)
         return vector_store
 
+def warm_dense_index():
+    """Deserialize FAISS and rebuild the source registry"""
+    with vector_store_lock.write_lock():
+        if vector_store is None:
+            get_vector_store(build_sparse=False)
+
+def warm_sparse_index():
+    """Build BM25 over the loaded chunks unless a query already did"""
+    if bm25_index is None:
+        rebuild_sparse_index()
+
+def warm_query_embeddings():
+    """Push a dummy batch through the in-process model and the query batcher"""
+    embeddings.embed_documents(["warm up"] * 8)
+    ingest_embeddings.embed_query("warm up")
+
+def warm_embedding_pool():
+    """Wait for the ingestion workers to load the model, then embed a dummy batch"""
+    pool = get_embedding_pool()
+    if pool is None:
+        return SKIPPED
+    if not pool.wait_until_ready():
+        raise TimeoutError("Embedding workers did not load the model in time")
+    pool.embed(["warm up"])
+
+def warm_tokenizer():
+    return None if get_tokenizer() is not None else FALLBACK
+
+def warm_up():
+    """Warm independent parts of the retrieval stack in parallel; a step only runs once its predecessor is warm"""
+    chains = [
+        [("dense_index", warm_dense_index), ("sparse_index", warm_sparse_index)],
+        [("query_embeddings", warm_query_embeddings)],
+        [("embedding_pool", warm_embedding_pool)],
+        [("tokenizer", warm_tokenizer)],
+    ]
+
+    def run_chain(chain):
+        for name, warm in chain:
+            if not readiness.run(name, warm):
+                break
+
+    for chain in chains:
+        threading.Thread(target=run_chain, args=(chain,), daemon=True).start()
+
+def build_bm25_index(texts):
+    """BM25 over chunk texts in id order; deleted ids keep an empty row so row numbers stay equal to chunk ids."""
+    return BM25Okapi([text.lower().split() for text in texts])
+
 def update_bm25_index():
-    """Update the BM25 index with FAISS documents."""
-    global bm25_index, tokenized_corpus, all_documents
+    """Update the BM25 index with FAISS documents; callers hold the lock."""
+    global bm25_index
 
-    if not all_documents:
+    chunks = get_chunk_store()
+    if chunks is None:
         return
 
     try:
-        tokenized_corpus = [doc.page_content.lower().split() for doc in all_documents]
-        bm25_index = BM25Okapi(tokenized_corpus)
-        print(f"✅ BM25 index updated with {len(all_documents)} documents")
+        bm25_index = build_bm25_index(chunks.iter_texts())
+        print(f"✅ BM25 index updated with {chunks.live_count()} documents")
     except Exception as e:
         print(f"Error updating BM25 index: {e}")
 
-def extract_text_from_source(file_path=None, url=None):
-    """Extract text using functions from function_for_DOC_QNA.py"""
-    try:
-        if file_path:
-            text = extract_text_auto(file_path=file_path)
-        elif url:
-            text = extract_clean_text(url)
-        else:
-            raise ValueError("Either file_path or url must be provided")
+def refresh_sparse_indexes():
+    """Rebuild the BM25 index from the chunk store while the caller holds the lock (used when loading)."""
+    global bm25_index
 
-        doc = Document(
-            page_content=text,
-            metadata={"source": file_path or url}
-        )
+    if not has_documents():
+        bm25_index = None
+        return
 
-        text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=600,
-            chunk_overlap=100,
-            separators=["\n\n", "\n", ". ", " ", ""]
-        )
-        
-        return text_splitter.split_documents([doc])
-        
+    update_bm25_index()
+
+def rebuild_sparse_index():
+    """Rebuild BM25 from a snapshot of the chunk texts; only the snapshot holds the read lock."""
+    global bm25_index
+
+    with vector_store_lock.read_lock():
+        chunks = get_chunk_store()
+        texts = list(chunks.iter_texts()) if has_documents() else None
+        live = chunks.live_count() if texts else 0
+
+    try:
+        bm25_index = build_bm25_index(texts) if texts else None
+        print(f"✅ BM25 index updated with {live} documents")
     except Exception as e:
-        raise ValueError(f"Error extracting text: {e}")
+        print(f"Error updating BM25 index: {e}")
+
+def mark_sparse_index_stale():
+    """Note that chunks were added or deleted; the refresh thread rebuilds BM25 once changes settle."""
+    now = time.time()
+    with sparse_changes_lock:
+        if sparse_changes["first"] is None:
+            sparse_changes["first"] = now
+        sparse_changes["last"] = now
+
+def run_sparse_refresh():
+    """Rebuild BM25 once per burst of ingestion or eviction instead of once per added batch."""
+    while True:
+        time.sleep(0.5)
+        now = time.time()
+        with sparse_changes_lock:
+            first, last = sparse_changes["first"], sparse_changes["last"]
+            if first is None or (now - last < BM25_REFRESH_DELAY_SECONDS and now - first < BM25_REFRESH_MAX_DELAY_SECONDS):
+                continue
+            sparse_changes["first"] = sparse_changes["last"] = None
+
+        # Changes made while this runs mark the index stale again and trigger another pass
+        rebuild_sparse_index()
+
+threading.Thread(target=run_sparse_refresh, daemon=True).start()
 
-def add_to_vector_store(documents, source_id):
-    """Add documents to FAISS and update BM25 index."""
-    global all_documents, bm25_index, vector_store, bm25_retriever
+def add_to_vector_store(documents, source_id, namespace="public", content_hash=None, vectors=None, persist=True):
+    """Add documents to FAISS and update BM25 index; errors propagate so callers can roll back."""
+    global bm25_index, vector_store
 
     if not documents:
         print("❗ No documents to add to FAISS.")
         return 0
 
-    with vector_store_lock:
+    for doc in documents:
+        if not hasattr(doc, 'metadata'):
+            doc.metadata = {}
+        doc.metadata["source"] = source_id
+        doc.metadata["timestamp"] = time.time()
+        doc.metadata["namespace"] = namespace
+        if content_hash:
+            doc.metadata["content_hash"] = content_hash
+
+    # Embed before taking the write lock so queries keep running meanwhile
+    if vectors is None:
+        vectors = ingest_embeddings.embed_documents([doc.page_content for doc in documents])
+
+    with vector_store_lock.write_lock():
         if vector_store is None:
             vector_store = get_vector_store()
 
-        for doc in documents:
-            if not hasattr(doc, 'metadata'):
-                doc.metadata = {}
-            doc.metadata["source"] = source_id
-            doc.metadata["timestamp"] = time.time()
+        add_embeddings_with_ids(
+            vector_store,
+            [doc.page_content for doc in documents],
+            vectors,
+            [doc.metadata for doc in documents]
+        )
+        # Registered before saving, so chunks of a failed save can still be evicted with their source
+        register_chunks(source_id, documents, vector_store.index.d, namespace=namespace)
+        summary_index.schedule(source_id)
+        mark_sparse_index_stale()
+        if persist:
+            save_vector_store()
 
-        try:
-            vector_store.add_documents(documents)
-            vector_store.save_local(VECTOR_DB_PATH)
+        index_tiers.maybe_upgrade()
 
-            all_documents = list(vector_store.docstore._dict.values())
-            update_bm25_index()
+        print(f"✅ {len(documents)} documents added to FAISS.")
+        print(f"📂 FAISS now contains {get_chunk_store().live_count()} documents.")
 
-            try:
-                if all_documents:
-                    bm25_retriever = BM25Retriever.from_documents(all_documents)
-                    bm25_retriever.k = 5
-                    print(f"✅ BM25 retriever initialized with {len(all_documents)} documents")
-            except Exception as e:
-                print(f"⚠️ BM25 retriever initialization failed: {e}")
-                bm25_retriever = None
+        return len(documents)
 
-            print(f"✅ {len(documents)} documents added to FAISS.")
-            print(f"📂 FAISS now contains {len(all_documents)} documents.")
+def share_duplicate_chunks(shared, source_id, namespace="public"):
+    """Make a source an owner of the indexed chunks its dropped near-duplicates repeat.
 
-            return len(documents)
-            
-        except Exception as e:
-            print(f"Error adding documents to vector store: {e}")
-            return 0
+    Returns the duplicates whose chunk is no longer indexed; they have to be indexed as the source's own."""
+    if not shared:
+        return []
 
-def hybrid_search(query, all_splits, vector_store, top_n=10):
-    """Enhanced hybrid search."""
-    global bm25_index, tokenized_corpus
+    with vector_store_lock.write_lock():
+        chunks = get_chunk_store()
+        attached, orphans = [], []
+        by_owner = {}
+        for doc, owner, digest in shared:
+            by_owner.setdefault(owner, []).append((doc, digest))
+        for owner, items in by_owner.items():
+            located = {}
+            if chunks is not None:
+                located = {chunk_digest(chunks.text(i)): i for i in chunks.ids_for_sources([owner]).tolist()}
+            for doc, digest in items:
+                if digest in located:
+                    attached.append((doc, owner, digest, located[digest]))
+                else:
+                    orphans.append(doc)
 
-    if not all_splits or not vector_store:
-        return []
+        if attached:
+            chunks.add_owners([chunk_id for _, _, _, chunk_id in attached], source_id)
+            register_chunks(source_id, [doc for doc, _, _, _ in attached], vector_store.index.d, namespace=namespace)
+            summary_index.schedule(source_id)
+        record_shared_signatures(namespace, source_id, [(owner, digest) for _, owner, digest, _ in attached], orphans)
 
-    print(f"🔍 Retrieved documents for query: {query}")
+    return orphans
 
-    try:
-        expanded_query = llm.invoke(f"Expand this search query while maintaining its core meaning: '{query}'")
-        expanded_query = expanded_query.content if hasattr(expanded_query, "content") else str(expanded_query)
+def save_vector_store():
+    """Write the chunk store and then the FAISS index that refers to it; callers hold the lock."""
+    with vector_store_save_lock:
+        vector_store.docstore.save()
+        vector_store.save_local(VECTOR_DB_PATH)
+        save_source_catalog(SOURCE_CATALOG_PATH)
 
-        results = []
-        
+def persist_vector_store():
+    """Write the FAISS index to disk after a series of unsaved additions."""
+    with vector_store_lock.read_lock():
+        if vector_store is not None:
+            save_vector_store()
+
+EXPAND_QUERY_PROMPT = "Expand this search query while maintaining its core meaning: '{query}'"
+
+def search_indexes(expanded_query, chunks, vector_store, top_n=10, retrieval_filter=None):
+    """Dense and BM25 search for an already expanded query, as (document, fused score) pairs."""
+    dense_results, bm25_results = [], []
+
+    with vector_store_lock.read_lock():
         # Get vector results
         try:
-            vector_results = vector_store.similarity_search_with_score(expanded_query, k=top_n)
-            results.extend([doc for doc, score in vector_results])
+            if retrieval_filter is None:
+                vector_results = vector_store.similarity_search_with_score(expanded_query, k=top_n)
+                dense_results = [doc for doc, score in vector_results]
+            else:
+                # Search only the allowed ids instead of post-filtering a global top-k that may miss them all
+                query_vector = ingest_embeddings.embed_query(expanded_query)
+                _, found = search_filtered(vector_store.index, query_vector,
+                                           filtered_chunk_ids(chunks, retrieval_filter), top_n)
+                dense_results = [chunks.document(int(chunk_id)) for chunk_id in found]
         except Exception as e:
             print(f"Vector search failed: {e}")
 
-        # Get BM25 results if available
-        if bm25_index and tokenized_corpus:
+        # Get BM25 results if available; chunks added since its last rebuild are only found by the dense search
+        sparse_index = bm25_index
+        if sparse_index:
             try:
                 query_tokens = expanded_query.lower().split()
-                scores = bm25_index.get_scores(query_tokens)
-                top_indices = sorted(range(len(scores)), key=lambda i: scores[i], reverse=True)[:top_n]
-                bm25_results = [all_splits[i] for i in top_indices if i < len(all_splits)]
-                results.extend(bm25_results)
+                if retrieval_filter is None:
+                    scores = sparse_index.get_scores(query_tokens)
+                    top_indices = sorted(range(len(scores)), key=lambda i: scores[i], reverse=True)[:top_n]
+                else:
+                    positions = [i for i in filtered_chunk_ids(chunks, retrieval_filter) if i < sparse_index.corpus_size]
+                    scores = sparse_index.get_batch_scores(query_tokens, positions)
+                    top_indices = [positions[i] for i in sorted(range(len(scores)), key=lambda i: scores[i], reverse=True)[:top_n]]
+                bm25_results = [chunks.document(i) for i in top_indices if i in chunks]
             except Exception as e:
                 print(f"BM25 search failed: {e}")
 
-        print(f"📊 Found {len(results)} relevant documents")
-        return results[:top_n]
-        
+    # A chunk found by both retrievers is listed once and ranks higher
+    results = fuse_rankings([dense_results, bm25_results])
+    print(f"📊 Found {len(results)} relevant documents")
+    return results[:top_n]
+
+async def ahybrid_search(query, chunks, vector_store, top_n=10, retrieval_filter=None):
+    """Hybrid search with an async LLM call and index lookups on the retrieval executor."""
+    if chunks is None or not vector_store:
+        return []
+
+    print(f"🔍 Retrieved documents for query: {query}")
+
+    try:
+        expanded_query = await llm.ainvoke(EXPAND_QUERY_PROMPT.format(query=query))
+        expanded_query = expanded_query.content if hasattr(expanded_query, "content") else str(expanded_query)
+
+        return await run_blocking(search_indexes, expanded_query, chunks, vector_store, top_n, retrieval_filter)
+
     except Exception as e:
         print(f"Hybrid search error: {e}")
         return []
 
-def process_file(file_path, filename):
-    """Extract text and update vector store in a background thread."""
-    global processing_status, all_documents
+def run_ingestion_job(job):
+    """Stream one upload through extraction, chunking, embedding and indexing."""
+    job_id, filename = job["id"], job["filename"]
+    # Same-named uploads with different content are separate sources
+    source_id = file_source_id(filename, job["content_hash"])
+    name_source(source_id, filename)
+    failed = True
+    duplicates, shared_count = [0], [0]
+
+    def on_stage(stage, indexed):
+        update_job(job_id, stage, chunk_count=indexed)
+
+    def select_batch(batch):
+        # Near-duplicates of chunks already in this namespace (or earlier in this file) are not embedded;
+        # the chunks they repeat from other sources are shared with this one instead
+        kept, shared = drop_near_duplicates(batch, job["namespace"], source_id)
+        orphans = share_duplicate_chunks(shared, source_id, job["namespace"])
+        duplicates[0] += len(batch) - len(kept) - len(orphans)
+        shared_count[0] += len(shared) - len(orphans)
+        return kept + orphans
+
+    def index_batch(batch, vectors):
+        # Each batch is searchable as soon as it is added; the index is saved once at the end
+        for doc in batch:
+            doc.metadata["filename"] = filename
+        return add_to_vector_store(batch, source_id=source_id, namespace=job["namespace"],
+                                   content_hash=job["content_hash"], vectors=vectors, persist=False)
+
     try:
-        print(f"📂 Processing file: {filename}")
-        processing_status[filename] = "processing"
+        print(f"📂 Processing file: {filename} (job {job_id})")
+        update_job(job_id, "extracting")
 
-        with concurrent.futures.ThreadPoolExecutor() as executor:
-            future = executor.submit(extract_text_from_source, file_path=file_path)
-            try:
-                docs = future.result(timeout=60)
-            except concurrent.futures.TimeoutError:
-                print(f"❗ Timeout while extracting text from {filename}")
-                processing_status[filename] = "failed"
-                return
+        # Pages flow from the extraction process into the chunker as they are produced
+        pages = stream_pages(job["file_path"], get_extraction_pool, get_queue_manager(),
+                             discard_pool=discard_extraction_pool)
+        doc_count = ingest_segments(
+            pages, ingest_embeddings.embed_documents, index_batch, on_stage=on_stage, select_batch=select_batch
+        )
 
-        if not docs:
+        if doc_count or shared_count[0]:
+            persist_vector_store()
+            print(f"✅ File {filename} processed successfully. {doc_count} documents added, "
+                  f"{shared_count[0]} shared with earlier uploads.")
+            update_job(job_id, "completed", chunk_count=doc_count + shared_count[0])
+            failed = False
+        elif duplicates[0]:
+            print(f"♻️ Every chunk of {filename} was already in the knowledge base ({duplicates[0]} near-duplicates)")
+            update_job(job_id, "completed", chunk_count=0)
+            failed = False
+        else:
             print(f"❗ No valid text extracted from {filename}")
-            processing_status[filename] = "failed"
-            return
-        
-        processed_docs = process_extracted_text(docs[0].page_content)
-        
-        if not processed_docs:
-            print(f"❗ No valid content chunks were generated from {filename}")
-            processing_status[filename] = "failed"
-            return
-        
-        doc_count = add_to_vector_store(processed_docs, source_id=filename)
-        print(f"✅ File {filename} processed successfully. {doc_count} documents added.")
+            update_job(job_id, "failed", error="No valid text could be extracted")
 
-        processing_status[filename] = "completed"
+    except TimeoutError:
+        print(f"❗ Timeout while extracting text from {filename}")
+        update_job(job_id, "failed", error="Timed out while extracting text")
 
     except Exception as e:
         print(f"❗ Error processing {filename}: {e}")
-        processing_status[filename] = "failed"
+        update_job(job_id, "failed", error=str(e))
+
+    finally:
+        # Let the same content be retried if this ingestion did not make it into the index: batches
+        # already indexed, their signatures and the claimed hash all go with the job's source
+        if failed:
+            # Uploads attached to this content by reference were never indexed either
+            error = (get_job(job_id) or {}).get("error") or "unknown error"
+            for alias in aliases_of(source_id):
+                record_job(alias, "failed", content_hash=job["content_hash"],
+                           error=f"The identical upload {filename} failed: {error}")
+            if job["content_hash"]:
+                release_content_hash(job["content_hash"])
+            forget_source_signatures(source_id)
+            evict_sources([source_id])
+
+# Bounded pool of job runners; unfinished jobs from a previous run are resumed
+start_ingestion_workers(run_ingestion_job)
 
 # Document Q&A routes
 def create_doc_qna_routes(app: FastAPI):
     """Add document Q&A routes to the main FastAPI app"""
     
+    @app.on_event("startup")
+    async def start_warm_up():
+        """Load indexes and models in the background as soon as the server starts"""
+        if WARMUP_ENABLED:
+            warm_up()
+        else:
+            readiness.skip_all("warm-up disabled, loaded on first query")
+
+    @app.get("/ready")
+    async def ready():
+        """Per-component warm-up state; 503 until queries no longer wait on loading"""
+        report = readiness.report()
+        return JSONResponse(report, status_code=200 if report["ready"] else 503)
+
     @app.get("/doc-chat", response_class=HTMLResponse)
     async def get_doc_chat_page():
         """Serve the document chat page"""
@@ -347,24 +856,76 @@ def create_doc_qna_routes(app: FastAPI):
             raise HTTPException(status_code=500, detail=str(e))
 
     @app.post("/upload")
-    async def upload_file(file: UploadFile = File(...)):
+    async def upload_file(request: Request, file: UploadFile = File(...)):
+        # Reject early, before reading the body, when ingestion is saturated
+        if is_queue_full():
+            return JSONResponse(
+                {"status": "busy", "message": "Too many files are being processed. Please retry shortly."},
+                status_code=429,
+                headers={"Retry-After": str(RETRY_AFTER_SECONDS)}
+            )
+
         try:
             os.makedirs("uploads", exist_ok=True)
             timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
             file_path = f"uploads/{timestamp}_{file.filename}"
+            namespace = get_request_namespace(request)
 
+            # Hash the upload while it streams to disk
+            hasher = hashlib.sha256()
             with open(file_path, "wb") as buffer:
-                shutil.copyfileobj(file.file, buffer)
+                while True:
+                    block = await file.read(UPLOAD_BLOCK_SIZE)
+                    if not block:
+                        break
+                    hasher.update(block)
+                    buffer.write(block)
+            content_hash = hasher.hexdigest()
+
+            existing_source = claim_content_hash(content_hash, file_source_id(file.filename, content_hash))
+            if existing_source is not None:
+                # Same content is already ingested (or being ingested): attach it by reference
+                os.remove(file_path)
+                attach_source(existing_source, file.filename, namespace)
+                await run_blocking(save_source_catalog, SOURCE_CATALOG_PATH)
+                print(f"♻️ File {file.filename} matches already ingested {existing_source}, skipping extraction.")
 
-            print(f"📂 File {file.filename} saved. Now extracting text...")
-            processing_status[file.filename] = "processing"
+                # The original may still be processing; it can then be polled, under either name
+                job = await run_blocking(get_latest_job_for_filename, source_name(existing_source))
+                if job is not None and job["status"] not in TERMINAL_STAGES:
+                    return JSONResponse({
+                        "status": "success",
+                        "message": "Identical content is already being processed.",
+                        "filename": file.filename,
+                        "duplicate_of": existing_source,
+                        "job_id": job["id"]
+                    })
 
-            threading.Thread(target=process_file, args=(file_path, file.filename), daemon=True).start()
+                return JSONResponse({
+                    "status": "success",
+                    "message": "File content is already in the knowledge base.",
+                    "filename": file.filename,
+                    "duplicate_of": existing_source
+                })
+
+            try:
+                job_id = create_job(file.filename, file_path, namespace=namespace, content_hash=content_hash)
+            except IngestionQueueFull:
+                os.remove(file_path)
+                release_content_hash(content_hash)
+                return JSONResponse(
+                    {"status": "busy", "message": "Too many files are being processed. Please retry shortly."},
+                    status_code=429,
+                    headers={"Retry-After": str(RETRY_AFTER_SECONDS)}
+                )
+
+            print(f"📂 File {file.filename} saved. Queued as job {job_id}.")
 
             return JSONResponse({
                 "status": "success",
                 "message": "File uploaded successfully and is being processed.",
-                "filename": file.filename
+                "filename": file.filename,
+                "job_id": job_id
             })
 
         except Exception as e:
@@ -378,25 +939,45 @@ def create_doc_qna_routes(app: FastAPI):
             url = url_input.url.strip()
             print(f"🌐 Processing URL: {url}")
             
-            # Process the URL
-            docs = extract_text_from_source(url=url)
+            doc_count = 0
+            shared_count = 0
+            page_count = 0
+            pending_docs = []
+            if url_input.js_render:
+                # Single page rendered in the shared browser pool
+                page_count = 1
+                pending_docs, shared_count = await run_blocking(prepare_url_chunks, await arender_text(url), url)
+            else:
+                # Pages are chunked and indexed in batches while the rest of the site is still being fetched
+                async for page in crawl_site(url):
+                    page_count += 1
+                    page_docs, page_shared = await run_blocking(prepare_url_chunks, page.text, url, page.url)
+                    pending_docs.extend(page_docs)
+                    shared_count += page_shared
+                    if len(pending_docs) >= INDEX_BATCH_SIZE:
+                        doc_count += await run_blocking(add_to_vector_store, pending_docs, source_id=url, persist=False)
+                        pending_docs = []
+            
+            if pending_docs:
+                doc_count += await run_blocking(add_to_vector_store, pending_docs, source_id=url, persist=False)
             
-            if not docs:
+            if not page_count:
                 return JSONResponse({
                     "status": "error",
                     "message": "No content could be extracted from the URL"
                 })
             
-            processed_docs = process_extracted_text(docs[0].page_content)
-            
-            if processed_docs:
-                doc_count = add_to_vector_store(processed_docs, source_id=url)
-                print(f"Added {doc_count} chunks to vector store for {url}")
+            # Chunks shared with earlier sources count as added to this one
+            doc_count += shared_count
+            if doc_count:
+                await run_blocking(persist_vector_store)
+                print(f"Added {doc_count} chunks from {page_count} pages to vector store for {url}")
                 
                 return JSONResponse({
                     "status": "success",
                     "message": f"URL content processed successfully! Added {doc_count} chunks to knowledge base.",
-                    "url": url
+                    "url": url,
+                    "pages": page_count
                 })
             else:
                 return JSONResponse({
@@ -406,62 +987,146 @@ def create_doc_qna_routes(app: FastAPI):
                 
         except Exception as e:
             print(f"❗ Error processing URL: {e}")
+            # Pages indexed before the failure stay; signatures of chunks that never made it in are dropped
+            if get_chunk_store() is not None:
+                await run_blocking(reload_source_signatures, get_chunk_store(), vector_store_lock, url_input.url.strip())
             return JSONResponse({
                 "status": "error",
                 "message": f"Error processing URL: {str(e)}"
             })
 
+    @app.get("/index/stats")
+    async def index_stats():
+        """Current dense index tier and the last background migration"""
+        return JSONResponse(index_tiers.stats())
+
+    @app.get("/dedup/stats")
+    async def dedup_stats():
+        """Chunks eliminated as near-duplicates at ingestion"""
+        return JSONResponse(get_dedup_stats())
+
+    @app.get("/memory/stats")
+    async def memory_stats():
+        """Conversation sessions, background summaries and follow-up rewrites"""
+        return JSONResponse(conversation_memory.get_stats())
+
+    @app.get("/summaries/stats")
+    async def summary_stats():
+        """Summary trees built, queued and used to answer overview questions"""
+        return JSONResponse(summary_index.get_stats())
+
+    @app.delete("/chat-session")
+    async def clear_chat_session(request: Request):
+        """Forget the caller's conversation"""
+        conversation_memory.clear(get_chat_session(request))
+        return JSONResponse({"status": "success"})
+
+    @app.get("/answer-cache/stats")
+    async def answer_cache_stats():
+        """Hit-rate metrics for the semantic answer cache"""
+        return JSONResponse(get_answer_cache_stats())
+
     @app.get("/processing-status")
-    async def get_processing_status(filename: str):
-        """Check if a file has finished processing."""
-        status = processing_status.get(filename, "unknown")
-        
-        if status == "failed":
-            return JSONResponse({"status": "failed", "message": "File processing failed."})
+    async def get_processing_status(job_id: Optional[str] = None, filename: Optional[str] = None):
+        """Check which stage an ingestion job has reached."""
+        if job_id:
+            job = await run_blocking(get_job, job_id)
+        elif filename:
+            job = await run_blocking(get_latest_job_for_filename, source_name(resolve_source(filename)))
+        else:
+            raise HTTPException(status_code=400, detail="job_id or filename is required")
 
-        return JSONResponse({"status": status})
+        if job is None:
+            return JSONResponse({"status": "unknown"})
+
+        if job["status"] == "failed":
+            return JSONResponse({
+                "status": "failed",
+                "job_id": job["id"],
+                "message": f"File processing failed: {job['error'] or 'unknown error'}"
+            })
+
+        return JSONResponse({"status": job["status"], "job_id": job["id"], "chunks": job["chunk_count"]})
+
+    @app.post("/retrieve")
+    async def retrieve(retrieve_input: RetrieveInput):
+        """Matching chunks for a question, optionally restricted to some sources or metadata values"""
+        global vector_store
+
+        # Load the index first; before warm-up finishes nothing looks indexed yet
+        if vector_store is None:
+            vector_store = await run_blocking(ensure_vector_store)
+
+        if not has_documents():
+            return JSONResponse({"results": []})
+
+        retrieval_filter = build_retrieval_filter(retrieve_input.sources, retrieve_input.metadata)
+        results = await run_blocking(search_indexes, retrieve_input.question, get_chunk_store(), vector_store,
+                                     retrieve_input.top_n, retrieval_filter)
+        record_source_hits(doc for doc, _ in results)
+
+        return JSONResponse({"results": [
+            {"content": doc.page_content, "metadata": getattr(doc, "metadata", {}), "score": round(score, 5)}
+            for doc, score in results
+        ]})
 
     @app.post("/chat/{message}")
-    async def chat_with_ai(message: str):
-        """Chat endpoint for document Q&A"""
-        global all_documents, vector_store
+    async def chat_with_ai(message: str, request: Request, source: Optional[List[str]] = Query(None),
+                           metadata: Optional[str] = None):
+        """Chat endpoint for document Q&A, optionally limited to ?source=<file> and a JSON metadata filter"""
+        global vector_store
+
+        retrieval_filter = build_retrieval_filter(source, parse_metadata_filter(metadata))
+        session_id = get_chat_session(request)
         
         try:
             print(f"📩 Received query: {message}")
             
+            # Load the index first; before warm-up finishes nothing looks indexed yet
+            if vector_store is None:
+                vector_store = await run_blocking(ensure_vector_store)
+
             # Handle case when no documents are available
-            if not all_documents:
-                response = "Hello! I can help you analyze documents, images, audio files, and web content. Upload some files or add URLs to get started!"
-                return JSONResponse({"response": response})
+            if not has_documents():
+                return JSONResponse({"response": NO_DOCUMENTS_RESPONSE})
+
+            # Follow-ups like "and why is that?" are searched and cached as standalone questions
+            history = conversation_memory.history(session_id)
+            search_query = await conversation_memory.standalone_query(session_id, message)
+
+            # Near-identical questions against an unchanged corpus reuse the earlier answer
+            cache = await check_answer_cache(request, search_query, retrieval_filter)
+            if cache["answer"] is not None:
+                conversation_memory.record_turn(session_id, message, cache["answer"])
+                return JSONResponse({"response": cache["answer"], "cached": True},
+                                    headers={ANSWER_CACHE_HEADER: "hit"})
             
             # Regular chat with document search
             try:
-                print("✅ Running hybrid search for query:", message)
-                
-                if vector_store is None:
-                    vector_store = get_vector_store()
+                print("✅ Running hybrid search for query:", search_query)
                 
-                # Perform hybrid search
-                results = hybrid_search(message, all_documents, vector_store, top_n=5)
+                # Overview questions are answered from precomputed summaries; others search the chunks
+                # off the event loop so concurrent queries can be batched
+                results = select_summaries(search_query, retrieval_filter) or await ahybrid_search(
+                    search_query, get_chunk_store(), vector_store, top_n=CONTEXT_CANDIDATES, retrieval_filter=retrieval_filter
+                )
                 
                 if not results:
                     print("⚠️ No search results found")
-                    response = "I couldn't find specific information about that query in your uploaded documents. Try uploading more relevant content or rephrasing your question."
-                    return JSONResponse({"response": response})
+                    return JSONResponse({"response": NO_RESULTS_RESPONSE})
                 
                 print(f"🔍 Retrieved {len(results)} total documents for query: {message}")
+                record_source_hits(doc for doc, _ in results)
                 
-                # Create context from results
-                context = ""
-                for i, doc in enumerate(results[:3]):
-                    if hasattr(doc, 'page_content'):
-                        context += f"Document {i+1}:\n{doc.page_content}\n\n"
-                    else:
-                        context += f"Document {i+1}:\n{str(doc)}\n\n"
+                # Deduplicated, merged and packed to the token budget
+                context = format_context(pack_context(results))
                 
                 # Generate response using Gemini
-                response_text = generate_response_with_gemini(message, context)
-                return JSONResponse({"response": response_text})
+                response_text = await agenerate_response_with_gemini(message, context, history)
+                remember_answer(cache, search_query, response_text)
+                if not response_text.startswith(GENERATION_ERROR_MESSAGE):
+                    conversation_memory.record_turn(session_id, message, response_text)
+                return JSONResponse({"response": response_text}, headers={ANSWER_CACHE_HEADER: cache["state"]})
                     
             except Exception as e:
                 print(f"❌ Search error: {e}")
@@ -476,4 +1141,85 @@ def create_doc_qna_routes(app: FastAPI):
                 status_code=500
             )
 
+    @app.post("/chat-stream/{message}")
+    async def chat_with_ai_stream(message: str, request: Request, source: Optional[List[str]] = Query(None),
+                                  metadata: Optional[str] = None):
+        """Stream retrieval metadata first, then answer tokens as server-sent events"""
+        global vector_store
+
+        retrieval_filter = build_retrieval_filter(source, parse_metadata_filter(metadata))
+        # Resolved before streaming starts so a new session cookie goes out with the headers
+        session_id = get_chat_session(request)
+        headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+        print(f"📩 Received streaming query: {message}")
+        started = time.perf_counter()
+
+        # Load the index first; before warm-up finishes nothing looks indexed yet
+        if vector_store is None:
+            vector_store = await run_blocking(ensure_vector_store)
+
+        cache = history = search_query = None
+        if has_documents():
+            history = conversation_memory.history(session_id)
+            search_query = await conversation_memory.standalone_query(session_id, message)
+            # Looked up before the response starts, so the X-Answer-Cache header can report it
+            cache = await check_answer_cache(request, search_query, retrieval_filter)
+            headers[ANSWER_CACHE_HEADER] = cache["state"]
+
+        async def event_stream():
+            if cache is None:
+                yield format_sse("token", {"text": NO_DOCUMENTS_RESPONSE})
+                yield format_sse("done", {})
+                return
+
+            if cache["answer"] is not None:
+                conversation_memory.record_turn(session_id, message, cache["answer"])
+                yield format_sse("metadata", {"sources": [], "cached": True})
+                yield format_sse("token", {"text": cache["answer"]})
+                yield format_sse("done", {})
+                return
+
+            try:
+                results = select_summaries(search_query, retrieval_filter) or await ahybrid_search(
+                    search_query, get_chunk_store(), vector_store, top_n=CONTEXT_CANDIDATES, retrieval_filter=retrieval_filter
+                )
+            except Exception as e:
+                print(f"❌ Search error: {e}")
+                results = []
+
+            if not results:
+                yield format_sse("token", {"text": NO_RESULTS_RESPONSE})
+                yield format_sse("done", {})
+                return
+
+            record_source_hits(doc for doc, _ in results)
+            blocks = pack_context(results)
+            sources = context_sources(blocks)
+
+            yield format_sse("metadata", {
+                "sources": sources,
+                "retrieval_ms": round((time.perf_counter() - started) * 1000),
+                "cached": False
+            })
+
+            answer = ""
+            try:
+                prompt = build_answer_prompt(message, format_context(blocks), history)
+                async for chunk in llm.astream(prompt):
+                    text = chunk.content if hasattr(chunk, "content") else str(chunk)
+                    if text:
+                        answer += text
+                        yield format_sse("token", {"text": text})
+                remember_answer(cache, search_query, answer)
+                if answer:
+                    conversation_memory.record_turn(session_id, message, answer)
+            except Exception as e:
+                print(f"Error streaming response: {e}")
+                yield format_sse("error", {"message": GENERATION_ERROR_MESSAGE})
+
+            yield format_sse("done", {})
+
+        return StreamingResponse(event_stream(), media_type="text/event-stream", headers=headers)
+
     return app
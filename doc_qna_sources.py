@@ -0,0 +1,260 @@
+import os
+import json
+import threading
+import time
+from typing import Dict, List, Iterable, Optional
+
+# Eviction policy - all values can be tuned through the environment
+SOURCE_TTL_SECONDS = int(os.getenv("DOC_QNA_SOURCE_TTL_SECONDS", str(24 * 3600)))
+SOURCE_IDLE_SECONDS = int(os.getenv("DOC_QNA_SOURCE_IDLE_SECONDS", str(6 * 3600)))
+INDEX_BUDGET_BYTES = int(os.getenv("DOC_QNA_INDEX_BUDGET_MB", "512")) * 1024 * 1024
+EVICTION_INTERVAL_SECONDS = int(os.getenv("DOC_QNA_EVICTION_INTERVAL_SECONDS", "300"))
+
+# source_id -> {"bytes": int, "added_at": float, "last_hit": float, "namespaces": set}
+# A source's chunk ids are looked up in the chunk store's source column when it is evicted
+source_registry: Dict[str, Dict] = {}
+registry_lock = threading.Lock()
+
+# sha256 of uploaded content -> source_id that holds its chunks
+content_hashes: Dict[str, str] = {}
+# Alternate names (e.g. re-uploaded filenames) -> source_id
+source_aliases: Dict[str, str] = {}
+# Uploaded files are keyed by name and content hash, so same-named files stay apart; source_id -> file name
+source_names: Dict[str, str] = {}
+# source_id -> namespaces its content was attached to by reference, possibly before it was indexed
+attached_namespaces: Dict[str, set] = {}
+# Aliases, attached namespaces and the names and hashes of sources (some only share chunks, so the chunk
+# columns can't hold them) are written here whenever they change
+_catalog_lock = threading.Lock()
+
+# Bumped whenever chunks are added to or removed from the indexes
+corpus_version = 0
+
+
+def estimate_chunk_bytes(doc, embedding_dim: int) -> int:
+    """Approximate memory held by one chunk across the dense and sparse indexes"""
+    text_bytes = len(doc.page_content.encode("utf-8"))
+    # Text is held once in the docstore and once tokenized for BM25
+    return 2 * text_bytes + embedding_dim * 4
+
+
+def register_chunks(source_id: str, documents: List, embedding_dim: int, namespace: str = "public"):
+    """Account a source's newly indexed chunks for eviction"""
+    global corpus_version
+
+    now = time.time()
+    added_bytes = sum(estimate_chunk_bytes(doc, embedding_dim) for doc in documents)
+
+    with registry_lock:
+        corpus_version += 1
+        entry = source_registry.setdefault(source_id, {
+            "bytes": 0,
+            "added_at": now,
+            "last_hit": now,
+            "namespaces": set(),
+        })
+        entry["namespaces"].add(namespace)
+        entry["namespaces"].update(attached_namespaces.get(source_id, ()))
+        entry["bytes"] += added_bytes
+        entry["last_hit"] = now
+
+
+def rebuild_registry(chunk_store, embedding_dim: int, catalog_path: Optional[str] = None):
+    """Rebuild the registry from the chunk store's columns, without materializing a Document per chunk,
+    and the saved catalog for what the columns don't hold"""
+    global corpus_version
+
+    stats = chunk_store.source_stats()
+    catalog = {}
+    if catalog_path and os.path.exists(catalog_path):
+        try:
+            with open(catalog_path, encoding="utf-8") as f:
+                catalog = json.load(f)
+        except ValueError as e:
+            print(f"⚠️ Could not read the source catalog: {e}")
+
+    now = time.time()
+    with registry_lock:
+        source_registry.clear()
+        content_hashes.clear()
+        source_aliases.clear()
+        source_names.clear()
+        attached_namespaces.clear()
+        corpus_version += 1
+
+        # Only entries of sources still indexed are kept
+        for alias, source_id in catalog.get("aliases", {}).items():
+            if source_id in stats:
+                source_aliases[alias] = source_id
+        for source_id, name in catalog.get("names", {}).items():
+            if source_id in stats:
+                source_names[source_id] = name
+        for digest, source_id in catalog.get("content_hashes", {}).items():
+            if source_id in stats:
+                content_hashes[digest] = source_id
+        for source_id, namespaces in catalog.get("attached_namespaces", {}).items():
+            if source_id in stats:
+                attached_namespaces[source_id] = set(namespaces)
+
+        for source_id, source in stats.items():
+            added_at = source["timestamp"] if source["timestamp"] is not None else now
+            source_registry[source_id] = {
+                # estimate_chunk_bytes summed over the source's chunks
+                "bytes": 2 * source["text_bytes"] + source["chunks"] * embedding_dim * 4,
+                "added_at": added_at,
+                "last_hit": added_at,
+                "namespaces": {source["namespace"] or "public", *attached_namespaces.get(source_id, ())},
+            }
+            # Content hash and file name come from one chunk of the source's own
+            if source["first"] is not None:
+                metadata = chunk_store.metadata(source["first"])
+                if metadata.get("content_hash"):
+                    content_hashes[metadata["content_hash"]] = source_id
+                if metadata.get("filename"):
+                    source_names[source_id] = metadata["filename"]
+
+    print(f"📚 Source registry rebuilt with {len(stats)} sources")
+
+
+def save_source_catalog(path: str):
+    """Write aliases, attached namespaces, source names and content hashes for rebuild_registry"""
+    with registry_lock:
+        data = json.dumps({
+            "aliases": source_aliases,
+            "names": source_names,
+            "content_hashes": content_hashes,
+            "attached_namespaces": {source_id: sorted(ns) for source_id, ns in attached_namespaces.items()},
+        })
+    with _catalog_lock:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        staging = f"{path}.tmp"
+        with open(staging, "w", encoding="utf-8") as f:
+            f.write(data)
+        os.replace(staging, path)
+
+
+def record_source_hits(documents: Iterable):
+    """Mark the sources of retrieved documents as recently used"""
+    now = time.time()
+    with registry_lock:
+        for doc in documents:
+            source_id = getattr(doc, "metadata", {}).get("source")
+            if source_id in source_registry:
+                source_registry[source_id]["last_hit"] = now
+
+
+def select_sources_to_evict(now: Optional[float] = None) -> List[str]:
+    """Pick sources past their TTL, idle too long, or least recently used over the memory budget"""
+    now = now or time.time()
+
+    with registry_lock:
+        expired = [
+            source_id for source_id, entry in source_registry.items()
+            if now - entry["added_at"] > SOURCE_TTL_SECONDS
+            or now - entry["last_hit"] > SOURCE_IDLE_SECONDS
+        ]
+
+        remaining = sorted(
+            (item for item in source_registry.items() if item[0] not in expired),
+            key=lambda item: item[1]["last_hit"]
+        )
+        total_bytes = sum(entry["bytes"] for _, entry in remaining)
+
+        over_budget = []
+        for source_id, entry in remaining:
+            if total_bytes <= INDEX_BUDGET_BYTES:
+                break
+            over_budget.append(source_id)
+            total_bytes -= entry["bytes"]
+
+    return expired + over_budget
+
+
+def forget_source(source_id: str):
+    """Drop a source, its content hashes and aliases from the registry"""
+    global corpus_version
+
+    with registry_lock:
+        entry = source_registry.pop(source_id, None)
+        if entry is not None:
+            corpus_version += 1
+        for digest in [d for d, owner in content_hashes.items() if owner == source_id]:
+            del content_hashes[digest]
+        for alias in [a for a, owner in source_aliases.items() if owner == source_id]:
+            del source_aliases[alias]
+        source_names.pop(source_id, None)
+        attached_namespaces.pop(source_id, None)
+
+
+def claim_content_hash(digest: str, source_id: str) -> Optional[str]:
+    """Return the source already holding this content, or claim the hash for source_id"""
+    with registry_lock:
+        existing = content_hashes.get(digest)
+        if existing is not None:
+            return existing
+        content_hashes[digest] = source_id
+        return None
+
+
+def release_content_hash(digest: str):
+    """Forget a claimed hash whose ingestion failed"""
+    with registry_lock:
+        content_hashes.pop(digest, None)
+
+
+def attach_source(source_id: str, alias: str, namespace: str):
+    """Attach existing content to a namespace under another name without re-ingesting it"""
+    with registry_lock:
+        if alias != source_id:
+            source_aliases[alias] = source_id
+        # Kept apart from the registry entry, which doesn't exist until the first chunks are indexed
+        attached_namespaces.setdefault(source_id, set()).add(namespace)
+        entry = source_registry.get(source_id)
+        if entry is not None:
+            entry["namespaces"].add(namespace)
+            entry["last_hit"] = time.time()
+
+
+def aliases_of(source_id: str) -> List[str]:
+    """Names other uploads attached to a source's content under"""
+    with registry_lock:
+        return [alias for alias, owner in source_aliases.items() if owner == source_id]
+
+
+def resolve_source(name: str) -> str:
+    """Map an alias back to the source that holds the chunks"""
+    with registry_lock:
+        return source_aliases.get(name, name)
+
+
+def file_source_id(filename: str, digest: Optional[str]) -> str:
+    """Source id of an uploaded file: its name plus a prefix of its content hash"""
+    return f"{filename}#{digest[:12]}" if digest else filename
+
+
+def name_source(source_id: str, name: str):
+    """Remember the file name behind a source id, for filters and status lookups by name"""
+    if name != source_id:
+        with registry_lock:
+            source_names[source_id] = name
+
+
+def source_name(source_id: str) -> str:
+    with registry_lock:
+        return source_names.get(source_id, source_id)
+
+
+def resolve_sources(names: Iterable[str]) -> List[str]:
+    """Source ids behind user-facing names: ids themselves, aliases, and every file uploaded under a name"""
+    with registry_lock:
+        resolved = set()
+        for name in names:
+            resolved.add(source_aliases.get(name, name))
+            resolved.update(source_id for source_id, file_name in source_names.items() if file_name == name)
+        return sorted(resolved)
+
+
+def get_corpus_version() -> int:
+    """Version of the indexed corpus, for caches derived from it"""
+    with registry_lock:
+        return corpus_version
@@ -0,0 +1,300 @@
+import os
+import re
+import json
+import time
+import threading
+import concurrent.futures
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from langchain.schema import Document
+
+from doc_qna_chunking import count_tokens
+from doc_qna_memory import truncate_to_tokens
+
+SUMMARY_ENABLED = os.getenv("DOC_QNA_SUMMARY_ENABLED", "true").lower() == "true"
+# A source is summarized once no chunks have been added to it for this long
+SUMMARY_DEBOUNCE_SECONDS = int(os.getenv("DOC_QNA_SUMMARY_DEBOUNCE_SECONDS", "10"))
+# Text given to one leaf summary, and the length of every summary, in word pieces
+SUMMARY_LEAF_TOKENS = int(os.getenv("DOC_QNA_SUMMARY_LEAF_TOKENS", "1500"))
+SUMMARY_NODE_MAX_TOKENS = int(os.getenv("DOC_QNA_SUMMARY_NODE_MAX_TOKENS", "200"))
+# Summaries combined per roll-up call; larger values mean fewer calls and shallower trees
+SUMMARY_FANIN = int(os.getenv("DOC_QNA_SUMMARY_FANIN", "8"))
+SUMMARY_WORKERS = int(os.getenv("DOC_QNA_SUMMARY_WORKERS", "4"))
+
+OVERVIEW_PATTERN = re.compile(
+    r"\b(summari[sz]e|summary|overview|outline|tl;?dr|gist|recap|main (points|ideas|topics|findings)|"
+    r"key (points|takeaways|findings)|what (is|are) (this|the|these|my) (document|file|paper|report|book|article)s? about)\b",
+    re.IGNORECASE
+)
+# Words of an overview question that say nothing about which part to summarize
+OVERVIEW_WORDS = {
+    "summarize", "summarise", "summary", "overview", "outline", "gist", "recap", "give", "provide", "write",
+    "the", "this", "that", "these", "my", "document", "documents", "file", "files", "paper", "report", "book",
+    "article", "about", "what", "main", "key", "points", "ideas", "topics", "findings", "takeaways", "please",
+    "can", "you", "brief", "short", "quick", "and", "for", "of", "in", "me", "an", "is", "are", "whole", "entire",
+}
+# Words that point at a part of a document without having to appear in its section title
+SECTION_WORDS = {"section", "sections", "chapter", "chapters", "part", "parts"}
+
+LEAF_PROMPT = """Summarize this part of {title} in at most {max_words} words.
+Keep names, numbers, definitions and conclusions. Return only the summary.
+
+{text}
+
+Summary:"""
+
+ROLLUP_PROMPT = """These are summaries of consecutive parts of {title}.
+Combine them into one summary of at most {max_words} words that keeps the most important points.
+Return only the summary.
+
+{text}
+
+Summary:"""
+
+
+def is_overview_query(query: str) -> bool:
+    """Whether a question asks for a summary rather than a specific fact"""
+    return bool(OVERVIEW_PATTERN.search(query))
+
+
+def _terms(text: str) -> set:
+    return {word for word in re.findall(r"\w+", text.lower()) if word.isdigit() or len(word) > 2}
+
+
+def _title(name: str, section: Optional[str]) -> str:
+    return f'the section "{section}" of {name}' if section else name
+
+
+class SummaryIndex:
+    """Per-source summary trees: leaf summaries of runs of chunks, rolled up by section and then for the whole document"""
+
+    def __init__(self, complete: Callable[[str], str], get_chunks: Callable[[str], List[Tuple[str, Dict]]], path: str):
+        self.complete = complete
+        self.get_chunks = get_chunks
+        self.path = path
+        self.trees: Dict[str, Dict] = {}
+        # source_id -> time of its latest added chunk, for sources waiting to be (re)summarized
+        self.pending: Dict[str, float] = {}
+        self.building = set()
+        self.lock = threading.Lock()
+        self.saving = threading.Lock()
+        self.stats = {"built": 0, "failed": 0, "llm_calls": 0, "answered": 0}
+
+    # -- building --
+
+    def schedule(self, source_id: str):
+        """Summarize a source after its ingestion goes quiet; called on every batch of added chunks"""
+        if SUMMARY_ENABLED:
+            with self.lock:
+                self.pending[source_id] = time.time()
+
+    def forget(self, source_id: str):
+        with self.lock:
+            self.pending.pop(source_id, None)
+            self.building.discard(source_id)
+            removed = self.trees.pop(source_id, None) is not None
+        if removed:
+            self.save()
+
+    def _summarize(self, prompt: str, title: str, text: str) -> str:
+        self.stats["llm_calls"] += 1
+        summary = self.complete(prompt.format(title=title, max_words=SUMMARY_NODE_MAX_TOKENS * 2 // 3, text=text))
+        return truncate_to_tokens(summary.strip(), SUMMARY_NODE_MAX_TOKENS)
+
+    def _leaves(self, chunks: List[Tuple[str, Dict]]) -> List[Dict]:
+        """Runs of consecutive chunks, split where the section changes or the leaf budget is reached"""
+        tokens = count_tokens([text for text, _ in chunks])
+
+        # Every chunk lands in a leaf whole, so large sources get more leaves rather than lose text
+        leaves, current = [], None
+        for (text, metadata), count in zip(chunks, tokens):
+            section, page = metadata.get("section"), metadata.get("page")
+            if current is None or current["section"] != section or current["tokens"] + count > SUMMARY_LEAF_TOKENS:
+                current = {"section": section, "texts": [], "tokens": 0, "pages": [page, page]}
+                leaves.append(current)
+            current["texts"].append(text)
+            current["tokens"] += count
+            if page is not None:
+                current["pages"] = [page if current["pages"][0] is None else current["pages"][0], page]
+        return leaves
+
+    def _roll_up(self, pool, name: str, nodes: List[Dict], section: Optional[str], new_node) -> Dict:
+        """Combine nodes SUMMARY_FANIN at a time until one is left"""
+        while len(nodes) > 1:
+            groups = [nodes[i:i + SUMMARY_FANIN] for i in range(0, len(nodes), SUMMARY_FANIN)]
+            # A node left over on its own moves up a level without another call
+            merged = [group for group in groups if len(group) > 1]
+            texts = ["\n\n".join(node["text"] for node in group) for group in merged]
+            summaries = dict(zip(map(id, merged), pool.map(
+                lambda text: self._summarize(ROLLUP_PROMPT, _title(name, section), text), texts
+            )))
+            nodes = [
+                new_node(summaries[id(group)], section, group) if id(group) in summaries else group[0]
+                for group in groups
+            ]
+        return nodes[0]
+
+    def build(self, source_id: str):
+        """Summarize a source's chunks bottom-up and keep the tree if the source wasn't evicted meanwhile"""
+        chunks = self.get_chunks(source_id)
+        if not chunks:
+            return
+
+        started = time.time()
+        nodes: List[Dict] = []
+        # Uploaded files are summarized under their name rather than their source id
+        name = chunks[0][1].get("filename") or source_id
+
+        def new_node(text: str, section: Optional[str], children: List[Dict], pages=None) -> Dict:
+            if children:
+                starts = [child["pages"][0] for child in children if child["pages"] and child["pages"][0] is not None]
+                ends = [child["pages"][1] for child in children if child["pages"] and child["pages"][1] is not None]
+                pages = [min(starts), max(ends)] if starts else None
+            node = {
+                "id": len(nodes),
+                "level": 1 + max((child["level"] for child in children), default=-1),
+                "section": section,
+                "pages": pages,
+                "text": text,
+                "children": [child["id"] for child in children],
+            }
+            nodes.append(node)
+            return node
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=SUMMARY_WORKERS) as pool:
+            leaves = self._leaves(chunks)
+            texts = ["\n".join(leaf["texts"]) for leaf in leaves]
+            summaries = list(pool.map(
+                lambda item: self._summarize(LEAF_PROMPT, _title(name, item[0]["section"]), item[1]),
+                zip(leaves, texts)
+            ))
+            leaf_nodes = [new_node(summary, leaf["section"], [], leaf["pages"]) for leaf, summary in zip(leaves, summaries)]
+
+            # Consecutive leaves of one section roll up into that section's node
+            sections: List[List[Dict]] = []
+            for node in leaf_nodes:
+                if sections and sections[-1][0]["section"] == node["section"]:
+                    sections[-1].append(node)
+                else:
+                    sections.append([node])
+            section_nodes = [self._roll_up(pool, name, group, group[0]["section"], new_node) for group in sections]
+            root = self._roll_up(pool, name, section_nodes, None, new_node)
+
+        with self.lock:
+            if source_id not in self.building:
+                return
+            self.trees[source_id] = {
+                "root": root["id"], "nodes": nodes, "name": name, "chunks": len(chunks), "built_at": time.time()
+            }
+        self.save()
+        self.stats["built"] += 1
+        print(f"🌳 Summary tree for {source_id}: {len(leaf_nodes)} leaves, {len(nodes)} nodes "
+              f"in {time.time() - started:.1f}s")
+
+    def run(self):
+        """Background loop that summarizes sources whose ingestion has finished"""
+        while True:
+            time.sleep(1)
+            with self.lock:
+                now = time.time()
+                ready = [source_id for source_id, added in self.pending.items() if now - added >= SUMMARY_DEBOUNCE_SECONDS]
+                for source_id in ready:
+                    del self.pending[source_id]
+                    self.building.add(source_id)
+
+            for source_id in ready:
+                try:
+                    self.build(source_id)
+                except Exception as e:
+                    print(f"❗ Summarizing {source_id} failed: {e}")
+                    self.stats["failed"] += 1
+                finally:
+                    with self.lock:
+                        self.building.discard(source_id)
+
+    # -- files --
+
+    def save(self):
+        # The summary thread and eviction both save; one at a time, so the latest trees are written last
+        with self.saving:
+            with self.lock:
+                data = json.dumps(self.trees)
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            staging = f"{self.path}.tmp"
+            with open(staging, "w", encoding="utf-8") as f:
+                f.write(data)
+            os.replace(staging, self.path)
+
+    def load(self, sources: Iterable[str]):
+        """Read saved trees for the sources still indexed and queue the ones that have none"""
+        trees = {}
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, encoding="utf-8") as f:
+                    trees = json.load(f)
+            except ValueError as e:
+                print(f"⚠️ Could not read summary trees: {e}")
+
+        sources = set(sources)
+        with self.lock:
+            self.trees = {source_id: tree for source_id, tree in trees.items() if source_id in sources}
+        for source_id in sources - set(self.trees):
+            self.schedule(source_id)
+        print(f"🌳 Loaded {len(self.trees)} summary trees")
+
+    # -- answering --
+
+    def select(self, query: str, sources: Optional[List[str]] = None) -> List[Tuple[Document, float]]:
+        """Summary nodes for an overview question: the sections it names, or document roots if it names nothing.
+
+        A question with words that no section title covers (e.g. "summary statistics of column X") gets
+        nothing here and goes to the chunk search instead."""
+        terms = _terms(query) - OVERVIEW_WORDS
+        required = terms - SECTION_WORDS
+        with self.lock:
+            trees = {
+                source_id: tree for source_id, tree in self.trees.items()
+                if sources is None or source_id in sources
+            }
+
+        results = []
+        for source_id, tree in sorted(trees.items(), key=lambda item: item[1]["built_at"], reverse=True):
+            matches = []
+            if required:
+                for node in tree["nodes"]:
+                    if node["section"]:
+                        section_terms = _terms(node["section"])
+                        if required <= section_terms:
+                            matches.append((len(terms & section_terms), node["level"], node))
+            if matches:
+                best = max(overlap for overlap, _, _ in matches)
+                # Among nodes naming the section equally well, the highest one covers all of it
+                top = max(level for overlap, level, _ in matches if overlap == best)
+                chosen = [(node, float(best)) for overlap, level, node in matches if overlap == best and level == top]
+            elif required:
+                # The question is about something this document has no section for
+                chosen = []
+            else:
+                chosen = [(tree["nodes"][tree["root"]], 0.0)]
+
+            for node, score in chosen:
+                metadata = {"source": source_id, "summary_level": node["level"]}
+                if tree.get("name", source_id) != source_id:
+                    metadata["filename"] = tree["name"]
+                if node["section"]:
+                    metadata["section"] = node["section"]
+                results.append((Document(page_content=node["text"], metadata=metadata), score))
+
+        if results:
+            self.stats["answered"] += 1
+        return sorted(results, key=lambda item: item[1], reverse=True)
+
+    def get_stats(self) -> Dict:
+        with self.lock:
+            return {
+                **self.stats,
+                "trees": len(self.trees),
+                "nodes": sum(len(tree["nodes"]) for tree in self.trees.values()),
+                "pending": len(self.pending),
+                "building": len(self.building),
+            }
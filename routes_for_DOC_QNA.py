@@ -317,7 +317,7 @@ def get_text_splitter():
         separators=["\n\n", "\n", ". ", " ", ""]
     )
 
-def hybrid_search(query, all_splits, vector_store, top_n=10):
+def hybrid_search(query, all_splits, vector_store, top_n=10, expand=True):
     """Enhanced hybrid search with better URL content handling."""
     global bm25_index, tokenized_corpus
 
@@ -327,9 +327,12 @@ def hybrid_search(query, all_splits, vector_store, top_n=10):
     print(f"🔍 Retrieved documents for query: {query}")
 
     try:
-        # Query Expansion
-        expanded_query = llm.invoke(f"Expand this search query while maintaining its core meaning: '{query}'")
-        expanded_query = expanded_query.content if hasattr(expanded_query, "content") else str(expanded_query)
+        # Query Expansion costs an extra LLM call, so the fast path searches the question as asked
+        if expand:
+            expanded_query = llm.invoke(f"Expand this search query while maintaining its core meaning: '{query}'")
+            expanded_query = expanded_query.content if hasattr(expanded_query, "content") else str(expanded_query)
+        else:
+            expanded_query = query
 
         results = []
         
@@ -359,42 +362,56 @@ def hybrid_search(query, all_splits, vector_store, top_n=10):
         return []
 
 # LangGraph components
-from langgraph.graph import MessagesState, StateGraph
+from langgraph.graph import MessagesState, StateGraph, END
 from langchain_core.tools import tool
 from langchain_core.messages import ToolMessage, SystemMessage, AIMessage, HumanMessage
-from langgraph.prebuilt import ToolNode
+from langgraph.prebuilt import ToolNode, tools_condition
 
 graph_builder = StateGraph(MessagesState)
 
+# Chunks given to the answer prompt, in full
+CONTEXT_TOP_K = 3
+
+# Messages the agent may answer without searching; every other question takes the fast path
+SMALL_TALK_PATTERN = re.compile(
+    r"^\s*(hi|hello|hey|thanks|thank you|ok|okay|bye|good (morning|afternoon|evening)|who are you|what can you do)\b[\s!.?]*$",
+    re.IGNORECASE
+)
+
+def build_context(docs) -> str:
+    """Number retrieved chunks for the prompt, keeping their full text"""
+    context = ""
+    for i, doc in enumerate(docs):
+        content = doc.page_content if hasattr(doc, 'page_content') else str(doc)
+        context += f"Document {i+1}:\n{content}\n\n"
+    return context
+
 @tool
 def retrieve(query: str):
     """Retrieves most relevant information using hybrid search."""
     global all_documents, vector_store
 
     if not all_documents:
-        return ToolMessage(content="No documents available. Please upload a document first.", name="retrieve")
+        return "No documents available. Please upload a document first."
 
     if vector_store is None:
         vector_store = get_vector_store()
 
-    all_splits = all_documents[:]
-    retrieved_docs = hybrid_search(query, all_splits, vector_store, top_n=10)
+    # The tool call already carries a search query, so it isn't expanded again
+    retrieved_docs = hybrid_search(query, all_documents, vector_store, top_n=CONTEXT_TOP_K, expand=False)
 
     print(f"🔎 Retrieved Docs Count: {len(retrieved_docs)}")
 
     if not retrieved_docs:
-        return ToolMessage(content="No relevant documents found.", name="retrieve")
-
-    sources = [f"{i+1}. {doc.page_content[:300]}..." for i, doc in enumerate(retrieved_docs)]
-    content = "\n".join(sources)
+        return "No relevant documents found."
 
-    return ToolMessage(content=content, name="retrieve")
+    return build_context(retrieved_docs)
 
 def query_or_respond(state: MessagesState):
     """Generate tool call for retrieval or respond."""
     llm_with_tools = llm.bind_tools([retrieve])
     response = llm_with_tools.invoke(state["messages"])
-    return {"messages": state["messages"] + [response]}
+    return {"messages": [response]}
 
 tools = ToolNode([retrieve])
 
@@ -418,6 +435,24 @@ def generate(state: MessagesState):
     final_answer = generate_response_with_gemini(user_query, context)
     return {"messages": [AIMessage(content=final_answer)]}
 
+graph_builder.add_node(query_or_respond)
+graph_builder.add_node(tools)
+graph_builder.add_node(generate)
+graph_builder.set_entry_point("query_or_respond")
+graph_builder.add_conditional_edges("query_or_respond", tools_condition, {END: END, "tools": "tools"})
+graph_builder.add_edge("tools", "generate")
+graph_builder.add_edge("generate", END)
+graph = graph_builder.compile()
+
+def needs_agent(message: str) -> bool:
+    """Route to the tool-calling agent only when the message may not need a search"""
+    return bool(SMALL_TALK_PATTERN.match(message))
+
+def run_agent(message: str) -> str:
+    """Full agent loop: one call to decide, and a search plus a generation call only if it asks for one"""
+    state = graph.invoke({"messages": [HumanMessage(content=message)]})
+    return state["messages"][-1].content
+
 # Store file processing status
 processing_status = {}
 
@@ -663,7 +698,11 @@ async def chat_with_ai(message: str):
             
             return JSONResponse({"response": response})
         
-        # Regular chat with document search
+        # Greetings and the like go through the agent, which can answer without a search
+        if needs_agent(message):
+            return JSONResponse({"response": run_agent(message)})
+
+        # Fast path: search directly and make a single generation call
         try:
             print("✅ Running hybrid search for query:", message)
             
@@ -671,7 +710,7 @@ async def chat_with_ai(message: str):
                 vector_store = get_vector_store()
             
             # Perform hybrid search
-            results = hybrid_search(message, all_documents, vector_store, top_n=5)
+            results = hybrid_search(message, all_documents, vector_store, top_n=5, expand=False)
             
             if not results:
                 print("⚠️ No search results found")
@@ -684,12 +723,7 @@ async def chat_with_ai(message: str):
             print(f"🔍 Retrieved {len(results)} total documents for query: {message}")
             
             # Create context from results
-            context = ""
-            for i, doc in enumerate(results[:3]):
-                if hasattr(doc, 'page_content'):
-                    context += f"Document {i+1}:\n{doc.page_content}\n\n"
-                else:
-                    context += f"Document {i+1}:\n{str(doc)}\n\n"
+            context = build_context(results[:CONTEXT_TOP_K])
             
             # Generate response using Gemini
             response_text = generate_response_with_gemini(message, context)